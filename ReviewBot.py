@@ -9,6 +9,8 @@ from typing import Generator, List, Optional, Tuple, Union
 import cmdln
 from collections import namedtuple
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 from osclib.cache import Cache
 from osclib.core import action_is_patchinfo
 from osclib.core import devel_project_fallback
@@ -17,6 +19,7 @@ from osclib.core import maintainers_get
 from osclib.core import package_role_expand
 from osclib.core import request_action_key
 from osclib.core import request_age
+from osclib.core import request_list_paginated
 from osclib.memoize import memoize
 from osclib.memoize import memoize_session_reset
 import scm
@@ -28,6 +31,7 @@ import yaml
 from lxml import etree as ET
 
 from osc import conf
+import osc.connection
 import osc.core
 from urllib.error import HTTPError, URLError
 
@@ -70,6 +74,10 @@ class ReviewChoices(Enum):
     FALLBACK_ALWAYS = 'fallback-always'
 
 
+class CheckSerially(Exception):
+    """Raised by check_serially() in worker processes."""
+
+
 class ReviewBot(object):
     """
     A generic obs request reviewer
@@ -85,6 +93,12 @@ class ReviewBot(object):
         ReviewChoices.ACCEPT_ONPASS, ReviewChoices.FALLBACK_ONFAIL, ReviewChoices.FALLBACK_ALWAYS
     )
 
+    # Whether requests may be checked in worker processes (see --workers).
+    # Checkers writing to OBS or other services other than through
+    # comment_write(), add_review() and change_review_state() must either
+    # call check_serially() before such a write or disable this.
+    CONCURRENT_CHECKS = True
+
     COMMENT_MARKER_REGEX = re.compile(r'<!-- (?P<bot>[^ ]+) state=(?P<state>[^ ]+)(?: result=(?P<result>[^ ]+))? -->')
 
     # map of default config entries
@@ -141,6 +155,10 @@ class ReviewBot(object):
         self.lookup = PackageLookup(self.platform)
 
         self.staging_apis = {}
+        # number of processes checking requests concurrently
+        self.workers = 1
+        # writes collected by workers for the committer as (method, kwargs)
+        self.writes_deferred = None
 
         self.load_config()
 
@@ -247,46 +265,108 @@ class ReviewBot(object):
 
         # give implementations a chance to do something before single requests
         self.prepare_review()
-        return_value = 0
 
+        if self.workers > 1 and len(self.requests) > 1:
+            if self.CONCURRENT_CHECKS:
+                return self.check_requests_concurrent()
+            self.logger.warning(f'{self.bot_name} does not support concurrent checks, checking serially')
+
+        return_value = 0
         for req in self.requests:
-            self.logger.info(f"checking {req.reqid}")
-            self.request = req
-
-            # XXX: this is a hack. Annotating the request with staging_project.
-            # OBS itself should provide an API for that but that's currently not the case
-            # https://github.com/openSUSE/openSUSE-release-tools/pull/2377
-            if not hasattr(req, 'staging_project'):
-                staging_project = None
-                for r in req.reviews:
-                    if r.state == 'new' and r.by_project and ":Staging:" in r.by_project:
-                        staging_project = r.by_project
-                        break
-                setattr(req, 'staging_project', staging_project)
+            good, failed = self.check_request(req)
+            if failed:
+                return_value = 1
 
-            try:
-                good = self.check_one_request(req)
-            except Exception:
-                good = None
+            self.check_request_commit(req, good)
 
-                import traceback
-                traceback.print_exc()
-                return_value = 1
+        return return_value
 
-            if self.review_mode == ReviewChoices.NO:
-                good = None
-            elif self.review_mode == ReviewChoices.ACCEPT:
-                good = True
+    def check_requests_concurrent(self):
+        """Check requests in forked worker processes and commit in order.
 
-            if good is None:
-                self.logger.info(f"{req.reqid} ignored")
-            elif good:
-                self._set_review(req, 'accepted')
-            elif self.review_mode != ReviewChoices.ACCEPT_ONPASS:
-                self._set_review(req, 'declined')
+        Each worker is a copy of the checker so per-request state, including
+        the working directory changed by some checkers, is isolated from the
+        other workers. Workers do not write to OBS. Their comments, added
+        reviews and review changes are deferred and committed by this process
+        in the order of the requests. Requests needing other writes while
+        being checked are checked again by this process instead.
+        """
+        return_value = 0
+
+        # Workers inherit the checker instead of receiving it pickled.
+        ReviewBot.check_worker = self
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(self.workers, mp_context=context,
+                                 initializer=check_request_worker_init) as executor:
+            futures = [executor.submit(check_request_worker, i) for i in range(len(self.requests))]
 
+            for req, future in zip(self.requests, futures):
+                try:
+                    good, failed, review_messages, writes = future.result()
+                except Exception:
+                    # None of the writes of the worker have been applied.
+                    good, failed, review_messages, writes = None, True, self.review_messages, []
+
+                    import traceback
+                    traceback.print_exc()
+
+                if writes is None:
+                    self.logger.info(f'checking {req.reqid} again serially')
+                    good, failed = self.check_request(req)
+                else:
+                    self.request = req
+                    self.review_messages = review_messages
+                    for method, kwargs in writes:
+                        getattr(self, method)(**kwargs)
+
+                if failed:
+                    return_value = 1
+
+                self.check_request_commit(req, good)
+
+        ReviewBot.check_worker = None
         return return_value
 
+    def check_request(self, req):
+        """Check a single request and return the result and whether it failed."""
+        self.logger.info(f"checking {req.reqid}")
+        self.request = req
+
+        # XXX: this is a hack. Annotating the request with staging_project.
+        # OBS itself should provide an API for that but that's currently not the case
+        # https://github.com/openSUSE/openSUSE-release-tools/pull/2377
+        if not hasattr(req, 'staging_project'):
+            staging_project = None
+            for r in req.reviews:
+                if r.state == 'new' and r.by_project and ":Staging:" in r.by_project:
+                    staging_project = r.by_project
+                    break
+            setattr(req, 'staging_project', staging_project)
+
+        try:
+            return self.check_one_request(req), False
+        except CheckSerially:
+            raise
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+            return None, True
+
+    def check_request_commit(self, req, good):
+        """Change the review of a checked request according to the review mode."""
+        if self.review_mode == ReviewChoices.NO:
+            good = None
+        elif self.review_mode == ReviewChoices.ACCEPT:
+            good = True
+
+        if good is None:
+            self.logger.info(f"{req.reqid} ignored")
+        elif good:
+            self._set_review(req, 'accepted')
+        elif self.review_mode != ReviewChoices.ACCEPT_ONPASS:
+            self._set_review(req, 'declined')
+
     @memoize(session=True)
     def request_override_check_users(self, project: str) -> List[str]:
         """Determine users allowed to override review in a comment command."""
@@ -392,6 +472,19 @@ class ReviewBot(object):
     # Normally a declined review will automatically be reopened along with the
     # request and any other bot reviews already added will not be touched unless
     # the issuing bot is rerun which does not fit normal workflow.
+    def change_review_state(self, req, newstate, message, **kwargs):
+        """Change the review state via the platform, deferred in worker processes."""
+        if self.writes_deferred is not None:
+            self.writes_deferred.append(('change_review_state', dict(req=req, newstate=newstate, message=message, **kwargs)))
+            return
+        return self.platform.change_review_state(req=req, newstate=newstate, message=message, **kwargs)
+
+    def check_serially(self):
+        """Call before writes which can not be deferred to check the request
+        again in the main process when checked in a worker process."""
+        if self.writes_deferred is not None:
+            raise CheckSerially()
+
     def add_review(self, req, by_group=None, by_user=None, by_project=None, by_package=None,
                    msg=None, allow_duplicate=False):
         query = {
@@ -424,6 +517,13 @@ class ReviewBot(object):
             key = request_action_key(self.action)
             msg = yaml.dump({key: msg}, default_flow_style=False)
 
+        self.add_review_post(u, query, msg)
+
+    def add_review_post(self, u, query, msg):
+        if self.writes_deferred is not None:
+            self.writes_deferred.append(('add_review_post', {'u': u, 'query': query, 'msg': msg}))
+            return
+
         try:
             r = osc.core.http_POST(u, data=msg)
         except HTTPError as e:
@@ -707,21 +807,31 @@ class ReviewBot(object):
     def set_request_ids_search_review(self):
         self.requests = list(self.platform.search_review(review_user=self.review_user, review_group=self.review_group))
 
+    def set_request_ids_review(self, ids):
+        """Set the requests of the given ids which still await this review."""
+        self.requests = []
+        for rqid in ids:
+            try:
+                req = self.platform.get_request(rqid, with_full_history=True)
+            except HTTPError as e:
+                if e.code != 404:
+                    raise
+                continue
+
+            if req.state.name != 'review':
+                continue
+
+            for review in req.reviews:
+                if review.state == 'new' and (
+                        (self.review_user and review.by_user == self.review_user) or
+                        (self.review_group and review.by_group == self.review_group)):
+                    self.requests.append(req)
+                    break
+
     # also used by openqabot
     def ids_project(self, project, typename):
         xpath = f"(state/@name='review' or state/@name='new') and (action/target/@project='{project}' and action/@type='{typename}')"
-        url = osc.core.makeurl(self.apiurl, ('search', 'request'),
-                               {'match': xpath,
-                                'withfullhistory': 1})
-        root = ET.parse(osc.core.http_GET(url)).getroot()
-
-        ret = []
-
-        for request in root.findall('request'):
-            req = osc.core.Request()
-            req.read(request)
-            ret.append(req)
-        return ret
+        return list(request_list_paginated(self.apiurl, xpath))
 
     def set_request_ids_project(self, project, typename):
         self.requests = self.ids_project(project, typename)
@@ -786,6 +896,18 @@ class ReviewBot(object):
                 return
             message = '\n\n'.join(self.comment_handler.lines)
 
+        if self.writes_deferred is not None:
+            self.logger.debug(f'deferring comment on {debug_key}')
+            self.writes_deferred.append(('comment_write', {
+                'state': state, 'result': result, 'project': project, 'package': package,
+                'request': None if request is self.request else request,
+                'message': message, 'identical': identical, 'only_replace': only_replace,
+                'info_extra': info_extra, 'info_extra_identical': info_extra_identical,
+                'bot_name_suffix': bot_name_suffix,
+            }))
+            self.comment_handler_remove()
+            return
+
         bot_name = self.bot_name
         if bot_name_suffix:
             bot_name = '::'.join([bot_name, bot_name_suffix])
@@ -911,6 +1033,21 @@ class CommentFromLogHandler(logging.Handler):
         self.lines.append(record.getMessage())
 
 
+def check_request_worker_init():
+    # Connections must not be shared with the parent process.
+    osc.connection.CONNECTION_POOLS.clear()
+
+
+def check_request_worker(index):
+    checker = ReviewBot.check_worker
+    checker.writes_deferred = []
+    try:
+        good, failed = checker.check_request(checker.requests[index])
+    except CheckSerially:
+        return None, False, None, None
+    return good, failed, checker.review_messages, checker.writes_deferred
+
+
 class CommandLineInterface(cmdln.Cmdln):
     def __init__(self, *args, **kwargs):
         cmdln.Cmdln.__init__(self, args, kwargs)
@@ -939,6 +1076,8 @@ class CommandLineInterface(cmdln.Cmdln):
                           default="https://src.opensuse.org",
                           help="Base URL for git checkouts (only relevent when scm is git). The GIT_BASE_URL environment variable"
                           " overrides this option")
+        parser.add_option('--workers', type='int', default=1, metavar='N',
+                          help='number of processes checking requests concurrently')
 
         return parser
 
@@ -972,6 +1111,8 @@ class CommandLineInterface(cmdln.Cmdln):
         if self.options.fallback_group:
             self.checker.fallback_group = self.options.fallback_group
 
+        self.checker.workers = self.options.workers
+
     def setup_checker(self):
         """ reimplement this """
         user = self.options.user
@@ -1009,6 +1150,9 @@ class CommandLineInterface(cmdln.Cmdln):
         return self.checker.check_requests()
 
     @cmdln.option('-n', '--interval', metavar="minutes", type="int", help="periodic interval in minutes")
+    @cmdln.option('--amqp-prefix', metavar="PREFIX",
+                  help="check requests upon events from the message bus of PREFIX (opensuse or suse) and"
+                       " only search for all reviews every interval")
     def do_review(self, subcmd, opts, *args):
         """${cmd_name}: check requests that have the specified user or group as reviewer
 
@@ -1022,6 +1166,13 @@ class CommandLineInterface(cmdln.Cmdln):
             self.checker.set_request_ids_search_review()
             return self.checker.check_requests()
 
+        if opts.amqp_prefix:
+            def work_ids(ids):
+                self.checker.set_request_ids_review(ids)
+                return self.checker.check_requests()
+
+            return self.listener(work, work_ids, opts.interval, opts.amqp_prefix)
+
         return self.runner(work, opts.interval)
 
     @cmdln.option('-n', '--interval', metavar="minutes", type="int", help="periodic interval in minutes")
@@ -1079,6 +1230,32 @@ class CommandLineInterface(cmdln.Cmdln):
             # or caches they may contain.
             self.postoptparse()
 
+    def listener(self, workfunc, checkfunc, interval, amqp_prefix):
+        """ runs checkfunc with the ids of the requests announced as changed
+        by the message bus and the full workfunc every <interval> minutes
+        (default 60) as well as upon (re-)connecting to the bus
+        """
+        from osclib.review_listener import ReviewListener
+
+        sweeps = 0
+
+        def sweep():
+            nonlocal sweeps
+            if sweeps:
+                # Caches are kept warm between events, but reset for the sweep
+                # just like between runs of runner().
+                memoize_session_reset()
+                self.postoptparse()
+            sweeps += 1
+
+            return workfunc()
+
+        listener = ReviewListener(amqp_prefix, checkfunc, sweep, (interval or 60) * 60, self.logger)
+        try:
+            listener.run()
+        except KeyboardInterrupt:
+            listener.stop()
+
 
 if __name__ == "__main__":
     app = CommandLineInterface()
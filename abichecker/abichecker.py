@@ -2,7 +2,7 @@
 
 from pprint import pformat
 from stat import S_ISREG, S_ISLNK
-from tempfile import NamedTemporaryFile
+from tempfile import TemporaryFile, mkdtemp
 import cmdln
 import logging
 import os
@@ -18,13 +18,15 @@ from lxml import etree as ET
 
 import osc.conf
 import osc.core
-from osc.util.cpio import CpioRead
 
 from urllib.error import HTTPError
 
 import rpm
 from collections import namedtuple
+from osclib.abi_dump_cache import AbiDumpCache
 from osclib.comments import CommentAPI
+from osclib.cpio_stream import CpioError
+from osclib.cpio_stream import CpioStream
 
 from abichecker_common import CACHEDIR
 
@@ -59,9 +61,8 @@ ARCH_WHITELIST = {
         'SUSE:SLE-12:Update' :   ('i586', 'ppc64le', 's390', 's390x', 'x86_64'),
         }
 
-# Directory where download binary packages.
-DOWNLOADS = os.path.join(CACHEDIR, 'downloads')
-UNPACKDIR = os.path.join(CACHEDIR, 'unpacked')
+# Directory where abi-dumper output is kept across runs.
+DUMPDIR = os.path.join(CACHEDIR, 'dumps')
 
 so_re = re.compile(r'^(?:/usr)?/lib(?:64)?/lib([^/]+)\.so(?:\.[^/]+)?')
 debugpkg_re = re.compile(r'-debug(?:source|info)(?:-(?:32|64)bit)?$')
@@ -160,6 +161,9 @@ class ABIChecker(ReviewBot.ReviewBot):
     """ check ABI of library packages
     """
 
+    # results and logs are stored in the database while checking
+    CONCURRENT_CHECKS = False
+
     def __init__(self, *args, **kwargs):
         ReviewBot.ReviewBot.__init__(self, *args, **kwargs)
 
@@ -185,7 +189,20 @@ class ABIChecker(ReviewBot.ReviewBot):
 
         self.current_request = None
 
+        self.dump_cache = AbiDumpCache(DUMPDIR)
+        # directory of the current check for downloads, unpacked files and dumps
+        self.workdir = None
+
     def check_source_submission(self, src_project, src_package, src_rev, dst_project, dst_package):
+        # each check works in its own directory so that checks can run in parallel
+        self.workdir = mkdtemp(prefix='check-', dir=CACHEDIR)
+        try:
+            return self._check_source_submission(src_project, src_package, src_rev, dst_project, dst_package)
+        finally:
+            shutil.rmtree(self.workdir)
+            self.workdir = None
+
+    def _check_source_submission(self, src_project, src_package, src_rev, dst_project, dst_package):
 
         # happens for maintenance incidents
         if dst_project == None and src_package == 'patchinfo':
@@ -231,9 +248,6 @@ class ABIChecker(ReviewBot.ReviewBot):
             self.reports.append(report)
             return False
 
-        if os.path.exists(UNPACKDIR):
-            shutil.rmtree(UNPACKDIR)
-
         try:
             # compute list of common repos to find out what to compare
             myrepos = self.findrepos(src_project, src_srcinfo, dst_project, dst_srcinfo)
@@ -300,7 +314,7 @@ class ABIChecker(ReviewBot.ReviewBot):
 
         for mr in myrepos:
             try:
-                dst_libs, dst_libdebug = self.extract(dst_project, dst_package, dst_srcinfo, mr.dstrepo, mr.arch)
+                dst_libs, dst_libdebug, dst_dumpkeys = self.extract(dst_project, dst_package, dst_srcinfo, mr.dstrepo, mr.arch)
                 # nothing to fetch, so no libs
                 if dst_libs is None:
                     continue
@@ -313,14 +327,14 @@ class ABIChecker(ReviewBot.ReviewBot):
                 missing_debuginfo.append(str(e))
                 ret = False
                 continue
-            except FetchError as e:
+            except (FetchError, CpioError) as e:
                 self.logger.error(e)
                 if ret == True: # need to check again
                     ret = None
                 continue
 
             try:
-                src_libs, src_libdebug = self.extract(src_project, src_package, src_srcinfo, mr.srcrepo, mr.arch)
+                src_libs, src_libdebug, src_dumpkeys = self.extract(src_project, src_package, src_srcinfo, mr.srcrepo, mr.arch)
                 if src_libs is None:
                     if dst_libs:
                         self.text_summary += "*Warning*: the submission does not contain any libs anymore\n\n"
@@ -334,7 +348,7 @@ class ABIChecker(ReviewBot.ReviewBot):
                 missing_debuginfo.append(str(e))
                 ret = False
                 continue
-            except FetchError as e:
+            except (FetchError, CpioError) as e:
                 self.logger.error(e)
                 if ret == True: # need to check again
                     ret = None
@@ -369,11 +383,11 @@ class ABIChecker(ReviewBot.ReviewBot):
             # for each pair dump and compare the abi
             for old, new in pairs:
                 # abi dump of old lib
-                old_base = os.path.join(UNPACKDIR, dst_project, dst_package, mr.dstrepo, mr.arch)
-                old_dump = os.path.join(CACHEDIR, 'old.dump')
+                old_base = os.path.join(self.workdir, 'unpacked', dst_project, dst_package, mr.dstrepo, mr.arch)
+                old_dump = os.path.join(self.workdir, 'old.dump')
                 # abi dump of new lib
-                new_base = os.path.join(UNPACKDIR, src_project, src_package, mr.srcrepo, mr.arch)
-                new_dump = os.path.join(CACHEDIR, 'new.dump')
+                new_base = os.path.join(self.workdir, 'unpacked', src_project, src_package, mr.srcrepo, mr.arch)
+                new_dump = os.path.join(self.workdir, 'new.dump')
 
                 def cleanup():
                     if os.path.exists(old_dump):
@@ -389,8 +403,8 @@ class ABIChecker(ReviewBot.ReviewBot):
 
                 # run abichecker
                 if m \
-                    and self.run_abi_dumper(old_dump, old_base, old, dst_libdebug[old]) \
-                    and self.run_abi_dumper(new_dump, new_base, new, src_libdebug[new]):
+                    and self.abi_dump(old_dump, old_base, old, dst_libdebug[old], dst_dumpkeys[old], store=True) \
+                    and self.abi_dump(new_dump, new_base, new, src_libdebug[new], src_dumpkeys[new]):
                         reportfn = os.path.join(CACHEDIR, htmlreport)
                         r = self.run_abi_checker(m.group(1), old_dump, new_dump, reportfn)
                         if r is not None:
@@ -417,9 +431,6 @@ class ABIChecker(ReviewBot.ReviewBot):
 
         # upload reports
 
-        if os.path.exists(UNPACKDIR):
-            shutil.rmtree(UNPACKDIR)
-
         return ret
 
     def _maintenance_hack(self, dst_project, dst_srcinfo, myrepos):
@@ -677,15 +688,42 @@ class ABIChecker(ReviewBot.ReviewBot):
             return False
         return True
 
+    def dump_pinned(self, key):
+        """Path of a cached dump copied into the directory of the check by
+        compute_fetchlist() so that eviction can't remove it before use."""
+        return os.path.join(self.workdir, 'dumps', key + '.dump')
+
+    def abi_dump(self, output, base, filename, debuglib, key, store=False):
+        """Dump the abi of the library, reusing the cached dump of the build.
+
+        Only dumps of target builds are stored since those are checked again
+        and again, while submitted builds are rarely checked twice and would
+        only push the target dumps out of the cache.
+        """
+        if os.path.exists(self.dump_pinned(key)):
+            self.logger.debug(f"using cached dump of {filename}")
+            shutil.copyfile(self.dump_pinned(key), output)
+            return True
+        if not self.run_abi_dumper(output, base, filename, debuglib):
+            return False
+        if store:
+            self.dump_cache.put(key, output)
+        return True
+
     def extract(self, project, package, srcinfo, repo, arch):
             # fetch cpio headers
             # check file lists for library packages
-            fetchlist, liblist, debuglist = self.compute_fetchlist(project, package, srcinfo, repo, arch)
+            fetchlist, liblist, debuglist, dumpkeys = self.compute_fetchlist(project, package, srcinfo, repo, arch)
 
-            if not fetchlist:
+            if not liblist:
                 msg = f"no libraries found in {project}/{package} {repo}/{arch}"
                 self.logger.info(msg)
-                return None, None
+                return None, None, None
+
+            # packages of libraries with cached dumps are not fetched at all
+            if not fetchlist:
+                self.logger.debug(f"dumps of all libraries of {project}/{package} {repo}/{arch} cached")
+                return liblist, debuglist, dumpkeys
 
             # mtimes in cpio are not the original ones, so we need to fetch
             # that separately :-(
@@ -700,53 +738,44 @@ class ABIChecker(ReviewBot.ReviewBot):
             # fetch binary rpms
             downloaded = self.download_files(project, package, repo, arch, fetchlist, mtimes)
 
-            # extract binary rpms
-            tmpfile = os.path.join(CACHEDIR, "cpio")
+            # extract binary rpms by streaming the payload, only writing the
+            # wanted members
+            wanted = set(liblist) | set(debugfiles)
+            dstdir = os.path.join(self.workdir, 'unpacked', project, package, repo, arch)
             for fn in fetchlist:
                 self.logger.debug(f"extract {fn}")
-                with open(tmpfile, 'wb') as tmpfd:
-                    if fn not in downloaded:
-                        raise FetchError(f"{fn} was not downloaded!")
-                    self.logger.debug(downloaded[fn])
-                    r = subprocess.call(['rpm2cpio', downloaded[fn]], stdout=tmpfd, close_fds=True)
-                    if r != 0:
-                        raise FetchError(f"failed to extract {fn}!")
-                    tmpfd.close()
-                    os.unlink(downloaded[fn])
-                    cpio = CpioRead(tmpfile)
-                    cpio.read()
-                    for ch in cpio:
-                        fn = ch.filename.decode('utf-8')
-                        if fn.startswith('./'): # rpm payload is relative
-                            fn = fn[1:]
-                        self.logger.debug("cpio fn %s", fn)
-                        if fn not in liblist and fn not in debugfiles:
+                if fn not in downloaded:
+                    raise FetchError(f"{fn} was not downloaded!")
+                self.logger.debug(downloaded[fn])
+                with subprocess.Popen(['rpm2cpio', downloaded[fn]], stdout=subprocess.PIPE,
+                                      bufsize=CpioStream.BUFSIZE, close_fds=True) as proc:
+                    cpio = CpioStream(proc.stdout)
+                    for name, mode, size in cpio:
+                        name = name.decode('utf-8')
+                        if name.startswith('./'): # rpm payload is relative
+                            name = name[1:]
+                        self.logger.debug("cpio fn %s", name)
+                        if name not in wanted or not S_ISREG(mode):
                             continue
-                        dst = os.path.join(UNPACKDIR, project, package, repo, arch)
-                        dst += fn
-                        if not os.path.exists(os.path.dirname(dst)):
-                            os.makedirs(os.path.dirname(dst))
+                        dst = dstdir + name
+                        os.makedirs(os.path.dirname(dst), exist_ok=True)
                         self.logger.debug("dst %s", dst)
-                        # the filehandle in the cpio archive is private so
-                        # open it again
-                        with open(tmpfile, 'rb') as cpiofh:
-                            cpiofh.seek(ch.dataoff, os.SEEK_SET)
-                            with open(dst, 'wb') as fh:
-                                while True:
-                                    buf = cpiofh.read(4096)
-                                    if buf is None or buf == b'':
-                                        break
-                                    fh.write(buf)
-            os.unlink(tmpfile)
-
-            return liblist, debuglist
+                        with open(dst, 'wb', buffering=0) as fh:
+                            cpio.copy(fh)
+                    # let rpm2cpio finish writing
+                    proc.stdout.read()
+                if proc.returncode != 0:
+                    raise FetchError(f"failed to extract {fn}!")
+                os.unlink(downloaded[fn])
+
+            return liblist, debuglist, dumpkeys
 
     def download_files(self, project, package, repo, arch, filenames, mtimes):
         downloaded = dict()
         for fn in filenames:
             if fn not in mtimes:
                 raise FetchError(f"missing mtime information for {fn}, can't check")
-            repodir = os.path.join(DOWNLOADS, package, project, repo)
+            repodir = os.path.join(self.workdir, 'downloads', package, project, repo)
             if not os.path.exists(repodir):
                 os.makedirs(repodir)
             t = os.path.join(repodir, fn)
@@ -782,28 +811,23 @@ class ABIChecker(ReviewBot.ReviewBot):
             r = osc.core.http_GET(u)
         except HTTPError as e:
             raise FetchError(f'failed to fetch header information: {e}')
-        tmpfile = NamedTemporaryFile(prefix="cpio-", delete=False)
-        for chunk in r:
-            tmpfile.write(chunk)
-        tmpfile.close()
-        cpio = CpioRead(tmpfile.name)
-        cpio.read()
         rpm_re = re.compile('(.+\.rpm)-[0-9A-Fa-f]{32}$')
-        for ch in cpio:
+        cpio = CpioStream(r)
+        for name, mode, size in cpio:
             # ignore errors
-            if ch.filename == '.errors':
+            if name == b'.errors':
                 continue
-            # the filehandle in the cpio archive is private so
-            # open it again
-            with open(tmpfile.name, 'rb') as fh:
-                fh.seek(ch.dataoff, os.SEEK_SET)
+            # rpm reads the header from a file descriptor, so hand over each
+            # header in an anonymous file rather than storing the archive
+            with TemporaryFile(prefix="cpio-") as fh:
+                cpio.copy(fh)
+                fh.seek(0)
                 h = self.readRpmHeaderFD(fh)
-                if h is None:
-                    raise FetchError(f"failed to read rpm header for {ch.filename}")
-                m = rpm_re.match(ch.filename.decode('utf-8'))
-                if m:
-                    yield m.group(1), h
-        os.unlink(tmpfile.name)
+            if h is None:
+                raise FetchError(f"failed to read rpm header for {name}")
+            m = rpm_re.match(name.decode('utf-8'))
+            if m:
+                yield m.group(1), h
 
     def _getmtimes(self, prj, pkg, repo, arch):
         """ returns a dict of filename: mtime """
@@ -988,9 +1012,11 @@ class ABIChecker(ReviewBot.ReviewBot):
 
     def compute_fetchlist(self, prj, pkg, srcinfo, repo, arch):
         """ scan binary rpms of the specified repo for libraries.
-        Returns a set of packages to fetch and the libraries found
+        Returns a set of packages to fetch and the libraries found. Packages
+        are only fetched for libraries whose abi dump is not cached.
         """
         self.logger.debug(f'scanning {prj}/{pkg} {repo}/{arch}')
+        buildarch = arch
 
         headers = self._fetchcpioheaders(prj, pkg, repo, arch)
         missing_debuginfo = set()
@@ -1028,6 +1054,7 @@ class ABIChecker(ReviewBot.ReviewBot):
         fetchlist = set()
         liblist = dict()
         debuglist = dict()
+        dumpkeys = dict()
         # check whether debug info exists for each lib
         for pkgname in sorted(lib_packages.keys()):
             dpkgname = pkgname+'-debuginfo'
@@ -1058,8 +1085,13 @@ class ABIChecker(ReviewBot.ReviewBot):
                         ok = False
 
                 if ok:
-                    fetchlist.add(pkgs[pkgname][0])
-                    fetchlist.add(rpmfn)
+                    libh = pkgs[pkgname][1]
+                    key = AbiDumpCache.key(self._md5_disturl(libh['disturl'].decode('utf-8')), lib, buildarch, libh['buildtime'])
+                    dumpkeys.setdefault(lib, key)
+                    os.makedirs(os.path.dirname(self.dump_pinned(key)), exist_ok=True)
+                    if not self.dump_cache.get(key, self.dump_pinned(key)):
+                        fetchlist.add(pkgs[pkgname][0])
+                        fetchlist.add(rpmfn)
                     liblist.setdefault(lib, set())
                     debuglist.setdefault(lib, libdebug)
                     libname = os.path.basename(lib)
@@ -1070,7 +1102,7 @@ class ABIChecker(ReviewBot.ReviewBot):
             self.logger.error(f'missing debuginfo: {pformat(missing_debuginfo)}')
             raise MissingDebugInfo(missing_debuginfo)
 
-        return fetchlist, liblist, debuglist
+        return fetchlist, liblist, debuglist, dumpkeys
 
 class CommandLineInterface(ReviewBot.CommandLineInterface):
 
@@ -1083,6 +1115,8 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
         parser.add_option("--force", action="store_true", help="recheck requests that are already considered done")
         parser.add_option("--no-review", action="store_true", help="don't actually accept or decline, just comment")
         parser.add_option("--web-url", metavar="URL", help="URL of web service")
+        parser.add_option("--dump-cache-size", metavar="MIB", type="int",
+                          help="size of the abi dump cache in MiB, 0 to disable (default %d)" % (AbiDumpCache.SIZE_LIMIT // 1024 // 1024))
         return parser
 
     def postoptparse(self):
@@ -1102,6 +1136,8 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
             bot.no_review = True
         if self.options.force:
             bot.force = True
+        if self.options.dump_cache_size is not None:
+            bot.dump_cache.size_limit = self.options.dump_cache_size * 1024 * 1024
 
         return bot
 
@@ -24,6 +24,7 @@ from osclib.core import create_add_role_request
 from osclib.core import package_role_expand
 from osclib.core import source_file_load
 from osclib.core import project_pseudometa_package
+from osclib.source_tree import SourceTree
 from osc.core import show_package_meta, show_project_meta
 from osc.core import get_request_list
 from urllib.error import HTTPError
@@ -304,28 +305,32 @@ class CheckSource(ReviewBot.ReviewBot):
                 f"A package submitted as {target_package} has to build as 'Name: {expected_name}' - found Name '{new_info['name']}'")
             return False
 
-        if not self.check_service_file(target_package):
+        # Index both trees once for all of the policy checks.
+        old = SourceTree('_old')
+        new = SourceTree(target_package)
+
+        if not self.check_service_file(new):
             return False
 
-        if not self.check_rpmlint(target_package):
+        if not self.check_rpmlint(new):
             return False
 
-        specs = [os.path.basename(x) for x in glob.glob(os.path.join(target_package, "*.spec"))]
-        if specs and not self.check_spec_policy('_old', target_package, specs):
+        specs = new.glob('*.spec')
+        if specs and not self.check_spec_policy(old, new, specs):
             return False
 
-        if not self.run_source_validator('_old', target_package):
+        if not self.run_source_validator(old, new):
             return False
 
-        if specs and not self.detect_mentioned_patches('_old', target_package, specs):
+        if specs and not self.detect_mentioned_patches(old, new, specs):
             return False
 
-        if not self.check_urls('_old', target_package, specs):
+        if not self.check_urls(old, new, specs):
             if self.platform_type == "OBS":
                 # Keep review open
-                self.platform.change_review_state(req=self.request, newstate='new',
-                                                  by_group=self.review_group,
-                                                  by_user=self.review_user, message=self.review_messages['new'])
+                self.change_review_state(req=self.request, newstate='new',
+                                         by_group=self.review_group,
+                                         by_user=self.review_user, message=self.review_messages['new'])
                 return None
             else:
                 return False
@@ -393,12 +398,11 @@ class CheckSource(ReviewBot.ReviewBot):
         result = osc.core.search(self.apiurl, **search)
         return result['package'].attrib['matches'] != '0'
 
-    def check_service_file(self, directory):
+    def check_service_file(self, tree):
         ALLOWED_MODES = ['localonly', 'disabled', 'buildtime', 'manual']
 
-        servicefile = os.path.join(directory, '_service')
-        if os.path.exists(servicefile):
-            services = ET.parse(servicefile)
+        if tree.exists('_service'):
+            services = ET.parse(tree.path('_service'))
             for service in services.findall('service'):
                 mode = service.get('mode')
                 if mode in ALLOWED_MODES:
@@ -410,78 +414,75 @@ class CheckSource(ReviewBot.ReviewBot):
                     f"Please change the mode of {name} and use `osc service localrun/disabledrun`."
                 return False
             # remove it away to have full service from source validator
-            os.unlink(servicefile)
+            tree.remove('_service')
 
-        for file in glob.glob(os.path.join(directory, "_service:*")):
-            file = os.path.basename(file)
+        for file in tree.glob("_service:*"):
             self.review_messages['declined'] = f"Found _service generated file {file} in checkout. Please clean this up first."
             return False
 
         return True
 
-    def check_rpmlint(self, directory):
-        for rpmlintrc in glob.glob(os.path.join(directory, "*rpmlintrc")):
-            with open(rpmlintrc, 'r') as f:
-                for line in f:
-                    if not re.match(r'^\s*setBadness', line):
-                        continue
-                    self.review_messages['declined'] = f"For product submissions, you cannot use setBadness. Use filters in {rpmlintrc}."
-                    return False
+    def check_rpmlint(self, tree):
+        for rpmlintrc in tree.glob("*rpmlintrc"):
+            for line in tree.lines(rpmlintrc):
+                if not re.match(r'^\s*setBadness', line):
+                    continue
+                rpmlintrc = tree.path(rpmlintrc)
+                self.review_messages['declined'] = f"For product submissions, you cannot use setBadness. Use filters in {rpmlintrc}."
+                return False
         return True
 
-    def check_spec_policy(self, old, directory, specs):
-        bname = os.path.basename(directory)
-        if not os.path.exists(os.path.join(directory, bname + '.changes')):
+    def check_spec_policy(self, old, new, specs):
+        bname = os.path.basename(new.directory)
+        if not new.exists(bname + '.changes'):
             text = f"{bname}.changes is missing. "
             text += "A package submitted as FooBar needs to have a FooBar.changes file with a format created by `osc vc`."
             self.review_messages['declined'] = text
             return False
 
-        specfile = os.path.join(directory, bname + '.spec')
-        if not os.path.exists(specfile):
+        if not new.exists(bname + '.spec'):
             self.review_messages['declined'] = f"{bname}.spec is missing. A package submitted as FooBar needs to have a FooBar.spec file."
             return False
 
         changes_updated = False
         for spec in specs:
-            with open(os.path.join(directory, spec), 'r') as f:
-                content = f.read()
-                if not re.search(r'#[*\s]+Copyright\s', content):
-                    text = f"{spec} does not appear to contain a Copyright comment. Please stick to the format\n\n"
-                    text += "# Copyright (c) 2022 Unsong Hero\n\n"
-                    text += "or use osc service runall format_spec_file"
-                    self.review_messages['declined'] = text
-                    return False
+            content = new.read(spec)
+            if not re.search(r'#[*\s]+Copyright\s', content):
+                text = f"{spec} does not appear to contain a Copyright comment. Please stick to the format\n\n"
+                text += "# Copyright (c) 2022 Unsong Hero\n\n"
+                text += "or use osc service runall format_spec_file"
+                self.review_messages['declined'] = text
+                return False
 
-                if re.search(r'\nVendor:', content):
-                    self.review_messages['declined'] = "{spec} contains a Vendor line, this is forbidden."
-                    return False
+            if re.search(r'\nVendor:', content):
+                self.review_messages['declined'] = "{spec} contains a Vendor line, this is forbidden."
+                return False
 
-                if not re.search(r'\n%changelog\s', content) and not re.search(r'\n%changelog$', content):
-                    text = f"{spec} does not contain a %changelog line. We don't want a changelog in the spec file"
-                    text += ", but the %changelog section needs to be present\n"
-                    self.review_messages['declined'] = text
-                    return False
+            if not re.search(r'\n%changelog\s', content) and not re.search(r'\n%changelog$', content):
+                text = f"{spec} does not contain a %changelog line. We don't want a changelog in the spec file"
+                text += ", but the %changelog section needs to be present\n"
+                self.review_messages['declined'] = text
+                return False
 
-                if not re.search('#[^\n]*license', content, flags=re.IGNORECASE):
-                    text = f"{spec} does not appear to have a license. The file needs to contain a free software license\n"
-                    text += "Suggestion: use \"osc service runall format_spec_file\" to get our default license or\n"
-                    text += "the minimal license:\n\n"
-                    text += "# This file is under MIT license\n"
-                    self.review_messages['declined'] = text
-                    return False
+            if not re.search('#[^\n]*license', content, flags=re.IGNORECASE):
+                text = f"{spec} does not appear to have a license. The file needs to contain a free software license\n"
+                text += "Suggestion: use \"osc service runall format_spec_file\" to get our default license or\n"
+                text += "the minimal license:\n\n"
+                text += "# This file is under MIT license\n"
+                self.review_messages['declined'] = text
+                return False
 
             # Check that we have for each spec file a changes file - and that at least one
             # contains changes
             changes = spec.replace('.spec', '.changes')
 
             # new or deleted .changes files also count
-            old_exists = os.path.exists(os.path.join(old, changes))
-            new_exists = os.path.exists(os.path.join(directory, changes))
+            old_exists = old.exists(changes)
+            new_exists = new.exists(changes)
             if old_exists != new_exists:
                 changes_updated = True
             elif old_exists and new_exists:
-                if subprocess.run(["cmp", "-s", os.path.join(old, changes), os.path.join(directory, changes)]).returncode:
+                if not new.same(old, changes):
                     changes_updated = True
 
         new_package = False
@@ -532,6 +533,8 @@ class CheckSource(ReviewBot.ReviewBot):
             if len(add_roles) > 0:
                 return add_roles[0].reqid
             else:
+                # The ID of the created request is part of the decline message.
+                self.check_serially()
                 add_role_msg = f'Created automatically from request {self.request.reqid}'
                 return create_add_role_request(self.apiurl, source_project, self.required_maintainer,
                                                'maintainer', message=add_role_msg)
@@ -679,14 +682,14 @@ class CheckSource(ReviewBot.ReviewBot):
         self.review_messages['accepted'] = 'unhandled: removing repository'
         return True
 
-    def run_source_validator(self, old, directory):
+    def run_source_validator(self, old, new):
         scripts = glob.glob("/usr/lib/obs/service/source_validators/*")
         if not scripts:
             raise RuntimeError.new('Missing source validator')
         for script in scripts:
             if os.path.isdir(script):
                 continue
-            res = subprocess.run([script, '--batchmode', directory, old], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            res = subprocess.run([script, '--batchmode', new.directory, old.directory], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
             if res.returncode:
                 text = "Source validator failed. Try \"osc service runall source_validator\"\n"
                 text += res.stdout.decode('utf-8')
@@ -702,29 +705,24 @@ class CheckSource(ReviewBot.ReviewBot):
 
         return True
 
-    def _snipe_out_existing_urls(self, old, directory, specs):
-        if not os.path.isdir(old):
+    def _snipe_out_existing_urls(self, old, new, specs):
+        if not old.present:
             return
-        oldsources = self._mentioned_sources(old, specs)
+        oldsources = old.mentioned_sources(specs)
         for spec in specs:
-            specfn = os.path.join(directory, spec)
-            nspecfn = specfn + '.new'
-            wf = open(nspecfn, 'w')
-            with open(specfn) as rf:
-                for line in rf:
-                    m = re.match(r'(Source[0-9]*\s*):\s*(.*)$', line)
-                    if m and m.group(2) in oldsources:
-                        wf.write(m.group(1) + ":" + os.path.basename(m.group(2)) + "\n")
-                        continue
-                    wf.write(line)
-            wf.close()
-            os.rename(nspecfn, specfn)
-
-    def check_urls(self, old, directory, specs):
-        self._snipe_out_existing_urls(old, directory, specs)
+            lines = new.lines(spec)
+            snipe = [(i, tag, value) for i, tag, value in new.spec_sources(spec) if value in oldsources]
+            if not snipe:
+                continue
+            for i, tag, value in snipe:
+                lines[i] = tag + ":" + os.path.basename(value) + "\n"
+            new.write(spec, ''.join(lines))
+
+    def check_urls(self, old, new, specs):
+        self._snipe_out_existing_urls(old, new, specs)
         oldcwd = os.getcwd()
         with tempfile.TemporaryDirectory() as tmpdir:
-            os.chdir(directory)
+            os.chdir(new.directory)
             res = subprocess.run(["/usr/lib/obs/service/download_files", "--enforceupstream",
                                   "yes", "--enforcelocal", "yes", "--outdir", tmpdir], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
             if res.returncode:
@@ -739,33 +737,12 @@ class CheckSource(ReviewBot.ReviewBot):
         os.chdir(oldcwd)
         return True
 
-    def difflines(self, oldf, newf):
-        with open(oldf, 'r') as f:
-            oldl = f.readlines()
-        with open(newf, 'r') as f:
-            newl = f.readlines()
-        return list(difflib.unified_diff(oldl, newl))
-
-    def _mentioned_sources(self, directory, specs):
-        sources = set()
-        for spec in specs:
-            specfn = os.path.join(directory, spec)
-            if not os.path.exists(specfn):
-                continue
-            with open(specfn) as f:
-                for line in f:
-                    m = re.match(r'Source[0-9]*\s*:\s*(.*)$', line)
-                    if not m:
-                        continue
-                    sources.add(m.group(1))
-        return sources
-
-    def detect_mentioned_patches(self, old, directory, specs):
+    def detect_mentioned_patches(self, old, new, specs):
         # new packages have different rules
-        if not os.path.isdir(old):
+        if not old.present:
             return True
-        opatches = self.list_patches(old)
-        npatches = self.list_patches(directory)
+        opatches = old.patches()
+        npatches = new.patches()
 
         cpatches = opatches.intersection(npatches)
         opatches -= cpatches
@@ -779,16 +756,15 @@ class CheckSource(ReviewBot.ReviewBot):
             patches_to_mention[p] = 'old'
         for p in npatches:
             patches_to_mention[p] = 'new'
-        for changes in glob.glob(os.path.join(directory, '*.changes')):
-            base = os.path.basename(changes)
-            oldchanges = os.path.join(old, base)
-            if os.path.exists(oldchanges):
-                diff = self.difflines(oldchanges, changes)
+        for changes in new.glob('*.changes'):
+            if new.same(old, changes):
+                # nothing added or removed
+                continue
+            if old.exists(changes):
+                diff = difflib.unified_diff(old.lines(changes), new.lines(changes))
             else:
-                with open(changes, 'r') as f:
-                    diff = ['+' + line for line in f.readlines()]
+                diff = ['+' + line for line in new.lines(changes)]
             for line in diff:
-                pass
                 # Check if the line mentions a patch being added (starts with +)
                 # or removed (starts with -)
                 if not re.match(r'[+-]', line):
@@ -800,8 +776,8 @@ class CheckSource(ReviewBot.ReviewBot):
                         del patches_to_mention[patch]
 
         # if a patch is mentioned as source, we ignore it
-        sources = self._mentioned_sources(directory, specs)
-        sources |= self._mentioned_sources(old, specs)
+        sources = new.mentioned_sources(specs)
+        sources |= old.mentioned_sources(specs)
 
         for s in sources:
             patches_to_mention.pop(s, None)
@@ -819,13 +795,6 @@ class CheckSource(ReviewBot.ReviewBot):
         self.review_messages['declined'] = '\n'.join(lines)
         return False
 
-    def list_patches(self, directory):
-        ret = set()
-        for ext in ['*.diff', '*.patch', '*.dif']:
-            for file in glob.glob(os.path.join(directory, ext)):
-                ret.add(os.path.basename(file))
-        return ret
-
 
 class CommandLineInterface(ReviewBot.CommandLineInterface):
 
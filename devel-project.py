@@ -14,9 +14,10 @@ from osclib.comments import CommentAPI
 from osclib.conf import Config
 from osclib.core import devel_project_fallback
 from osclib.core import entity_email
-from osclib.core import get_request_list_with_history
 from osclib.core import package_list_kind_filtered
 from osclib.core import request_age
+from osclib.core import request_list_paginated
+from osclib.core import request_list_xpath
 from osclib.stagingapi import StagingAPI
 from osclib.util import mail_send
 
@@ -163,9 +164,8 @@ def requests(args):
     # Disable including source project in get_request_list() query.
     osc.conf.config['include_request_from_project'] = False
     for devel_project in devel_projects:
-        requests = get_request_list_with_history(
-            apiurl, devel_project, req_state=('new', 'review'),
-            req_type='submit')
+        requests = request_list_paginated(apiurl, request_list_xpath(
+            devel_project, req_state=('new', 'review'), req_type='submit'))
         for request in requests:
             action = request.actions[0]
             age = request_age(request).days
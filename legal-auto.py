@@ -36,6 +36,8 @@ MAX_GET_RETRIES = 5
 
 
 class LegalAuto(ReviewBot.ReviewBot):
+    # requests are tracked in the legal database while being checked
+    CONCURRENT_CHECKS = False
 
     def __init__(self, *args, **kwargs):
         ReviewBot.ReviewBot.__init__(self, *args, **kwargs)
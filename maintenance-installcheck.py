@@ -2,8 +2,6 @@
 
 import sys
 
-import osc.core
-
 import ReviewBot
 from osclib.conf import Config, str2bool
 from osclib.core import (repository_path_expand, repository_path_search,
@@ -49,10 +47,9 @@ class MaintInstCheck(ReviewBot.ReviewBot):
             msg = '\n'.join(self.comment)
             self.logger.debug(msg)
             if not self.dryrun:
-                osc.core.change_review_state(apiurl=self.apiurl,
-                                             reqid=req.reqid, newstate='declined',
-                                             by_group=self.review_group,
-                                             by_user=self.review_user, message=msg)
+                self.change_review_state(req=req, newstate='declined',
+                                         by_group=self.review_group,
+                                         by_user=self.review_user, message=msg)
             # lie to the super class - decline only once
             return None
 
@@ -1,11 +1,17 @@
 #!/usr/bin/python3
 
 import argparse
+import heapq
+import json
 import os
+import pickle
+import resource
 import subprocess
 import sys
+import tempfile
 from collections import namedtuple
 from datetime import datetime
+from operator import attrgetter
 
 import osc.conf
 import osc.core
@@ -20,8 +26,8 @@ import metrics_release
 import osclib.conf
 from osclib.cache import Cache
 from osclib.conf import Config
-from osclib.core import (get_request_list_with_history,
-                         project_pseudometa_package)
+from osclib.core import project_pseudometa_package
+from osclib.core import search_paginated
 from osclib.stagingapi import StagingAPI
 
 SOURCE_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -32,66 +38,80 @@ osclib.conf.DEFAULT[
     r'openSUSE:(?P<project>[\d.]+)$'] = osclib.conf.DEFAULT[
     r'openSUSE:(?P<project>Leap:(?P<version>[\d.]+))$']
 
-# Provide osc.core.get_request_list() that swaps out search() implementation to
-# capture the generated query, paginate over and yield each request to avoid
-# loading all requests at the same time. Additionally, use lxml ET to avoid
-# having to re-parse to perform complex xpaths.
 
+def request_list_finalized(apiurl, project, since=None):
+    """
+    Yield the accepted, revoked, and superseded requests targeting project with
+    their full history, optionally only those whose state changed since the
+    given time, as lxml elements.
+    """
+    xpath = ''
+    for state in ('accepted', 'revoked', 'superseded'):
+        xpath = osc.core.xpath_join(xpath, f"state/@name='{state}'", inner=True)
+    xpath = osc.core.xpath_join(xpath, f"action/target/@project='{project}'", op='and', nexpr_parentheses=True)
+    if project == 'openSUSE:Factory':
+        # Idealy this would be 250000, but poo#48437 and lack of OBS sort.
+        xpath = osc.core.xpath_join(xpath, '@id>450000', op='and')
+    if since:
+        xpath = osc.core.xpath_join(xpath, f"state/@when>='{since}'", op='and')
 
-def get_request_list(*args, **kwargs):
-    osc.core._search = osc.core.search
-    osc.core.search = search_capture
-    osc.core._ET = osc.core.ET
-    osc.core.ET = ET
-    osc.conf.config['include_request_from_project'] = False
-
-    osc.core.get_request_list(*args, **kwargs)
-
-    osc.core.search = osc.core._search
-
-    query = search_capture.query
-    for request in search_paginated_generator(query[0], query[1], **query[2]):
-        # Python 3 yield from.
-        yield request
+    yield from search_paginated(apiurl, 'request', xpath, {'withfullhistory': 1})
 
-    osc.core.ET = osc.core._ET
 
+class PointSpool(object):
+    """
+    Collect points in memory until spill_size is reached after which they are
+    sorted by time and spilled to a temporary file as a run. Iterating the
+    spool merges the runs to walk the points in order by time while holding at
+    most spill_size points in memory regardless of the size of the history.
+    """
 
-def search_capture(apiurl, queries=None, **kwargs):
-    search_capture.query = (apiurl, queries, kwargs)
-    return {'request': ET.fromstring('<collection matches="0"></collection>')}
+    def __init__(self, spill_size=100000):
+        self.spill_size = spill_size
+        self.buffer = []
+        self.runs = []
+        self.count = 0
 
-# Provides a osc.core.search() implementation for use with get_request_list()
-# that paginates in sets of 1000 and yields each request.
+    def __len__(self):
+        return self.count
 
+    def append(self, point):
+        self.buffer.append(point)
+        self.count += 1
+        if len(self.buffer) >= self.spill_size:
+            self.spill()
 
-def search_paginated_generator(apiurl, queries=None, **kwargs):
-    if "action/target/@project='openSUSE:Factory'" in kwargs['request']:
-        # Idealy this would be 250000, but poo#48437 and lack of OBS sort.
-        kwargs['request'] = osc.core.xpath_join(kwargs['request'], '@id>450000', op='and')
+    def spill(self):
+        run = tempfile.TemporaryFile()
+        for point in sorted(self.buffer, key=attrgetter('time')):
+            pickle.dump(tuple(point), run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
 
-    request_count = 0
-    queries['request']['limit'] = 1000
-    queries['request']['offset'] = 0
-    while True:
-        collection = osc.core.search(apiurl, queries, **kwargs)['request']
-        if not request_count:
-            print(f"processing {int(collection.get('matches')):,} requests")
+        self.runs.append(run)
+        self.buffer = []
 
-        for request in collection.findall('request'):
-            yield request
-            request_count += 1
+    @staticmethod
+    def run_read(run):
+        while True:
+            try:
+                yield Point(*pickle.load(run))
+            except EOFError:
+                run.close()
+                return
 
-        if request_count == int(collection.get('matches')):
-            # Stop paging once the expected number of items has been returned.
-            break
+    def sorted(self):
+        """Yield and remove all points in order by time."""
+        # The merge is stable so points at the same time keep their order.
+        runs = [self.run_read(run) for run in self.runs]
+        runs.append(sorted(self.buffer, key=attrgetter('time')))
+        self.buffer = []
+        self.runs = []
+        self.count = 0
 
-        # Release memory as otherwise ET seems to hold onto it.
-        collection.clear()
-        queries['request']['offset'] += queries['request']['limit']
+        yield from heapq.merge(*runs, key=attrgetter('time'))
 
 
-points = []
+points = PointSpool()
 
 
 def point(measurement, fields, datetime, tags=None, delta=False):
@@ -104,10 +124,27 @@ def timestamp(datetime):
     return int(datetime.strftime('%s'))
 
 
-def ingest_requests(client, api, project):
-    requests = get_request_list_with_history(
-        api.apiurl, project, req_state=('accepted', 'revoked', 'superseded'))
-    for request in requests:
+def ingest_requests(client, api, project, incremental=False, batch_size=1000):
+    checkpoint = ingest_requests_checkpoint_get(client, project) if incremental else None
+    if checkpoint:
+        print(f"processing requests finalized since {checkpoint['when']}")
+
+    since = checkpoint['when'] if checkpoint else None
+    when_last = since
+    ids_last = set(checkpoint['ids']) if checkpoint else set()
+    for request in request_list_finalized(api.apiurl, project, since):
+        # Track the high-water mark of the final state changes. Requests
+        # finalized in the same second as the previous mark were either
+        # processed by the previous run or not yet finalized at the time.
+        when = request.find('state').get('when')
+        if since and when == since and request.get('id') in checkpoint['ids']:
+            continue
+        if when_last is None or when > when_last:
+            when_last = when
+            ids_last = set()
+        if when == when_last:
+            ids_last.add(request.get('id'))
+
         if request.find('action').get('type') not in ('submit', 'delete'):
             # TODO Handle non-stageable requests via different flow.
             continue
@@ -251,7 +288,43 @@ def ingest_requests(client, api, project):
                 print(f"unable to find priority history entry for {request.get('id')} to {priority.text}")
 
     print(f'finalizing {len(points):,} points')
-    return walk_points(client, points, project)
+    if checkpoint and not points:
+        return 0
+
+    wrote, state = walk_points(client, points, project, checkpoint, batch_size)
+    state.update({'when': when_last, 'ids': sorted(ids_last)})
+    ingest_requests_checkpoint_set(client, project, state)
+    return wrote
+
+
+# The checkpoint of the request ingestion is stored alongside the points. It
+# contains the high-water mark of the final state changes ingested and the
+# running counters of the delta points in order to only fetch newer requests
+# and write their points on subsequent runs.
+
+
+def ingest_requests_checkpoint_get(client, project):
+    query_api = client.query_api()
+    result = query_api.query(query=f'''
+        from(bucket: "{project}")
+        |> range(start: -100y)
+        |> filter(fn: (r) => r._measurement == "requests_checkpoint")
+        |> filter(fn: (r) => r._field == "state")
+        |> sort(columns: ["_time"], desc: true)
+        |> limit(n: 1)''')
+    if result and result[0].records:
+        return json.loads(result[0].records[0].get_value())
+
+    return None
+
+
+def ingest_requests_checkpoint_set(client, project, checkpoint):
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+    write_api.write(bucket=project, record=[{
+        'measurement': 'requests_checkpoint',
+        'fields': {'state': json.dumps(checkpoint)},
+        'time': timestamp(datetime.utcnow()),
+    }], write_precision='s')
 
 
 def who_workaround(request, review, relax=False):
@@ -282,19 +355,29 @@ def who_workaround(request, review, relax=False):
 # Walk data points in order by time, adding up deltas and merging points at
 # the same time. Data is converted to dict() and written to influx batches to
 # avoid extra memory usage required for all data in dict() and avoid influxdb
-# allocating memory for entire incoming data set at once.
+# allocating memory for entire incoming data set at once. The points are merged
+# from the runs of the PointSpool so they are never all held in memory.
+#
+# Given a checkpoint the measurements are kept and the counters continue from
+# those of the checkpoint. Delta points up to the time of the checkpoint were
+# already written and are only added to the counters.
 
 
-def walk_points(client, points, target):
+def walk_points(client, points, target, checkpoint=None, batch_size=1000):
     delete_api = client.delete_api()
     write_api = client.write_api(write_options=SYNCHRONOUS)
     measurements = set()
     counters = {}
+    time_checkpoint = None
+    if checkpoint:
+        time_checkpoint = checkpoint['time']
+        for counters_tag_key, values in checkpoint['counters'].items():
+            counters[counters_tag_key] = {'last': None, 'values': values}
     final = []
     time_last = None
     wrote = 0
-    for point in sorted(points, key=lambda p: p.time):
-        if point.measurement not in measurements:
+    for point in points.sorted():
+        if not checkpoint and point.measurement not in measurements:
             # Wait until just before writing to drop measurement.
             delete_api.delete(start="1970-01-01T00:00:00Z",
                               stop=datetime.utcnow().isoformat() + "Z",
@@ -302,8 +385,8 @@ def walk_points(client, points, target):
                               predicate=f'_measurement="{point.measurement}"')
             measurements.add(point.measurement)
 
-        if point.time != time_last and len(final) >= 1000:
-            # Write final point in batches of ~1000, but guard against writing
+        if point.time != time_last and len(final) >= batch_size:
+            # Write final point in batches of ~batch_size, but guard against writing
             # when in the middle of points at the same time as they may end up
             # being merged. As such the previous time should not match current.
             write_api.write(bucket=target, record=final, write_precision='s')
@@ -329,6 +412,9 @@ def walk_points(client, points, target):
         for key, value in point.fields.items():
             values[key] = values.setdefault(key, 0) + value
 
+        if time_checkpoint is not None and point.time <= time_checkpoint:
+            continue
+
         if counters_tag['last'] and point.time == counters_tag['last']['time']:
             point = counters_tag['last']
         else:
@@ -339,7 +425,13 @@ def walk_points(client, points, target):
 
     # Write any remaining final points.
     write_api.write(bucket=target, record=final, write_precision='s')
-    return wrote + len(final)
+
+    # Running counters to continue from in the next incremental run.
+    times = [time for time in (time_last, time_checkpoint) if time is not None]
+    return wrote + len(final), {
+        'time': max(times) if times else None,
+        'counters': {key: counters_tag['values'] for key, counters_tag in counters.items()},
+    }
 
 
 def ingest_release_schedule(client, project):
@@ -616,7 +708,8 @@ def main(args):
         global who_workaround_swap, who_workaround_miss
         who_workaround_swap = who_workaround_miss = 0
 
-        points_requests = ingest_requests(client, api, args.project)
+        points.spill_size = args.spill_size
+        points_requests = ingest_requests(client, api, args.project, args.incremental, args.batch_size)
         points_schedule = ingest_release_schedule(client, args.project)
 
     print('who_workaround_swap', who_workaround_swap)
@@ -624,6 +717,8 @@ def main(args):
 
     print('wrote {:,} points and {:,} annotation points to db'.format(
         points_requests, points_schedule))
+    # Linux reports the maximum resident set size in kilobytes.
+    print('peak memory {:,} MiB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
 
 
 if __name__ == '__main__':
@@ -640,6 +735,11 @@ if __name__ == '__main__':
     parser.add_argument('--heavy-cache', action='store_true',
                         help='cache ephemeral queries indefinitely (useful for development)')
     parser.add_argument('--release-only', action='store_true', help='ingest release metrics only')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only ingest requests finalized since the previous run instead of all requests')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of points per write to InfluxDB')
+    parser.add_argument('--spill-size', type=int, default=100000,
+                        help='number of request points held in memory before spilling to disk')
     args = parser.parse_args()
 
     sys.exit(main(args))
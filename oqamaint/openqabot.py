@@ -28,6 +28,9 @@ class OpenQABot(ReviewBot.ReviewBot):
     """ check ABI of library packages
     """
 
+    # openQA jobs are triggered while checking
+    CONCURRENT_CHECKS = False
+
     def __init__(self, *args, **kwargs):
         super(OpenQABot, self).__init__(*args, **kwargs)
         self.tgt_repo = {}
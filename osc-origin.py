@@ -1,4 +1,8 @@
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from datetime import timedelta
+import hashlib
 import json
 import logging
 import os
@@ -13,12 +17,14 @@ from osclib.core import entity_exists
 from osclib.core import package_kind
 from osclib.core import package_list
 from osclib.core import package_list_kind_filtered
+from osclib.core import package_list_sourceinfo
 from osclib.core import project_attribute_list
 from osclib.core import project_locked
 from osclib.origin import config_load
 from osclib.origin import config_origin_list
 from osclib.origin import origin_find
 from osclib.origin import origin_history
+from osclib.origin import origin_lookup_changes
 from osclib.origin import origin_potentials
 from osclib.origin import origin_revision_state
 from osclib.origin import origin_updatable
@@ -27,10 +33,12 @@ from osclib.origin import origin_update
 from osclib.util import mail_send
 from shutil import copyfile
 import sys
+import threading
 import time
 import yaml
 
 OSRT_ORIGIN_LOOKUP_TTL = 60 * 60 * 24 * 7
+OSRT_ORIGIN_LOOKUP_STATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
 
 @cmdln.option('--debug', action='store_true', help='output debug information')
@@ -38,11 +46,14 @@ OSRT_ORIGIN_LOOKUP_TTL = 60 * 60 * 24 * 7
 @cmdln.option('--dry', action='store_true', help='perform a dry-run where applicable')
 @cmdln.option('--force-refresh', action='store_true', help='force refresh of data')
 @cmdln.option('--format', default='plain', help='output format')
+@cmdln.option('--incremental', action='store_true',
+              help='only refresh the lookup of packages with changes since the last lookup')
 @cmdln.option('--listen', action='store_true', help='listen to events')
 @cmdln.option('--listen-seconds', help='number of seconds to listen to events')
 @cmdln.option('--mail', action='store_true', help='mail report to <confg:mail-release-list>')
 @cmdln.option('--origins-only', action='store_true', help='list origins instead of expanded config')
 @cmdln.option('-p', '--project', help='project on which to operate')
+@cmdln.option('--workers', help='number of packages to look up concurrently')
 def do_origin(self, subcmd, opts, *args):
     """${cmd_name}: tools for working with origin information
 
@@ -60,13 +71,13 @@ def do_origin(self, subcmd, opts, *args):
 
     Usage:
         osc origin config [--origins-only]
-        osc origin cron
+        osc origin cron [--incremental] [--workers]
         osc origin history [--format json|yaml] PACKAGE
-        osc origin list [--force-refresh] [--format json|yaml]
+        osc origin list [--force-refresh] [--incremental] [--format json|yaml] [--workers]
         osc origin package [--debug] PACKAGE
         osc origin potentials [--format json|yaml] PACKAGE
         osc origin projects [--format json|yaml]
-        osc origin report [--diff] [--force-refresh] [--mail]
+        osc origin report [--diff] [--force-refresh] [--incremental] [--mail] [--workers]
         osc origin update [--listen] [--listen-seconds] [PACKAGE...]
     """
 
@@ -86,6 +97,8 @@ def do_origin(self, subcmd, opts, *args):
     if not opts.project and core.is_project_dir('.'):
         opts.project = core.store_read_project('.')
 
+    opts.workers = int(opts.workers or 1)
+
     Cache.init()
     apiurl = self.get_api_url()
     if command not in ['cron', 'projects', 'update']:
@@ -122,7 +135,8 @@ def osrt_origin_cron(apiurl, opts, *args):
                 continue
 
         # Force update lookup information.
-        lookup = osrt_origin_lookup(apiurl, project, force_refresh=True, quiet=True)
+        lookup = osrt_origin_lookup(apiurl, project, force_refresh=True, quiet=True, workers=opts.workers,
+                                    incremental=opts.incremental)
         print(f'{project} lookup updated for {len(lookup)} package(s)')
 
 
@@ -161,7 +175,149 @@ def osrt_origin_lookup_file(project, previous=False):
     return os.path.join(cache_dir, lookup_name)
 
 
-def osrt_origin_lookup(apiurl, project, force_refresh=False, previous=False, quiet=False):
+def osrt_origin_lookup_package(apiurl, project, package):
+    origin_info = origin_find(apiurl, project, package)
+    return {
+        'origin': str(origin_info),
+        'revisions': origin_revision_state(apiurl, project, package, origin_info),
+    }
+
+
+def osrt_origin_lookup_partial_load(partial_path):
+    lookup = {}
+    if not os.path.exists(partial_path):
+        return lookup
+
+    # Only resume recent runs as the older results would be outdated.
+    if time.time() - os.stat(partial_path).st_mtime > OSRT_ORIGIN_LOOKUP_TTL:
+        return lookup
+
+    with open(partial_path, 'r') as partial_stream:
+        for line in partial_stream:
+            try:
+                package, details = json.loads(line)
+            except ValueError:
+                # Last line cut off by the interruption.
+                break
+            lookup[package] = details
+
+    return lookup
+
+
+def osrt_origin_lookup_packages(apiurl, project, packages, lookup, callback=None, workers=1):
+    """
+    Look up the origin of the packages into lookup calling callback with each
+    package once done. Pending lookups are cancelled when one fails.
+    """
+    lock = threading.Lock()
+
+    def lookup_package(package):
+        details = osrt_origin_lookup_package(apiurl, project, package)
+        with lock:
+            lookup[package] = details
+            if callback:
+                callback(package, details)
+
+    if workers <= 1:
+        for package in packages:
+            lookup_package(package)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(lookup_package, package) for package in packages]
+        for future in as_completed(futures):
+            future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def osrt_origin_lookup_generate(apiurl, project, partial_path, workers=1):
+    """
+    Look up the origin of all packages in project. Each package is appended to
+    the partial file once done and packages found in the partial file of an
+    interrupted run are not looked up again.
+    """
+    lookup = osrt_origin_lookup_partial_load(partial_path)
+    if len(lookup):
+        print(f'{project} lookup resumed with {len(lookup)} package(s)', file=sys.stderr)
+
+    packages = set()
+
+    def packages_pending():
+        # Submitted while the package kinds are still being determined.
+        for package in package_list_kind_filtered(apiurl, project):
+            package = str(package)
+            packages.add(package)
+            if package not in lookup:
+                yield package
+
+    with open(partial_path, 'a' if len(lookup) else 'w') as partial_stream:
+        def record(package, details):
+            partial_stream.write(json.dumps([package, details]) + '\n')
+            partial_stream.flush()
+
+        osrt_origin_lookup_packages(apiurl, project, packages_pending(), lookup, record, workers)
+
+    # Drop packages removed since the interrupted run.
+    return {package: details for package, details in lookup.items() if package in packages}
+
+
+def osrt_origin_lookup_config_hash(apiurl, project):
+    config = config_load(apiurl, project)
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def osrt_origin_lookup_incremental(apiurl, project, lookup_path, state_path, workers=1):
+    """
+    Look up again only the packages whose origin may have changed since the
+    existing lookup was started or return None if a full lookup is required.
+    """
+    if not os.path.exists(lookup_path) or not os.path.exists(state_path):
+        return None
+
+    with open(state_path, 'r') as state_stream:
+        state = json.load(state_stream)
+
+    # Regularly perform a full lookup to pick up anything missed.
+    full = datetime.strptime(state['full'], OSRT_ORIGIN_LOOKUP_STATE_FORMAT)
+    if (datetime.utcnow() - full).total_seconds() > OSRT_ORIGIN_LOOKUP_TTL:
+        return None
+
+    if state['config'] != osrt_origin_lookup_config_hash(apiurl, project):
+        return None
+
+    since = datetime.strptime(state['started'], OSRT_ORIGIN_LOOKUP_STATE_FORMAT)
+    changed = origin_lookup_changes(apiurl, project, since)
+    if changed is None:
+        return None
+
+    with open(lookup_path, 'r') as lookup_stream:
+        lookup = yaml.safe_load(lookup_stream)
+    if not lookup or not isinstance(next(iter(lookup.values())), dict):
+        return None
+
+    names = set(package_list_sourceinfo(apiurl, project))
+    lookup = {package: details for package, details in lookup.items() if package in names}
+
+    packages = []
+    for package in sorted(names):
+        if package in lookup and package not in changed:
+            continue
+
+        if package_kind(apiurl, project, package) == 'source':
+            packages.append(package)
+        else:
+            lookup.pop(package, None)
+
+    print(f'{project} lookup incremental for {len(packages)} package(s)', file=sys.stderr)
+    osrt_origin_lookup_packages(apiurl, project, packages, lookup, workers=workers)
+
+    return lookup
+
+
+def osrt_origin_lookup(apiurl, project, force_refresh=False, previous=False, quiet=False, workers=1,
+                       incremental=False):
     locked = project_locked(apiurl, project)
     if locked:
         force_refresh = False
@@ -171,7 +327,7 @@ def osrt_origin_lookup(apiurl, project, force_refresh=False, previous=False, qui
         if not locked and not previous:
             # Force refresh of lookup information if expried.
             if time.time() - os.stat(lookup_path).st_mtime > OSRT_ORIGIN_LOOKUP_TTL:
-                return osrt_origin_lookup(apiurl, project, True)
+                return osrt_origin_lookup(apiurl, project, True, workers=workers, incremental=incremental)
 
         with open(lookup_path, 'r') as lookup_stream:
             lookup = yaml.safe_load(lookup_stream)
@@ -184,15 +340,22 @@ def osrt_origin_lookup(apiurl, project, force_refresh=False, previous=False, qui
         if previous:
             return None
 
-        packages = package_list_kind_filtered(apiurl, project)
-
-        lookup = {}
-        for package in packages:
-            origin_info = origin_find(apiurl, project, package)
-            lookup[str(package)] = {
-                'origin': str(origin_info),
-                'revisions': origin_revision_state(apiurl, project, package, origin_info),
-            }
+        state_path = lookup_path + '.state'
+        state = {
+            'started': datetime.utcnow().strftime(OSRT_ORIGIN_LOOKUP_STATE_FORMAT),
+            'config': osrt_origin_lookup_config_hash(apiurl, project),
+        }
+
+        lookup = None
+        partial_path = lookup_path + '.partial'
+        if incremental and not os.path.exists(partial_path):
+            lookup = osrt_origin_lookup_incremental(apiurl, project, lookup_path, state_path, workers)
+        if lookup is None:
+            lookup = osrt_origin_lookup_generate(apiurl, project, partial_path, workers)
+            state['full'] = state['started']
+        else:
+            with open(state_path, 'r') as state_stream:
+                state['full'] = json.load(state_stream)['full']
 
         if os.path.exists(lookup_path):
             lookup_path_previous = osrt_origin_lookup_file(project, True)
@@ -200,6 +363,11 @@ def osrt_origin_lookup(apiurl, project, force_refresh=False, previous=False, qui
 
         with open(lookup_path, 'w+') as lookup_stream:
             yaml.dump(lookup, lookup_stream, default_flow_style=False)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+        with open(state_path, 'w') as state_stream:
+            json.dump(state, state_stream)
 
     if not previous and not quiet:
         dt = timedelta(seconds=time.time() - os.stat(lookup_path).st_mtime)
@@ -213,7 +381,8 @@ def osrt_origin_max_key(dictionary, minimum):
 
 
 def osrt_origin_list(apiurl, opts, *args):
-    lookup = osrt_origin_lookup(apiurl, opts.project, opts.force_refresh, quiet=opts.format != 'plain')
+    lookup = osrt_origin_lookup(apiurl, opts.project, opts.force_refresh, quiet=opts.format != 'plain',
+                                workers=opts.workers, incremental=opts.incremental)
 
     if opts.format != 'plain':
         # Suppliment data with request information.
@@ -308,7 +477,8 @@ def osrt_origin_report_diff(lookup, lookup_previous):
 
 
 def osrt_origin_report(apiurl, opts, *args):
-    lookup = osrt_origin_lookup(apiurl, opts.project, opts.force_refresh)
+    lookup = osrt_origin_lookup(apiurl, opts.project, opts.force_refresh, workers=opts.workers,
+                                incremental=opts.incremental)
     origin_count = osrt_origin_report_count(lookup)
 
     columns = ['origin', 'count', 'percent']
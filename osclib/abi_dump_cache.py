@@ -0,0 +1,79 @@
+import hashlib
+import os
+import shutil
+from tempfile import NamedTemporaryFile
+
+# Cache of the abi-dumper output of abichecker (see abichecker/abichecker.py).
+
+
+class AbiDumpCache(object):
+    """Keep abi-dumper output of library builds across requests.
+
+    The libraries of a target build are dumped for every request against it
+    so the dumps are stored by library build and reused. Once the cache
+    exceeds size_limit bytes the least recently used dumps are evicted.
+    """
+
+    SIZE_LIMIT = 2 * 1024 * 1024 * 1024
+    # fraction of size_limit to evict down to so pruning is infrequent
+    PRUNE_TARGET = 0.8
+
+    def __init__(self, directory, size_limit=SIZE_LIMIT):
+        self.directory = directory
+        self.size_limit = size_limit
+
+    @staticmethod
+    def key(disturl_md5, lib, arch, buildtime):
+        """Key of a library build. The build time tells apart rebuilds of
+        the same sources which may differ in ABI due to changed dependencies.
+        """
+        key = '\0'.join([disturl_md5, lib, arch, str(buildtime)])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.dump')
+
+    def get(self, key, output):
+        """Copy the cached dump to output. Returns False if not cached."""
+        if not self.size_limit:
+            return False
+        try:
+            shutil.copyfile(self.path(key), output)
+            # the modification time tracks the last use
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, dump):
+        if not self.size_limit:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with NamedTemporaryFile(dir=self.directory, delete=False) as fh:
+            with open(dump, 'rb') as src:
+                shutil.copyfileobj(src, fh)
+        os.replace(fh.name, self.path(key))
+        self.prune()
+
+    def prune(self):
+        dumps = []
+        total = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.dump'):
+                    continue
+                st = entry.stat()
+                dumps.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        if total <= self.size_limit:
+            return
+
+        for mtime, size, path in sorted(dumps):
+            if total <= self.size_limit * self.PRUNE_TARGET:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
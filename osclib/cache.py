@@ -1,19 +1,19 @@
 import datetime
-import hashlib
 import os
 import osc.core
 import re
 import sys
 
+from urllib.error import HTTPError
 from urllib.parse import unquote
 from urllib.parse import urlsplit, SplitResult
 from io import BytesIO
 
 from osc import conf
-from urllib.request import urlopen
 from osclib.cache_manager import CacheManager
+from osclib.cache_store import FileStore
+from osclib.cache_store import STORES
 from osclib.conf import str2bool
-from osclib.util import rmtree_nfs_safe
 from time import time
 from lxml import etree as ET
 
@@ -27,15 +27,29 @@ def http_request(method, url, headers={}, data=None, file=None):
         ret = Cache.get(url)
         if ret:
             return ret
+
+        # Expired or invalidated entry with validators can be revalidated by
+        # the server rather than downloaded again.
+        validators = Cache.validators(url)
+        if validators:
+            headers = dict(headers, **validators)
     else:
         # Logically, seems to make more sense after real call, but practically
         # it should not matter and makes the apitests happy when dealing with
         # request acceptance which causes a GET to determine target project.
         Cache.delete(url)
 
-    ret = osc.core._http_request(method, url, headers, data, file)
+    try:
+        ret = osc.core._http_request(method, url, headers, data, file)
+    except HTTPError as e:
+        if method == 'GET' and e.code == 304:
+            return Cache.revalidated(url)
+        raise
 
     if method == 'GET':
+        if getattr(ret, 'status', None) == 304:
+            return Cache.revalidated(url)
+
         ret = Cache.put(url, ret)
 
     return ret
@@ -60,6 +74,16 @@ class Cache(object):
 
     Any paths without a project context will be cleared when updated using this
     cache, but obviously not for other contributors.
+
+    The ETag and Last-Modified validators of each response are stored next to
+    the cached body. Rather than downloading expired or invalidated entries
+    again they are revalidated using a conditional GET which only costs headers
+    when the server responds with 304 Not Modified. The hit, miss, and
+    revalidated counts are kept in Cache.stats.
+
+    Entries are kept by one of the osclib.cache_store backends selected via
+    $OSRT_CACHE_BACKEND: either one file per URL (file, the default) or a single
+    indexed sqlite database (sqlite) which avoids large numbers of inodes.
     """
 
     CACHE_DIR = None
@@ -99,10 +123,21 @@ class Cache(object):
         r'/source/([^/]+)/(?:[^/?]+)(?:\?[^/]+)?$': TTL_DUPLICATE,
     }
 
+    VALIDATORS = {
+        'ETag': 'If-None-Match',
+        'Last-Modified': 'If-Modified-Since',
+    }
+
     last_updated = {}
+    stats = {
+        'hit': 0,
+        'miss': 0,
+        'revalidated': 0,
+        'revalidated_bytes': 0,
+    }
 
     @staticmethod
-    def init(directory='main'):
+    def init(directory='main', backend=None):
         if Cache.CACHE_DIR:
             # Stick with the first initialization to allow for StagingAPI to
             # ensure always enabled, but allow parent to change directory.
@@ -110,6 +145,14 @@ class Cache(object):
 
         Cache.CACHE_DIR = CacheManager.directory('request', directory)
 
+        if backend is None:
+            backend = os.environ.get('OSRT_CACHE_BACKEND', 'file')
+        if backend not in STORES:
+            raise Exception('Unknown cache backend {} (choose from: {})'.format(
+                backend, ', '.join(sorted(STORES))))
+        Cache.store = STORES[backend](Cache.CACHE_DIR)
+        Cache.store.prune(time() - CacheManager.PRUNE_TTL)
+
         Cache.patterns = []
 
         if str2bool(os.environ.get('OSRT_DISABLE_CACHE', '')):
@@ -131,7 +174,6 @@ class Cache(object):
         url = unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
             ttl = Cache.PATTERNS[match]
 
             if project:
@@ -154,10 +196,7 @@ class Cache(object):
 
                 # Treat non-existant cache as brand new for the sake of history
                 # span check since it behaves as desired.
-                age = 0
-                directory = Cache.path(url, project)
-                if os.path.exists(directory):
-                    age = time() - os.path.getmtime(directory)
+                age = Cache.store.project_age(apiurl, project) or 0
 
                 # If history span is shorter than allowed cache life and the age
                 # of the current cache is older than history span with no
@@ -171,12 +210,16 @@ class Cache(object):
                 if history_span < ttl_delta and age_delta > history_span:
                     Cache.delete_project(apiurl, project)
 
-            if os.path.exists(path) and time() - os.path.getmtime(path) <= ttl:
+            age = Cache.store.age(url, project)
+            data = Cache.store.open(url, project) if age is not None and age <= ttl else None
+            if data is not None:
+                Cache.stats['hit'] += 1
                 if conf.config['debug']:
                     print('CACHE_GET', url, file=sys.stderr)
-                return urlopen('file://' + path)
+                return data
             else:
-                reason = '(' + ('expired' if os.path.exists(path) else 'does not exist') + ')'
+                Cache.stats['miss'] += 1
+                reason = '(' + ('expired' if age is not None else 'does not exist') + ')'
                 if conf.config['debug']:
                     print('CACHE_MISS', url, reason, file=sys.stderr)
 
@@ -187,7 +230,6 @@ class Cache(object):
         url = unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True, makedirs=True)
             ttl = Cache.PATTERNS[match]
             if ttl == 0:
                 return data
@@ -196,24 +238,68 @@ class Cache(object):
             # after writing to cache. As such a wrapper must be used. This could
             # be replaced with urlopen('file://...') to be consistent, but until
             # the need arrises BytesIO has less overhead.
+            data_original = data
             text = data.read()
             data = BytesIO(text)
 
+            validators = {}
+            response_headers = getattr(data_original, 'headers', None)
+            if response_headers is not None:
+                for header in Cache.VALIDATORS:
+                    value = response_headers.get(header)
+                    if value:
+                        validators[header] = value
+
             if conf.config['debug']:
                 print('CACHE_PUT', url, project, file=sys.stderr)
-            f = open(path, 'wb')
-            f.write(text)
-            f.close()
+            Cache.store.put(url, project, ttl, text, validators)
 
         return data
 
+    @staticmethod
+    def validators(url):
+        """
+        Conditional request headers for a cached body that can be revalidated.
+        """
+        url = unquote(url)
+        match, project = Cache.match(url)
+        if not match:
+            return {}
+
+        validators = Cache.store.validators(url, project)
+        if not validators:
+            return {}
+
+        headers = {}
+        for header, conditional in Cache.VALIDATORS.items():
+            if header in validators:
+                headers[conditional] = validators[header]
+
+        return headers
+
+    @staticmethod
+    def revalidated(url):
+        """
+        Refresh a cached body after the server indicated it was not modified.
+        """
+        url = unquote(url)
+        _, project = Cache.match(url)
+
+        # Reset the age of the body so that it is valid for another ttl.
+        size = Cache.store.touch(url, project)
+
+        Cache.stats['revalidated'] += 1
+        Cache.stats['revalidated_bytes'] += size
+        if conf.config['debug']:
+            print('CACHE_REVALIDATED', url, file=sys.stderr)
+
+        return Cache.store.open(url, project)
+
     @staticmethod
     def delete(url):
         url = unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
-
             # Rather then wait for last updated statistics to expire, remove the
             # project cache if applicable.
             if project:
@@ -223,10 +309,9 @@ class Cache(object):
                     project = osc.core.get_request(apiurl, project).actions[0].tgt_project
                 Cache.delete_project(apiurl, project)
 
-            if os.path.exists(path):
+            if Cache.store.delete(url, project):
                 if conf.config['debug']:
                     print('CACHE_DELETE', url, file=sys.stderr)
-                os.remove(path)
 
         # Also delete version without query. This does not handle other
         # variations using different query strings. Handy for PUT with ?force=1.
@@ -237,17 +322,13 @@ class Cache(object):
 
     @staticmethod
     def delete_project(apiurl, project):
-        path = Cache.path(apiurl, project)
-
-        if os.path.exists(path):
+        if Cache.store.delete_project(apiurl, project):
             if conf.config['debug']:
                 print('CACHE_DELETE_PROJECT', apiurl, project, file=sys.stderr)
-            rmtree_nfs_safe(path)
 
     @staticmethod
     def delete_all():
-        if os.path.exists(Cache.CACHE_DIR):
-            rmtree_nfs_safe(Cache.CACHE_DIR)
+        Cache.store.delete_all()
 
     @staticmethod
     def match(url):
@@ -271,23 +352,7 @@ class Cache(object):
         if not Cache.CACHE_DIR:
             raise Exception('Cache.init() must be called first')
 
-        parts = [Cache.CACHE_DIR]
-
-        o = urlsplit(url)
-        parts.append(o.hostname)
-
-        if project:
-            parts.append(project)
-
-        directory = os.path.join(*parts)
-        if not os.path.exists(directory) and makedirs:
-            os.makedirs(directory)
-
-        if include_file:
-            parts.append(hashlib.sha1(url.encode('utf-8')).hexdigest())
-            return os.path.join(*parts)
-
-        return directory
+        return FileStore(Cache.CACHE_DIR).path(url, project, include_file, makedirs)
 
     @staticmethod
     def last_updated_load(apiurl):
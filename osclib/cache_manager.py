@@ -16,6 +16,9 @@ from xdg.BaseDirectory import save_cache_path
 class CacheManager(object):
     PRUNE_FREQUENCY = 60 * 60 * 24 * 7
     PRUNE_TTL = 60 * 60 * 24 * 30
+    # Directories not pruned since their contents are persistent, like the
+    # source hash index database and its WAL files.
+    PRUNE_EXCLUDE = ['source-hash']
 
     pruned = False
     test = False
@@ -47,7 +50,12 @@ class CacheManager(object):
         accessed_prune = time() - CacheManager.PRUNE_TTL
         files_pruned = 0
         bytes_pruned = 0
-        for directory, subdirectories, files in os.walk(CacheManager.directory()):
+        cache_root = CacheManager.directory()
+        for directory, subdirectories, files in os.walk(cache_root):
+            subdirectories_count = len(subdirectories)
+            if directory == cache_root:
+                subdirectories[:] = [d for d in subdirectories if d not in CacheManager.PRUNE_EXCLUDE]
+
             files_pruned_directory = 0
             for filename in files:
                 path = os.path.join(directory, filename)
@@ -59,7 +67,7 @@ class CacheManager(object):
                     bytes_pruned += stat.st_size
                     os.remove(path)
 
-            if len(subdirectories) == 0 and len(files) - files_pruned_directory == 0:
+            if subdirectories_count == 0 and len(files) - files_pruned_directory == 0:
                 os.rmdir(directory)
 
         print('> pruned {:,} files comprised of {:,} bytes'.format(
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from io import BytesIO
+from time import time
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from osclib.util import rmtree_nfs_safe
+
+# Storage backends for osclib.cache.Cache. The file store keeps one file per
+# URL which is simple, but results in a large number of inodes and slow prunes
+# on NFS. The sqlite store keeps everything in a single indexed file which turns
+# project invalidation and pruning into single queries.
+
+
+class FileStore(object):
+    """
+    Store each cached body as CACHE_DIR/<host>/<project>/<sha1(url)> and the
+    validators in an accompanying .headers file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, url, project, include_file=False, makedirs=False):
+        parts = [self.directory]
+
+        o = urlsplit(url)
+        parts.append(o.hostname)
+
+        if project:
+            parts.append(project)
+
+        directory = os.path.join(*parts)
+        if makedirs:
+            os.makedirs(directory, exist_ok=True)
+
+        if include_file:
+            parts.append(hashlib.sha1(url.encode('utf-8')).hexdigest())
+            return os.path.join(*parts)
+
+        return directory
+
+    def age(self, url, project):
+        path = self.path(url, project, include_file=True)
+        if not os.path.exists(path):
+            return None
+
+        return time() - os.path.getmtime(path)
+
+    def project_age(self, apiurl, project):
+        directory = self.path(apiurl, project)
+        if not os.path.exists(directory):
+            return None
+
+        return time() - os.path.getmtime(directory)
+
+    def open(self, url, project):
+        return urlopen('file://' + self.path(url, project, include_file=True))
+
+    def put(self, url, project, ttl, text, validators):
+        path = self.path(url, project, include_file=True, makedirs=True)
+        # Write atomically as the same URL may be cached by concurrent threads.
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False) as f:
+            f.write(text)
+        os.replace(f.name, path)
+
+        if validators:
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False) as f:
+                json.dump(validators, f)
+            os.replace(f.name, path + '.headers')
+        elif os.path.exists(path + '.headers'):
+            os.remove(path + '.headers')
+
+    def validators(self, url, project):
+        path = self.path(url, project, include_file=True)
+        if not os.path.exists(path) or not os.path.exists(path + '.headers'):
+            return None
+
+        try:
+            with open(path + '.headers', 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def touch(self, url, project):
+        path = self.path(url, project, include_file=True)
+        os.utime(path, None)
+        return os.path.getsize(path)
+
+    def delete(self, url, project):
+        path = self.path(url, project, include_file=True)
+        deleted = os.path.exists(path)
+        if deleted:
+            os.remove(path)
+        if os.path.exists(path + '.headers'):
+            os.remove(path + '.headers')
+
+        return deleted
+
+    def delete_project(self, apiurl, project):
+        path = self.path(apiurl, project)
+        if not os.path.exists(path):
+            return False
+
+        # Entries with validators are kept, but marked as expired, so that they
+        # are revalidated upon next use instead of being downloaded again.
+        revalidate = False
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.endswith('.headers'):
+                    continue
+
+                if os.path.exists(entry.path + '.headers'):
+                    os.utime(entry.path, (entry.stat().st_atime, 0))
+                    revalidate = True
+                else:
+                    os.remove(entry.path)
+
+        if revalidate:
+            # Reset the age of the project cache as the removal would have.
+            os.utime(path, None)
+        else:
+            rmtree_nfs_safe(path)
+
+        return True
+
+    def delete_all(self):
+        if os.path.exists(self.directory):
+            rmtree_nfs_safe(self.directory)
+
+    def prune(self, accessed_before):
+        # Handled by CacheManager.prune_all() walking the cache directory.
+        pass
+
+
+class SQLiteStore(object):
+    """
+    Store all cached bodies in a single sqlite database keyed by URL with the
+    host and project indexed for invalidation and the access time indexed for
+    pruning.
+    """
+
+    FILENAME = 'cache.sqlite'
+    # Avoid a write for every read by only updating the access time used for
+    # pruning once it is older than this.
+    ACCESSED_RESOLUTION = 60 * 60 * 24
+
+    def __init__(self, directory):
+        self.directory = directory
+        # sqlite connections may not be shared between threads.
+        self._local = threading.local()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # Nor may they be shared with a forked process.
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+
+            connection = self._local.connection = sqlite3.connect(
+                os.path.join(self.directory, self.FILENAME), timeout=60, isolation_level=None)
+            # Readers do not block on writers nor the other way around.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    url TEXT PRIMARY KEY,
+                    host TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    ttl INTEGER NOT NULL,
+                    stored REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    validators TEXT,
+                    body BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS cache_project ON cache (host, project);
+                CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+                CREATE TABLE IF NOT EXISTS project (
+                    host TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (host, project)
+                );
+            """)
+
+        return connection
+
+    @staticmethod
+    def key(url, project):
+        return urlsplit(url).hostname, project or ''
+
+    def age(self, url, project):
+        row = self.connection.execute('SELECT stored FROM cache WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+
+        return time() - row[0]
+
+    def project_age(self, apiurl, project):
+        row = self.connection.execute(
+            'SELECT updated FROM project WHERE host = ? AND project = ?', self.key(apiurl, project)).fetchone()
+        if row is None:
+            return None
+
+        return time() - row[0]
+
+    def open(self, url, project):
+        now = time()
+        row = self.connection.execute('SELECT body, accessed FROM cache WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            # Removed by another process since checking the age.
+            return None
+
+        body, accessed = row
+        if now - accessed > self.ACCESSED_RESOLUTION:
+            self.connection.execute('UPDATE cache SET accessed = ? WHERE url = ?', (now, url))
+
+        # BytesIO shares the buffer of the bytes object rather than copying it.
+        return BytesIO(body)
+
+    def put(self, url, project, ttl, text, validators):
+        host, project = self.key(url, project)
+        now = time()
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            exists = self.connection.execute('SELECT 1 FROM cache WHERE url = ?', (url,)).fetchone()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, host, project, ttl, now, now, json.dumps(validators) if validators else None, text))
+            if not exists:
+                # Mirror the file store where a new entry updates the directory.
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO project VALUES (?, ?, ?)', (host, project, now))
+
+    def validators(self, url, project):
+        row = self.connection.execute('SELECT validators FROM cache WHERE url = ?', (url,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+
+        return json.loads(row[0])
+
+    def touch(self, url, project):
+        now = time()
+        self.connection.execute('UPDATE cache SET stored = ?, accessed = ? WHERE url = ?', (now, now, url))
+        return self.connection.execute('SELECT length(body) FROM cache WHERE url = ?', (url,)).fetchone()[0]
+
+    def delete(self, url, project):
+        return self.connection.execute('DELETE FROM cache WHERE url = ?', (url,)).rowcount > 0
+
+    def delete_project(self, apiurl, project):
+        key = self.key(apiurl, project)
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            if self.connection.execute('SELECT 1 FROM project WHERE host = ? AND project = ?', key).fetchone() is None:
+                return False
+
+            # Entries with validators are marked as expired to be revalidated.
+            self.connection.execute(
+                'DELETE FROM cache WHERE host = ? AND project = ? AND validators IS NULL', key)
+            self.connection.execute(
+                'UPDATE cache SET stored = 0 WHERE host = ? AND project = ?', key)
+            self.connection.execute(
+                'UPDATE project SET updated = ? WHERE host = ? AND project = ?', (time(),) + key)
+
+        return True
+
+    def delete_all(self):
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute('DELETE FROM cache')
+            self.connection.execute('DELETE FROM project')
+
+    def prune(self, accessed_before):
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute(
+                'DELETE FROM cache WHERE accessed < ? OR (validators IS NULL AND stored + ttl < ?)',
+                (accessed_before, time()))
+            self.connection.execute(
+                'DELETE FROM project WHERE NOT EXISTS '
+                '(SELECT 1 FROM cache WHERE cache.host = project.host AND cache.project = project.project)')
+
+
+STORES = {
+    'file': FileStore,
+    'sqlite': SQLiteStore,
+}
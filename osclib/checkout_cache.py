@@ -0,0 +1,222 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from urllib.error import HTTPError
+
+from lxml import etree as ET
+from osc.core import http_GET
+from osc.core import makeurl
+
+from osclib.cache_manager import CacheManager
+
+# Package checkouts re-download every file of a package even if only a single
+# file changed since the previous checkout, which is costly for large packages
+# checked again and again by superseding requests. Files are instead stored by
+# their md5 and working trees are populated from the store so that only changed
+# files are downloaded.
+
+# ioctl to share the data of a file on copy-on-write filesystems (FICLONE).
+FICLONE = 0x40049409
+
+
+class CheckoutCache(object):
+    """
+    Store package source files as <directory>/<md5[:2]>/<md5> and populate
+    working trees from it by reflink where supported or by hardlink otherwise.
+    Stored files are read-only so that a hardlinked working tree can not modify
+    them by accident and are verified before reuse as anything writing in place
+    regardless would. Once the store exceeds size_limit the least recently used
+    files are evicted.
+    """
+
+    BUFSIZE = 1024 * 1024
+    SIZE_LIMIT = 10 * 1024 * 1024 * 1024
+    # Fraction of size_limit to evict down to so that pruning is infrequent.
+    PRUNE_TARGET = 0.8
+
+    def __init__(self, directory, size_limit=SIZE_LIMIT):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.reflink = True
+
+    def path(self, md5):
+        return os.path.join(self.directory, md5[:2], md5)
+
+    @staticmethod
+    def _listing(apiurl, project, package, query):
+        return ET.parse(http_GET(makeurl(apiurl, ['source', project, package], query))).getroot()
+
+    def listing(self, apiurl, project, package, revision=None, expand_link=False, server_service_files=False):
+        """
+        Return the source listing of the package revision to check out like
+        osc.core.checkout_package() with the same flags.
+        """
+        query = {}
+        if revision:
+            query['rev'] = revision
+        if server_service_files:
+            # Expands the link as well.
+            query['expand'] = 1
+            try:
+                return self._listing(apiurl, project, package, query)
+            except HTTPError as e:
+                # Check out the base of a broken link just like osc.
+                if e.code != 400:
+                    raise
+
+                query['linkrev'] = 'base'
+                return self._listing(apiurl, project, package, query)
+
+        root = self._listing(apiurl, project, package, query)
+        if not expand_link:
+            return root
+
+        # Check out the expanded link sources, or those of the base of a broken
+        # link, by their xsrcmd5 just like osc.
+        linkinfo = root.find('linkinfo')
+        if linkinfo is not None and linkinfo.get('error'):
+            linkinfo = self._listing(apiurl, project, package, dict(query, linkrev='base')).find('linkinfo')
+        if linkinfo is None or not linkinfo.get('xsrcmd5'):
+            return root
+
+        return self._listing(apiurl, project, package, {'rev': linkinfo.get('xsrcmd5')})
+
+    def checkout(self, apiurl, project, package, directory, revision=None,
+                 expand_link=False, server_service_files=False):
+        """Populate directory with the files of the package revision."""
+        root = self.listing(apiurl, project, package, revision, expand_link, server_service_files)
+        # The srcmd5 of an expanded listing identifies the expanded sources.
+        srcmd5 = root.get('srcmd5')
+
+        os.makedirs(directory)
+        fetched = 0
+        for entry in root.findall('entry'):
+            name = entry.get('name')
+            md5 = entry.get('md5')
+            size = entry.get('size')
+            size = int(size) if size else None
+            target = os.path.join(directory, name)
+
+            path, fetched_size = self.fetch(apiurl, project, package, name, srcmd5, md5, size)
+            try:
+                self.place(path, target)
+            except FileNotFoundError:
+                # Evicted by a concurrent checkout in the meantime.
+                path, fetched_size = self.fetch(apiurl, project, package, name, srcmd5, md5, size)
+                self.place(path, target)
+            fetched += fetched_size
+
+        if fetched:
+            self.prune()
+
+        return fetched
+
+    def verify(self, path, md5, size=None):
+        """Return True if the stored file still has the given size and md5."""
+        if size is not None and os.path.getsize(path) != size:
+            return False
+
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.BUFSIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest() == md5
+
+    def fetch(self, apiurl, project, package, name, revision, md5, size=None):
+        """Return the path of the stored file and the number of bytes downloaded."""
+        path = self.path(md5)
+        try:
+            if self.verify(path, md5, size):
+                # The modification time of a stored file tracks its last use.
+                os.utime(path)
+                return path, 0
+            # Modified in place through a hardlink, so replaced below.
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.md5()
+        size = 0
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False) as f:
+            try:
+                response = http_GET(makeurl(apiurl, ['source', project, package, name], {'rev': revision}))
+                for chunk in iter(lambda: response.read(self.BUFSIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.remove(f.name)
+                raise
+
+        if digest.hexdigest() != md5:
+            os.remove(f.name)
+            raise ValueError(f'{project}/{package}/{name} does not match md5 {md5}')
+
+        os.chmod(f.name, 0o444)
+        # Write atomically as the same file may be fetched by concurrent checkouts.
+        os.replace(f.name, path)
+
+        return path, size
+
+    def place(self, path, target):
+        if self.reflink:
+            try:
+                with open(path, 'rb') as source, open(target, 'wb') as f:
+                    fcntl.ioctl(f.fileno(), FICLONE, source.fileno())
+                return
+            except FileNotFoundError:
+                raise
+            except OSError as e:
+                os.remove(target)
+                if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                    self.reflink = False
+
+        try:
+            os.link(path, target)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # Cache on another filesystem or maximum number of links reached.
+            shutil.copyfile(path, target)
+
+    def prune(self):
+        """Evict the least recently used files once over size_limit."""
+        files = []
+        total = 0
+        with os.scandir(self.directory) as subdirectories:
+            for subdirectory in subdirectories:
+                if not subdirectory.is_dir():
+                    continue
+
+                with os.scandir(subdirectory.path) as entries:
+                    for entry in entries:
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+
+        if total <= self.size_limit:
+            return
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.size_limit * self.PRUNE_TARGET:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+CHECKOUT_CACHE = None
+
+
+def checkout_cache():
+    global CHECKOUT_CACHE
+    if CHECKOUT_CACHE is None:
+        CHECKOUT_CACHE = CheckoutCache(CacheManager.directory('checkout'))
+    return CHECKOUT_CACHE
@@ -1,6 +1,7 @@
 from collections import namedtuple
 from datetime import datetime, timezone
 from dateutil.parser import parse as date_parse
+from io import BytesIO
 import re
 import socket
 import logging
@@ -23,7 +24,6 @@ from osc.connection import http_POST
 from osc.connection import http_PUT
 from osc.core import makeurl
 from osc.core import owner
-from osc.core import search as osc_core_search
 from osc.core import Request
 from osc.core import Action
 from osc.core import show_package_meta
@@ -34,6 +34,7 @@ from osc.util.helper import decode_it
 from osc import conf
 from osclib.conf import Config
 from osclib.memoize import memoize
+from osclib.source_hash_index import SOURCE_HASH_INDEX
 import traceback
 
 BINARY_REGEX = r'(?:.*::)?(?P<filename>(?P<name>.*)-(?P<version>[^-]+)-(?P<release>[^-]+)\.(?P<arch>[^-\.]+))'
@@ -74,6 +75,13 @@ def get_request_list_with_history(
         DeprecationWarning
     )
 
+    xpath = request_list_xpath(project, package, req_who, req_state, req_type, exclude_target_projects)
+    return list(request_list_paginated(apiurl, xpath))
+
+
+def request_list_xpath(
+        project='', package='', req_who='', req_state=('new', 'review', 'declined'),
+        req_type=None, exclude_target_projects=[]):
     xpath = ''
     if 'all' not in req_state:
         for state in req_state:
@@ -101,16 +109,20 @@ def get_request_list_with_history(
 
     if conf.config['verbose'] > 1:
         print(f'[ {xpath} ]')
-    queries = {}
-    queries['request'] = {'withfullhistory': '1'}
-    res = osc_core_search(apiurl, queries=queries, request=xpath)
-    collection = res['request']
-    requests = []
-    for root in collection.findall('request'):
-        r = Request()
-        r.read(root)
-        requests.append(r)
-    return requests
+
+    return xpath
+
+
+def request_list_paginated(apiurl, xpath, withfullhistory=True):
+    """
+    Yield the requests matching xpath as osc Request objects while only
+    holding a single page of the search results.
+    """
+    query = {'withfullhistory': 1} if withfullhistory else {}
+    for request_element in search_paginated(apiurl, 'request', xpath, query):
+        request = Request()
+        request.read(request_element)
+        yield request
 
 
 def convert_from_osc_et(xml):
@@ -334,6 +346,52 @@ def devel_project_get(apiurl: str, target_project: str, target_package: str) ->
     return None, None
 
 
+def devel_project_get_map(apiurl, target_project, target_packages, chunk=50):
+    """
+    Return the devel project & package of those target_packages which define
+    one in their meta as a dict, like devel_project_get(), using a single search
+    per chunk of packages instead of a meta request per package.
+    """
+    devel = {}
+
+    target_packages = sorted(set(target_packages))
+    for i in range(0, len(target_packages), chunk):
+        xpath = ''
+        for target_package in target_packages[i:i + chunk]:
+            xpath = xpath_join(xpath, f"@name='{target_package}'", op='or')
+        root = search(apiurl, 'package', f"@project='{target_project}' and ({xpath}) and devel/@project!=''")
+
+        for node in root.xpath('package/devel'):
+            devel[node.getparent().get('name')] = node.get('project'), node.get('package')
+
+    return devel
+
+
+def devel_project_get_git_map(apiurl, target_packages, chunk=50):
+    """
+    Return the devel project & package of those openSUSE:Factory target_packages
+    which are listed in factory_git_devel_project_mapping() and exist in their
+    devel project as a dict, like devel_project_get(), using a single search
+    per chunk of packages instead of a request per package.
+    """
+    devel_pkgs = factory_git_devel_project_mapping(apiurl)
+    devel = {}
+
+    target_packages = sorted(set(target_packages) & set(devel_pkgs))
+    for i in range(0, len(target_packages), chunk):
+        xpath = ''
+        for target_package in target_packages[i:i + chunk]:
+            xpath = xpath_join(xpath, f"(@project='{devel_pkgs[target_package]}' and @name='{target_package}')", op='or')
+        root = search(apiurl, 'package', xpath)
+
+        for node in root.findall('package'):
+            name = node.get('name')
+            if devel_pkgs.get(name) == node.get('project'):
+                devel[name] = node.get('project'), name
+
+    return devel
+
+
 @memoize(session=True)
 def devel_project_fallback(apiurl, target_project, target_package):
     project, package = devel_project_get(apiurl, target_project, target_package)
@@ -362,6 +420,29 @@ def devel_projects(apiurl, project):
     return sorted(devel_projects)
 
 
+def devel_projects_map(apiurl, projects, chunk=50):
+    """
+    Return the devel_projects() of each of the projects using a single search
+    per chunk of projects instead of one per project.
+    """
+    devel_projects = {project: set() for project in projects}
+
+    projects = sorted(devel_projects)
+    for i in range(0, len(projects), chunk):
+        xpath = ''
+        for project in projects[i:i + chunk]:
+            xpath = xpath_join(xpath, f"@project='{project}'", op='or')
+        root = search(apiurl, 'package', f"({xpath}) and devel/@project!=''")
+
+        for devel in root.xpath('package/devel'):
+            project = devel.getparent().get('project')
+            devel_project = devel.get('project')
+            if project in devel_projects and devel_project != project:
+                devel_projects[project].add(devel_project)
+
+    return {project: sorted(devel) for project, devel in devel_projects.items()}
+
+
 def request_created(request):
     if isinstance(request, Request):
         created = request.statehistory[0].when
@@ -494,7 +575,7 @@ def project_pseudometa_file_ensure(apiurl, project, filename, content, comment=N
 # https://lists.opensuse.org/opensuse-buildservice/2019-05/msg00020.html.
 
 
-def package_list_kind_filtered(apiurl, project, kinds_allowed=['source']):
+def package_list_sourceinfo(apiurl, project):
     query = {
         'view': 'info',
         'nofilename': '1',
@@ -502,7 +583,11 @@ def package_list_kind_filtered(apiurl, project, kinds_allowed=['source']):
     url = makeurl(apiurl, ['source', project], query)
     root = ET.parse(http_GET(url)).getroot()
 
-    for package in root.xpath('sourceinfo/@package'):
+    return root.xpath('sourceinfo/@package')
+
+
+def package_list_kind_filtered(apiurl, project, kinds_allowed=['source']):
+    for package in package_list_sourceinfo(apiurl, project):
         kind = package_kind(apiurl, project, package)
         if kind not in kinds_allowed:
             continue
@@ -819,6 +904,11 @@ def package_source_hash(apiurl, project, package, revision=None):
     # Will not catch packages that previous had a link, but no longer do.
     if package_source_link_copy(apiurl, project, package):
         query['expand'] = 1
+    elif SOURCE_HASH_INDEX.indexable(revision):
+        # The expansion depends on the link target so only plain revisions are indexed.
+        source_hash = SOURCE_HASH_INDEX.lookup(apiurl, project, package, [revision]).get(revision)
+        if source_hash is not None:
+            return source_hash
 
     try:
         url = makeurl(apiurl, ['source', project, package], query)
@@ -835,7 +925,11 @@ def package_source_hash(apiurl, project, package, revision=None):
         return None
 
     from osclib.util import sha1_short
-    return sha1_short(root.xpath('entry[@name!="_link"]/@md5'))
+    source_hash = sha1_short(root.xpath('entry[@name!="_link"]/@md5'))
+    if 'expand' not in query:
+        SOURCE_HASH_INDEX.add(apiurl, project, package, revision, source_hash)
+
+    return source_hash
 
 
 def package_source_hash_history(apiurl, project, package, limit=5, include_project_link=False):
@@ -853,8 +947,15 @@ def package_source_hash_history(apiurl, project, package, limit=5, include_proje
         source_hashes = []
 
     source_md5s = root.xpath('logentry/@srcmd5')
+    # Look up all revisions at once and only request those not yet indexed.
+    indexed = {}
+    if not package_source_link_copy(apiurl, project, package):
+        indexed = SOURCE_HASH_INDEX.lookup(apiurl, project, package, source_md5s[:limit])
+
     for source_md5 in source_md5s[:limit]:
-        source_hash = package_source_hash(apiurl, project, package, source_md5)
+        source_hash = indexed.get(source_md5)
+        if source_hash is None:
+            source_hash = package_source_hash(apiurl, project, package, source_md5)
         yield source_hash
 
         if include_project_link:
@@ -1067,6 +1168,112 @@ def search(apiurl, path, xpath, query={}):
     return ET.parse(http_GET(url)).getroot()
 
 
+def search_paginated(apiurl, path, xpath, query={}, limit=1000):
+    """
+    Yield the elements matching xpath page by page with each page parsed
+    incrementally. Each element is cleared once the next one is requested so
+    anything needed later must be extracted from it beforehand.
+    """
+    # Collections are named after the singular element, like package/project.
+    query = dict(query, match=xpath, limit=limit, offset=0)
+    while True:
+        url = makeurl(apiurl, ['search', path], query)
+        # Read the page before parsing rather than holding the connection open
+        # while the consumer processes each element.
+        page = BytesIO(http_GET(url).read())
+        count = 0
+        for _, element in ET.iterparse(page, tag=path):
+            yield element
+            count += 1
+
+            # Release the element and those preceding it within the collection.
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        if count < limit:
+            break
+        query['offset'] += limit
+
+
+def latest_updated_since(apiurl, since, limit=5000):
+    """
+    Return the packages updated after the since UTC datetime by project, with
+    None included for updates of the project itself, or None if the latest
+    updates do not reach back far enough to cover since.
+    """
+    # Same query as Cache.last_updated_load() to share the cached response.
+    url = makeurl(apiurl, ['statistics', 'latest_updated'], {'limit': limit})
+    root = ET.parse(http_GET(url)).getroot()
+
+    updated = {}
+    covered = len(root) < limit
+    for entity in root:
+        if datetime.strptime(entity.get('updated'), '%Y-%m-%dT%H:%M:%SZ') < since:
+            covered = True
+            continue
+
+        # Entities repesent either a project or package.
+        if entity.tag == 'project':
+            updated.setdefault(entity.get('name'), set()).add(None)
+        else:
+            updated.setdefault(entity.get('project'), set()).add(entity.get('name'))
+
+    return updated if covered else None
+
+
+def request_packages_since(apiurl, projects, since, chunk=50):
+    """
+    Return the package names of requests involving the projects, including
+    incidents released into them, whose state changed after the since UTC
+    datetime. Maintenance package names are included without their suffix.
+    """
+    maintenance_projects = tuple(project_attribute_list(apiurl, 'OBS:MaintenanceProject'))
+
+    # Only search the requests involving the projects in chunks of conditions
+    # rather than every request of the instance.
+    conditions = []
+    for project in sorted(projects):
+        conditions.append(f"action/target/@project='{project}'")
+        conditions.append(f"action/source/@project='{project}'")
+        conditions.append(f"action/target/@releaseproject='{project}'")
+    for project in maintenance_projects:
+        conditions.append(f"starts-with(action/target/@project,'{project}')")
+
+    packages = set()
+    for i in range(0, len(conditions), chunk):
+        xpath = ''
+        for condition in conditions[i:i + chunk]:
+            xpath = xpath_join(xpath, condition, op='or')
+        xpath = f"state/@when>='{since.strftime('%Y-%m-%dT%H:%M:%S')}' and ({xpath})"
+
+        for request_element in search_paginated(apiurl, 'request', xpath):
+            request = Request()
+            request.read(request_element)
+            packages.update(request_packages_involved(request, projects, maintenance_projects))
+
+    return packages
+
+
+def request_packages_involved(request, projects, maintenance_projects):
+    packages = set()
+    for action in request.actions:
+        # Actions only have the attributes relevant to their type.
+        target_project = getattr(action, 'tgt_project', None)
+        involved = {getattr(action, 'src_project', None), target_project,
+                    getattr(action, 'tgt_releaseproject', None)}
+        if not involved & set(projects) and not (
+                target_project and target_project.startswith(maintenance_projects)):
+            continue
+
+        for package in (getattr(action, 'src_package', None), getattr(action, 'tgt_package', None)):
+            if package:
+                packages.add(package)
+                packages.add(package.split('.', 1)[0])
+
+    return packages
+
+
 def action_is_patchinfo(action):
     return (action.type == 'maintenance_incident' and (
         action.src_package == 'patchinfo' or action.src_package.startswith('patchinfo.')))
@@ -0,0 +1,73 @@
+# Stream parser for the newc cpio archives of rpm payloads as written by
+# rpm2cpio and of the cpioheaders view of OBS, which avoids storing the archive
+# before extracting the wanted members.
+
+
+class CpioError(Exception):
+    pass
+
+
+class CpioStream(object):
+    """Sequentially read the members of a newc cpio archive from a stream.
+
+    Iterating yields (filename, mode, size) of each member. Member data not
+    copied via copy() before advancing is skipped, so the archive
+    never needs to be stored or seeked.
+    """
+
+    HEADER_SIZE = 110
+    MAGIC = (b'070701', b'070702')
+    TRAILER = b'TRAILER!!!'
+    # large copies to keep the number of syscalls low
+    BUFSIZE = 1024 * 1024
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.remaining = 0
+        self.padding = 0
+
+    def _read(self, size):
+        buf = self.fh.read(size)
+        # pipes and responses may return less than requested
+        while len(buf) < size:
+            chunk = self.fh.read(size - len(buf))
+            if not chunk:
+                raise CpioError('truncated cpio archive')
+            buf += chunk
+        return buf
+
+    def _skip(self, size):
+        while size:
+            size -= len(self._read(min(size, self.BUFSIZE)))
+
+    @staticmethod
+    def _pad(size):
+        return (4 - size % 4) % 4
+
+    def __iter__(self):
+        while True:
+            self._skip(self.remaining + self.padding)
+            self.remaining = self.padding = 0
+
+            header = self._read(self.HEADER_SIZE)
+            if header[:6] not in self.MAGIC:
+                raise CpioError('invalid cpio header')
+            mode = int(header[14:22], 16)
+            size = int(header[54:62], 16)
+            namesize = int(header[94:102], 16)
+
+            name = self._read(namesize)[:-1]
+            self._skip(self._pad(self.HEADER_SIZE + namesize))
+            if name == self.TRAILER:
+                return
+
+            self.remaining = size
+            self.padding = self._pad(size)
+            yield name, mode, size
+
+    def copy(self, dst):
+        """Copy the data of the current member to the file object dst."""
+        while self.remaining:
+            buf = self._read(min(self.remaining, self.BUFSIZE))
+            dst.write(buf)
+            self.remaining -= len(buf)
@@ -1,13 +1,142 @@
+import atexit
 from datetime import datetime
 import fcntl
 from functools import wraps
+import hashlib
 import os
 from osclib.cache_manager import CacheManager
 import shelve
+import sqlite3
 import pickle
+import threading
+from time import time
 
 # Where the cache files are stored
 CACHEDIR = CacheManager.directory('memoize')
+# Backend used for persistent caches: shelve or sqlite (see MemoStore).
+BACKEND = os.environ.get('OSRT_MEMOIZE_BACKEND', 'shelve')
+
+
+class MemoStore(object):
+    """Persistent memoize cache backed by sqlite.
+
+    Unlike the shelve backend no exclusive file lock is held for the duration
+    of a call. Reads are plain selects, which never block in WAL mode, while
+    writes and access time updates are queued and flushed in batches. Keys are
+    spread over a fixed number of buckets each holding an equal share of the
+    slots and eviction removes the least recently used entry of the bucket
+    being written, which approximates LRU over the whole cache at constant
+    cost.
+    """
+
+    BUCKETS = 64
+    BATCH = 32
+
+    def __init__(self, filename, slots):
+        self.filename = filename
+        self.capacity = max(1, slots // self.BUCKETS)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.touched = {}
+        self._connection = None
+        atexit.register(self.flush)
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # The connection must not be shared with a forked process and queued
+        # entries are left to be written by the parent.
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.touched = {}
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filename, timeout=60, isolation_level=None, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS memo (
+                    key BLOB PRIMARY KEY,
+                    bucket INTEGER NOT NULL,
+                    timestamp REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    value BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS memo_bucket ON memo (bucket, accessed);
+            """)
+
+        return self._connection
+
+    @staticmethod
+    def key(obj):
+        return hashlib.sha1(pickle.dumps(obj, protocol=-1)).digest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.pending:
+                timestamp, value = self.pending[key]
+                return timestamp, pickle.loads(value)
+
+            row = self.connection.execute('SELECT timestamp, value FROM memo WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+
+            self.touched[key] = time()
+            return datetime.fromtimestamp(row[0]), pickle.loads(row[1])
+
+    def set(self, key, timestamp, value):
+        with self.lock:
+            self.pending[key] = (timestamp, pickle.dumps(value, protocol=-1))
+            self.touched.pop(key, None)
+            if len(self.pending) >= self.BATCH:
+                self._flush()
+
+    def delete(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+            self.touched.pop(key, None)
+            self.connection.execute('DELETE FROM memo WHERE key = ?', (key,))
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+            self.touched = {}
+            self.connection.execute('DELETE FROM memo')
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending and not self.touched:
+            return
+
+        connection = self.connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'UPDATE memo SET accessed = ? WHERE key = ?',
+                [(accessed, key) for key, accessed in self.touched.items()])
+
+            now = time()
+            for key, (timestamp, value) in self.pending.items():
+                bucket = key[0] % self.BUCKETS
+                exists = connection.execute('SELECT 1 FROM memo WHERE key = ?', (key,)).fetchone()
+                if not exists:
+                    count = connection.execute('SELECT count(*) FROM memo WHERE bucket = ?', (bucket,)).fetchone()[0]
+                    if count >= self.capacity:
+                        connection.execute(
+                            'DELETE FROM memo WHERE key IN '
+                            '(SELECT key FROM memo WHERE bucket = ? ORDER BY accessed LIMIT ?)',
+                            (bucket, count - self.capacity + 1))
+                connection.execute(
+                    'INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?)',
+                    (key, bucket, timestamp.timestamp(), now, value))
+
+        self.pending = {}
+        self.touched = {}
 
 
 def memoize(ttl=None, session=False, add_invalidate=False):
@@ -17,6 +146,13 @@ def memoize(ttl=None, session=False, add_invalidate=False):
     ... def test_func(a):
     ...     return a
 
+    Persistent caches use either a shelve per function (the default) or, when
+    $OSRT_MEMOIZE_BACKEND is set to sqlite, a MemoStore per function which
+    avoids serializing parallel processes on a single lock.
+
+    Session caches may be shared by threads. Concurrent calls with the same
+    arguments wait for the first one instead of calling the function again.
+
     Internally, the memoized function has a cache:
 
     >>> cache = [c.cell_contents for c in test_func.func_closure if 'sync' in dir(c.cell_contents)][0]
@@ -70,7 +206,6 @@ def memoize(ttl=None, session=False, add_invalidate=False):
     SLOTS = 4096            # Number of slots in the cache file
     NCLEAN = 1024           # Number of slots to remove when limit reached
     TIMEOUT = 60 * 60 * 2   # Time to live for every cache slot (seconds)
-    memoize.session_functions = []
 
     def _memoize(fn):
         # Implement a POSIX lock / unlock extension for shelves. Inspired
@@ -92,10 +227,11 @@ def memoize(ttl=None, session=False, add_invalidate=False):
                 # closed by gc
                 cache.lckfile = lckfile
             else:
-                if not hasattr(fn, '_memoize_session_cache'):
-                    fn._memoize_session_cache = {}
-                    memoize.session_functions.append(fn)
-                cache = fn._memoize_session_cache
+                with memoize.session_lock:
+                    if not hasattr(fn, '_memoize_session_cache'):
+                        fn._memoize_session_cache = {}
+                        memoize.session_functions.append(fn)
+                    cache = fn._memoize_session_cache
             return cache
 
         def _close_cache(cache):
@@ -122,19 +258,31 @@ def memoize(ttl=None, session=False, add_invalidate=False):
             return key if session else str(key)
 
         def _invalidate(*args, **kwargs):
-            key = _key((args, kwargs))
+            if store:
+                store.delete(store.key(args))
+                return
+
+            key = _key(args)
             cache = _open_cache(cache_name)
             if key in cache:
                 del cache[key]
+            _close_cache(cache)
 
         def _invalidate_all():
+            if store:
+                store.clear()
+                return
+
             cache = _open_cache(cache_name)
             cache.clear()
+            _close_cache(cache)
 
         def _add_invalidate_method(_self):
             name = f'_invalidate_{fn.__name__}'
             if not hasattr(_self, name):
-                setattr(_self, name, _invalidate)
+                # Build the key the same way as _fn() including the instance.
+                first = str(_self)
+                setattr(_self, name, lambda *args, **kwargs: _invalidate(first, args, kwargs))
 
             name = '_invalidate_all'
             if not hasattr(_self, name):
@@ -142,14 +290,26 @@ def memoize(ttl=None, session=False, add_invalidate=False):
 
         @wraps(fn)
         def _fn(*args, **kwargs):
-            def total_seconds(td):
-                return (td.microseconds + (td.seconds + td.days * 24 * 3600.) * 10**6) / 10**6
             now = datetime.now()
             if add_invalidate:
                 _self = args[0]
                 _add_invalidate_method(_self)
             first = str(args[0]) if isinstance(args[0], object) else args[0]
+            if store:
+                key = store.key((first, args[1:], kwargs))
+                entry = store.get(key)
+                if entry:
+                    timestamp, value = entry
+                    if total_seconds(now - timestamp) < ttl:
+                        return value
+                value = fn(*args, **kwargs)
+                store.set(key, now, value)
+                return value
+
             key = _key((first, args[1:], kwargs))
+            if session:
+                return _session_call(key, now, args, kwargs)
+
             updated = False
             cache = _open_cache(cache_name)
             if key in cache:
@@ -162,14 +322,60 @@ def memoize(ttl=None, session=False, add_invalidate=False):
             _close_cache(cache)
             return value
 
+        def _session_call(key, now, args, kwargs):
+            while True:
+                with memoize.session_lock:
+                    cache = _open_cache(cache_name)
+                    if key in cache:
+                        timestamp, value = cache[key]
+                        if total_seconds(now - timestamp) < ttl:
+                            return value
+
+                    event = calls.get(key)
+                    if event is None:
+                        event = calls[key] = threading.Event()
+                        break
+
+                # Wait for the thread already calling and use its result or
+                # call if it failed.
+                event.wait()
+
+            try:
+                value = fn(*args, **kwargs)
+                with memoize.session_lock:
+                    cache = _open_cache(cache_name)
+                    cache[key] = (now, value)
+                    _clean_cache(cache)
+            finally:
+                with memoize.session_lock:
+                    del calls[key]
+                event.set()
+
+            return value
+
+        def total_seconds(td):
+            return (td.microseconds + (td.seconds + td.days * 24 * 3600.) * 10**6) / 10**6
+
         cache_name = os.path.join(CACHEDIR, fn.__name__)
+        # Events of the session calls in progress by key.
+        calls = {}
+        store = None
+        if not session and BACKEND == 'sqlite':
+            store = MemoStore(cache_name + '.sqlite', SLOTS)
         return _fn
 
     ttl = ttl if ttl else TIMEOUT
     return _memoize
 
 
+# Shared by all session caches, created once so that every memoized function
+# guards its cache with the same lock and memoize_session_reset() sees them all.
+memoize.session_functions = []
+memoize.session_lock = threading.RLock()
+
+
 def memoize_session_reset():
     """Reset all session caches."""
-    for i, _ in enumerate(memoize.session_functions):
-        memoize.session_functions[i]._memoize_session_cache = {}
+    with memoize.session_lock:
+        for i, _ in enumerate(memoize.session_functions):
+            memoize.session_functions[i]._memoize_session_cache = {}
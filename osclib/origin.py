@@ -1,4 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from functools import partial
 import logging
 from typing import Any, Dict, Generator, List, NamedTuple, Optional, Tuple, Union
 try:
@@ -12,7 +14,10 @@ from osclib.conf import str2bool
 from osclib.core import attribute_value_load
 from osclib.core import devel_project_get
 from osclib.core import devel_projects
+from osclib.core import devel_projects_map
 from osclib.core import entity_exists
+from osclib.core import entity_source_link
+from osclib.core import latest_updated_since
 from osclib.core import package_source_age
 from osclib.core import package_source_hash
 from osclib.core import package_source_hash_history
@@ -26,6 +31,7 @@ from osclib.core import request_action_list_source
 from osclib.core import request_create_change_devel
 from osclib.core import request_create_delete
 from osclib.core import request_create_submit
+from osclib.core import request_packages_since
 from osclib.core import request_remote_identifier
 from osclib.core import review_find_last
 from osclib.core import reviews_remaining
@@ -34,6 +40,7 @@ from osclib.memoize import memoize_session_reset
 from osclib.util import project_list_family
 from osclib.util import project_list_family_prior_pattern
 import re
+from urllib.error import HTTPError
 import yaml
 
 NAME = 'origin-manager'
@@ -880,9 +887,19 @@ def origin_update_initial_blacklisted_patterns(apiurl, target_project):
     return patterns
 
 
-@memoize(session=True)
-def origin_updatable(apiurl):
-    """ List of origin managed projects that can be updated. """
+# Origin managed projects rarely change their configuration so the index from
+# which the updatable projects and their origins are derived is persisted.
+ORIGIN_UPDATABLE_INDEX_TTL = 60 * 60
+ORIGIN_UPDATABLE_INDEX_WORKERS = 8
+
+
+@memoize(ttl=ORIGIN_UPDATABLE_INDEX_TTL)
+def origin_updatable_index(apiurl):
+    """
+    Index the origins of all updatable origin managed projects as a dict of
+    project to a list of (origin, pending_submission_allow) with <devel>
+    resolved to the devel projects.
+    """
     projects = project_attributes_list(apiurl, [
         'OSRT:OriginConfig',
     ], [
@@ -890,38 +907,50 @@ def origin_updatable(apiurl):
         'OSRT:OriginUpdateSkip',
     ], locked=False)
 
-    for project in projects:
-        updatable = False
+    # The OBS search does not include attribute values so the configs are still
+    # loaded per project, but concurrently.
+    with ThreadPoolExecutor(ORIGIN_UPDATABLE_INDEX_WORKERS) as executor:
+        configs = dict(zip(projects, executor.map(partial(config_load, apiurl), projects)))
+
+    updatable = {}
+    for project, config in configs.items():
+        origins = list(config_origin_generator(config.get('origins', []), skip_workarounds=True))
 
         # Look for at least one origin that allows automatic updates.
-        config = config_load(apiurl, project)
-        for origin, values in config_origin_generator(config['origins'], skip_workarounds=True):
-            if values['automatic_updates']:
-                updatable = True
-                break
+        if any(values['automatic_updates'] for _, values in origins):
+            updatable[project] = origins
+
+    index = {}
+    devel = devel_projects_map(apiurl, [
+        project for project, origins in updatable.items() if any(origin == '<devel>' for origin, _ in origins)])
+    for project, origins in sorted(updatable.items()):
+        index[project] = []
+        for origin, values in origins:
+            if origin == '<devel>':
+                for devel_project in origin_devel_projects_merge(apiurl, project, devel[project]):
+                    index[project].append((devel_project, values['pending_submission_allow']))
+            else:
+                index[project].append((origin, values['pending_submission_allow']))
 
-        if not updatable:
-            projects.remove(project)
+    return index
 
-    return projects
+
+@memoize(session=True)
+def origin_updatable(apiurl):
+    """ List of origin managed projects that can be updated. """
+    return list(origin_updatable_index(apiurl))
 
 
 @memoize(session=True)
 def origin_updatable_map(apiurl, pending=None, include_self=False):
     origins = {}
-    for project in origin_updatable(apiurl):
-        config = config_load(apiurl, project)
-        for origin, values in config_origin_generator(config['origins'], skip_workarounds=True):
-            if pending is not None and values['pending_submission_allow'] != pending:
+    for project, project_origins in origin_updatable_index(apiurl).items():
+        for origin, pending_submission_allow in project_origins:
+            if pending is not None and pending_submission_allow != pending:
                 continue
 
-            if origin == '<devel>':
-                for devel in origin_devel_projects(apiurl, project):
-                    origins.setdefault(devel, set())
-                    origins[devel].add(project)
-            else:
-                origins.setdefault(origin, set())
-                origins[origin].add(project)
+            origins.setdefault(origin, set())
+            origins[origin].add(project)
 
         if include_self:
             origins.setdefault(project, set())
@@ -996,7 +1025,12 @@ def origin_devel_project(apiurl, project, package):
 
 @memoize(session=True)
 def origin_devel_projects(apiurl, project):
-    projects = set(devel_projects(apiurl, project))
+    return origin_devel_projects_merge(apiurl, project, devel_projects(apiurl, project))
+
+
+def origin_devel_projects_merge(apiurl, project, devel_projects):
+    """Add the devel projects of requests and the devel-whitelist to devel_projects."""
+    projects = set(devel_projects)
 
     for devel_project, _ in origin_devel_project_requests(apiurl, project):
         projects.add(devel_project)
@@ -1029,3 +1063,65 @@ def origin_devel_project_requests(apiurl, project, package=None):
             continue
 
         yield action.src_project, action.src_package
+
+
+def origin_lookup_projects(apiurl, project):
+    """
+    Return the projects whose sources and requests determine the origin of the
+    packages in project: the project itself, its origins including the devel
+    projects and the projects they link to.
+    """
+    config = config_load(apiurl, project)
+    projects = {project}
+    for origin in config_origin_list(config, apiurl, project):
+        origin = origin_workaround_strip(origin)
+        if origin == '<devel>':
+            projects.update(origin_devel_projects(apiurl, project))
+        else:
+            projects.add(origin)
+
+    # Source histories include the projects linked to.
+    for linking in list(projects):
+        link = entity_source_link(apiurl, linking)
+        while link is not None and link.get('project') not in projects:
+            projects.add(link.get('project'))
+            link = entity_source_link(apiurl, link.get('project'))
+
+    return projects
+
+
+def origin_lookup_changes(apiurl, project, since):
+    """
+    Return the names of the packages whose origin may have changed after the
+    since UTC datetime based on the package updates and requests of the
+    projects involved, or None if that cannot be determined in which case all
+    packages must be looked up.
+    """
+    remotes = {}
+    for name in origin_lookup_projects(apiurl, project):
+        apiurl_remote, project_remote = project_remote_apiurl(apiurl, name)
+        remotes.setdefault(apiurl_remote, set()).add(project_remote)
+
+    packages = set()
+    for apiurl_remote, projects in remotes.items():
+        try:
+            updated = latest_updated_since(apiurl_remote, since)
+            if updated is None:
+                logging.debug(f'latest updates of {apiurl_remote} do not cover {since}')
+                return None
+
+            packages.update(request_packages_since(apiurl_remote, projects, since))
+        except HTTPError as e:
+            logging.debug(f'unable to determine changes of {apiurl_remote}: {e}')
+            return None
+
+        for name in projects:
+            changed = updated.get(name, set())
+            if None in changed:
+                # Project config, links, or repositories may have changed.
+                logging.debug(f'{name} itself updated since {since}')
+                return None
+
+            packages.update(changed)
+
+    return packages
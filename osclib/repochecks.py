@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import os
 import re
@@ -5,6 +6,7 @@ import requests
 import solv
 import subprocess
 import tempfile
+import time
 import glob
 from fnmatch import fnmatch
 from lxml import etree as ET
@@ -13,6 +15,7 @@ from osc.core import makeurl
 
 import yaml
 
+from osclib import susetags
 from osclib.cache_manager import CacheManager
 from osclib.repomirror import RepoMirror
 
@@ -22,9 +25,27 @@ SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 CACHEDIR = CacheManager.directory('repository-meta')
 
 
+# Seconds since the last use after which .solv files of outdated mirror states
+# are removed, which leaves them to processes that just looked them up.
+SOLV_TTL = 60 * 60 * 24
+
+
 class CorruptRepos(Exception):
     pass
 
+
+# Rules which installcheck does not describe as they refer to the job itself.
+SOLV_IGNORED_RULES = {
+    solv.Solver.SOLVER_RULE_DISTUPGRADE,
+    solv.Solver.SOLVER_RULE_JOB,
+    solv.Solver.SOLVER_RULE_JOB_PROVIDED_BY_SYSTEM,
+    solv.Solver.SOLVER_RULE_JOB_UNKNOWN_PACKAGE,
+    solv.Solver.SOLVER_RULE_JOB_UNSUPPORTED,
+}
+
+# Length of the prefixes by which collapse_followups() indexes the outputs.
+FOLLOWUP_PREFIX = 16
+
 # the content of sp is name, version, release, arch
 
 
@@ -85,18 +106,115 @@ def _do_packages_conflict(pool, pkgs):
     return True
 
 
-def _fileconflicts(pfile, arch, target_packages, whitelist):
+def solv_file(directory):
+    """
+    Convert the RPM headers mirrored in directory into a .solv file named after
+    the set of headers it contains. The file is reused as long as the mirror is
+    unchanged, which includes all projects building against the same repo.
+    """
+    rpms = sorted(filename for filename in os.listdir(directory) if filename.endswith('.rpm'))
+    stamp = hashlib.sha256('\n'.join(rpms).encode('utf-8')).hexdigest()
+    solvdir = os.path.join(directory, '.solv')
+    path = os.path.join(solvdir, stamp + '.solv')
+    if os.path.exists(path):
+        # mark as used
+        os.utime(path, None)
+        return path
+
+    logger.debug(f'Creating {path}')
+    os.makedirs(solvdir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='repochecker') as dir:
+        write_susetags(dir, [directory])
+
+        pool = solv.Pool()
+        repo = pool.add_repo(directory)
+        repo.add_susetags(solv.xfopen(os.path.join(dir, 'packages')),
+                          pool.lookup_id(solv.SOLVID_META, solv.SUSETAGS_DEFAULTVENDOR), 'en')
+
+        tmppath = os.path.join(solvdir, f'.{stamp}.{os.getpid()}')
+        ofh = solv.xfopen(tmppath, 'w')
+        repo.write(ofh)
+        ofh.close()
+        os.replace(tmppath, path)
+
+    prune = time.time() - SOLV_TTL
+    for oldfile in glob.glob(glob.escape(solvdir) + '/*.solv'):
+        if oldfile == path:
+            continue
+
+        # Concurrently pruned by another process refreshing the mirror.
+        try:
+            if os.stat(oldfile).st_mtime < prune:
+                os.unlink(oldfile)
+        except FileNotFoundError:
+            pass
+
+    return path
+
+
+def solv_pool(directories, arch, primaryxmls=(), fileprovides=False):
+    """
+    Create a pool from the .solv files of the mirrored directories followed by
+    the primaryxmls of download on demand repos. Like the combined susetags
+    file only the first package of a name in the chain of directories is
+    considered, the others are excluded from the pool.
+    """
+    pool = solv.Pool()
+    pool.setarch(arch)
+
+    considered = []
+    names = set()
+    for directory in directories:
+        if not os.path.isdir(directory):
+            # Not part of the susetags file either, see write_susetags().
+            continue
+
+        repo = pool.add_repo(directory)
+        solvfile = solv.xfopen(solv_file(directory))
+        if solvfile is None:
+            # Pruned after the lookup, the file is created again.
+            solvfile = solv.xfopen(solv_file(directory))
+        loaded = solvfile is not None and repo.add_solv(solvfile)
+        if solvfile is not None:
+            solvfile.close()
+        if not loaded:
+            raise CorruptRepos(f'failed to load {directory}')
+
+        repo_names = set()
+        for solvable in repo.solvables_iter():
+            if solvable.name not in names:
+                considered.append(solvable.id)
+                repo_names.add(solvable.name)
+        names |= repo_names
+
+    for primaryxml in primaryxmls:
+        repo = pool.add_repo(primaryxml)
+        repo.add_rpmmd(solv.xfopen(primaryxml), None, 0)
+        considered.extend(solvable.id for solvable in repo.solvables_iter())
+
+    pool.set_considered_list(considered)
+    if fileprovides:
+        pool.addfileprovides()
+    pool.createwhatprovides()
+
+    return pool
+
+
+def _fileconflicts(pfile, arch, target_packages, whitelist, directories=None):
     script = os.path.join(SCRIPT_PATH, '..', 'findfileconflicts')
     p = subprocess.run(['perl', script, pfile], stdout=subprocess.PIPE)
     if p.returncode or len(p.stdout):
         output = ''
         conflicts = yaml.safe_load(p.stdout)
 
-        pool = solv.Pool()
-        pool.setarch(arch)
-        repo = pool.add_repo("packages")
-        repo.add_susetags(solv.xfopen(pfile), pool.lookup_id(solv.SOLVID_META, solv.SUSETAGS_DEFAULTVENDOR), "en")
-        pool.createwhatprovides()
+        if directories:
+            pool = solv_pool(directories, arch)
+        else:
+            pool = solv.Pool()
+            pool.setarch(arch)
+            repo = pool.add_repo("packages")
+            repo.add_susetags(solv.xfopen(pfile), pool.lookup_id(solv.SOLVID_META, solv.SUSETAGS_DEFAULTVENDOR), "en")
+            pool.createwhatprovides()
 
         for conflict in conflicts:
             sp1 = conflict['between'][0]
@@ -130,19 +248,91 @@ def filter_release(line):
     return line
 
 
+def maparch2installarch(arch):
+    _mapping = {'armv6l': 'armv6hl',
+                'armv7l': 'armv7hl'}
+    if arch in _mapping:
+        return _mapping[arch]
+    return arch
+
+
+def solv_problem_lines(pool, problem):
+    """
+    Describe the rules of a solver problem in the same way as installcheck.
+    """
+    lines = []
+    for rule in problem.findallproblemrules():
+        for info in rule.allinfos():
+            if info.type in SOLV_IGNORED_RULES:
+                continue
+
+            lines.append(info.problemstr())
+            if info.type == solv.Solver.SOLVER_RULE_PKG_NOTHING_PROVIDES_DEP:
+                # List the providers of the name lacking the requested version.
+                name = str(info.dep).split(' ')[0]
+                if name != str(info.dep) and not name.startswith('('):
+                    for provider in pool.whatprovides(pool.Dep(name)):
+                        lines.append(f'  (we have {provider})')
+
+    return lines
+
+
+def solv_installcheck(directories, arch, target_packages, whitelist, primaryxmls=()):
+    """
+    In-process alternative to parsed_installcheck() which checks the target
+    packages of the first directory using the solv bindings and returns the
+    problems in the same structure without running /usr/bin/installcheck.
+    """
+    reported_problems = dict()
+
+    if not len(target_packages) or not os.path.isdir(directories[0]):
+        return reported_problems
+
+    pool = solv_pool(directories, maparch2installarch(arch), primaryxmls, fileprovides=True)
+    repo = next(repo for repo in pool.repos_iter() if repo.name == directories[0])
+
+    for solvable in repo.solvables_iter():
+        package = solvable.name
+        if package not in target_packages or not pool.isknownarch(solvable.archid):
+            continue
+
+        solver = pool.Solver()
+        solver.set_flag(solv.Solver.SOLVER_FLAG_IGNORE_RECOMMENDED, 1)
+        problems = solver.solve([pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_INSTALL, solvable.id)])
+        if not problems:
+            continue
+
+        if package in whitelist:
+            logger.debug(f"{package} fails installcheck but is white listed")
+            continue
+
+        output = []
+        for problem in problems:
+            output.extend(filter_release(line) for line in solv_problem_lines(pool, problem))
+        reported_problems[package] = {'problem': str(solvable), 'output': output,
+                                      'source': target_packages[package]}
+
+    return reported_problems
+
+
+def engine_installcheck(pfile, directories, arch, target_packages, whitelist, primaryxmls=()):
+    """
+    Check installability of the target packages using /usr/bin/installcheck on
+    pfile or, when $OSRT_INSTALLCHECK_ENGINE is set to solv, the in-process
+    solv_installcheck() on the mirrored directories.
+    """
+    if os.environ.get('OSRT_INSTALLCHECK_ENGINE', 'installcheck') == 'solv':
+        return solv_installcheck(directories, arch, target_packages, whitelist, primaryxmls)
+
+    return parsed_installcheck([pfile] + list(primaryxmls), arch, target_packages, whitelist)
+
+
 def parsed_installcheck(repos, arch, target_packages, whitelist):
     reported_problems = dict()
 
     if not len(target_packages):
         return reported_problems
 
-    def maparch2installarch(arch):
-        _mapping = {'armv6l': 'armv6hl',
-                    'armv7l': 'armv7hl'}
-        if arch in _mapping:
-            return _mapping[arch]
-        return arch
-
     if not isinstance(repos, list):
         repos = [repos]
 
@@ -175,19 +365,104 @@ def parsed_installcheck(repos, arch, target_packages, whitelist):
     return reported_problems
 
 
+def collapse_followups(outputs):
+    """
+    Replace the output of any other package contained within the output of a
+    package by FOLLOWUP(<package>) and return the collapsed outputs.
+
+    The result is the same as calling str.replace() with the output of every
+    other package in order, where the outputs of earlier packages are already
+    collapsed, but only outputs starting with a substring of the output are
+    tried rather than all of them.
+    """
+    outputs = dict(outputs)
+    order = {package: i for i, package in enumerate(outputs)}
+    # Outputs by their prefix and those too short to have one.
+    index = {}
+    short = set()
+
+    def index_update(package, add):
+        output = outputs[package]
+        if len(output) < FOLLOWUP_PREFIX:
+            entries = short
+        else:
+            entries = index.setdefault(output[:FOLLOWUP_PREFIX], set())
+        if add:
+            entries.add(package)
+        else:
+            entries.discard(package)
+
+    for package in outputs:
+        index_update(package, True)
+
+    def substrings(text, first, last):
+        return {text[i:i + FOLLOWUP_PREFIX] for i in range(max(first, 0), min(last, len(text) - FOLLOWUP_PREFIX + 1))}
+
+    for package1 in order:
+        output = outputs[package1]
+        # Substrings no longer contained after a replacement are kept as they
+        # only lead to further candidates.
+        prefixes = substrings(output, 0, len(output))
+        start = 0
+        while True:
+            candidates = set(short).union(*(index[prefix] for prefix in index.keys() & prefixes))
+            candidates.discard(package1)
+
+            for package2 in sorted(candidates, key=order.get):
+                if order[package2] < start:
+                    continue
+                followup = f'FOLLOWUP({package2})'
+                replaced = output.replace(outputs[package2], followup)
+                if replaced != output:
+                    # Continue after package2 with the substrings across the
+                    # inserted followups added to the candidates.
+                    output = replaced
+                    start = order[package2] + 1
+                    position = output.find(followup)
+                    while position >= 0:
+                        prefixes |= substrings(output, position - FOLLOWUP_PREFIX + 1, position + len(followup))
+                        position = output.find(followup, position + 1)
+                    break
+            else:
+                break
+
+        index_update(package1, False)
+        outputs[package1] = output
+        index_update(package1, True)
+
+    return outputs
+
+
+def write_susetags(dir, directories):
+    """
+    Write the susetags packages file and catalog.yml for the mirrored
+    directories into dir. Uses write_repo_susetags_file.pl unless
+    $OSRT_SUSETAGS_WRITER is set to python for the osclib.susetags writer.
+    """
+    if os.environ.get('OSRT_SUSETAGS_WRITER', 'perl') == 'python':
+        try:
+            susetags.write_susetags(dir, directories)
+        except susetags.CorruptPackage as e:
+            logger.error(str(e))
+            raise CorruptRepos
+        return
+
+    script = os.path.join(SCRIPT_PATH, '..', 'write_repo_susetags_file.pl')
+    parts = ['perl', script, dir] + directories
+
+    p = subprocess.run(parts)
+    if p.returncode:
+        # technically only 126, but there is no other value atm -
+        # so if some other perl error happens, we don't continue
+        raise CorruptRepos
+
+
 def installcheck(directories, arch, whitelist, ignore_conflicts):
 
     with tempfile.TemporaryDirectory(prefix='repochecker') as dir:
         pfile = os.path.join(dir, 'packages')
 
-        script = os.path.join(SCRIPT_PATH, '..', 'write_repo_susetags_file.pl')
-        parts = ['perl', script, dir] + directories
-
-        p = subprocess.run(parts)
-        if p.returncode:
-            # technically only 126, but there is no other value atm -
-            # so if some other perl error happens, we don't continue
-            raise CorruptRepos
+        write_susetags(dir, directories)
 
         target_packages = []
         with open(os.path.join(dir, 'catalog.yml')) as file:
@@ -195,11 +470,11 @@ def installcheck(directories, arch, whitelist, ignore_conflicts):
             target_packages = catalog.get(directories[0], [])
 
         parts = []
-        output = _fileconflicts(pfile, arch, target_packages, ignore_conflicts)
+        output = _fileconflicts(pfile, arch, target_packages, ignore_conflicts, directories)
         if output:
             parts.append(output)
 
-        parsed = parsed_installcheck(pfile, arch, target_packages, whitelist)
+        parsed = engine_installcheck(pfile, directories, arch, target_packages, whitelist)
         if len(parsed):
             output = ''
             for package in sorted(parsed):
@@ -1,5 +1,4 @@
 import fcntl
-import itertools
 import logging
 import os
 import osc.conf
@@ -7,7 +6,11 @@ import re
 import struct
 import sys
 import tempfile
+import threading
+import time
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree as ET
 from osc.core import makeurl, http_GET
 from osc.util.cpio import CpioHdr
@@ -19,14 +22,24 @@ logger = logging.getLogger('RepoMirror')
 class RepoMirror:
     cpio_struct = struct.Struct('6s8s8s8s8s8s8s8s8s8s8s8s8s8s')
     cpio_name_re = re.compile('^([^/]+)-([0-9a-f]{32})$')
+    partial_prefix = '.partial-'
 
-    def __init__(self, apiurl: str, nameignore: str = '-debug(info|source|info-32bit).rpm$'):
+    # Batches finishing quicker than this grow, failing batches shrink.
+    batch_target_seconds = 15
+    batch_max = 100
+    retries = 3
+
+    def __init__(self, apiurl: str, nameignore: str = '-debug(info|source|info-32bit).rpm$',
+                 workers: int = 4, batch_size: int = 50):
         """
         Class to mirror RPM headers of all binaries in a repo on OBS (full tree).
         Debug packages are ignored by default, see the nameignore parameter.
+        Headers are downloaded in batches by up to workers concurrent requests.
         """
         self.apiurl = apiurl
         self.nameignorere = re.compile(nameignore)
+        self.workers = workers
+        self.batch_size = batch_size
 
     def extract_cpio_stream(self, destdir: str, stream):
         while True:
@@ -52,10 +65,14 @@ class RepoMirror:
                 name = binarymatch.group(1)
                 md5 = binarymatch.group(2)
                 destpath = os.path.join(destdir, f'{md5}-{name}.rpm')
-                with tempfile.NamedTemporaryFile(mode='wb', dir=destdir) as tmpfile:
+                with tempfile.NamedTemporaryFile(mode='wb', dir=destdir, prefix=self.partial_prefix) as tmpfile:
                     # Probably not big enough to need chunking
                     tmpfile.write(stream.read(hdr.filesize))
-                    os.link(tmpfile.name, destpath)
+                    try:
+                        os.link(tmpfile.name, destpath)
+                    except FileExistsError:
+                        # Already extracted by a previous attempt of the batch.
+                        pass
                     # Would be nice to use O_TMPFILE + link here, but python passes
                     # O_EXCL which breaks that.
                     # os.link(f'/proc/self/fd/{tmpfile.fileno()}', destpath)
@@ -83,6 +100,11 @@ class RepoMirror:
 
         to_delete: list[str] = []
         for filename in os.listdir(destdir):
+            if filename.startswith(self.partial_prefix):
+                # Left behind by an interrupted run, destdir is locked.
+                to_delete.append(os.path.join(destdir, filename))
+                continue
+
             if not filename.endswith('.rpm'):
                 continue
 
@@ -98,17 +120,66 @@ class RepoMirror:
 
         if remotebins:
             logger.info(f'Downloading {len(remotebins)} new packages')
-            binaries = remotebins.values()
+            self._download(destdir, prj, repo, arch, remotebins)
 
-            # Download in batches of 50
-            for chunk in range(0, len(binaries), 50):
-                query = 'view=cpioheaders'
-                for binary in itertools.islice(binaries, chunk, chunk + 50):
-                    query += '&binary=' + quote_plus(binary)
+    def _download_batch(self, destdir: str, prj: str, repo: str, arch: str, binaries: list[str]) -> None:
+        query = 'view=cpioheaders'
+        for binary in binaries:
+            query += '&binary=' + quote_plus(binary)
 
-                req = http_GET(makeurl(self.apiurl, ['build', prj, repo, arch, '_repository'],
-                                       query=query))
-                self.extract_cpio_stream(destdir, req)
+        req = http_GET(makeurl(self.apiurl, ['build', prj, repo, arch, '_repository'],
+                               query=query))
+        self.extract_cpio_stream(destdir, req)
+
+    def _download(self, destdir: str, prj: str, repo: str, arch: str, remotebins: dict[str, str]) -> None:
+        """
+        Download the headers of remotebins (filename to binary name) by a pool
+        of workers each taking the next batch from a shared queue. The batch
+        size adapts to the observed response times and failed batches are put
+        back without the headers that were already extracted.
+        """
+        pending = deque(remotebins.items())
+        attempts: dict[str, int] = {}
+        lock = threading.Lock()
+        state = {'batch_size': self.batch_size, 'failed': None}
+
+        def worker():
+            while True:
+                with lock:
+                    if state['failed'] or not pending:
+                        return
+                    size = min(state['batch_size'], len(pending))
+                    batch = [pending.popleft() for _ in range(size)]
+
+                start = time.monotonic()
+                try:
+                    self._download_batch(destdir, prj, repo, arch, [name for _, name in batch])
+                except Exception as e:
+                    # Network errors and truncated streams surface in various forms.
+                    missing = [(filename, name) for filename, name in batch
+                               if not os.path.exists(os.path.join(destdir, filename))]
+                    with lock:
+                        state['batch_size'] = max(1, state['batch_size'] // 2)
+                        for filename, _ in missing:
+                            attempts[filename] = attempts.get(filename, 0) + 1
+                            if attempts[filename] > self.retries:
+                                state['failed'] = e
+                        pending.extendleft(reversed(missing))
+                    logger.warning(f'Batch of {len(batch)} failed ({e}), retrying {len(missing)}')
+                    continue
+
+                duration = time.monotonic() - start
+                with lock:
+                    if duration < self.batch_target_seconds and size == state['batch_size']:
+                        state['batch_size'] = min(self.batch_max, int(size * 1.5) + 1)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(worker) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+
+        if state['failed']:
+            raise state['failed']
 
     def mirror(self, destdir: str, prj: str, repo: str, arch: str) -> None:
         "Creates destdir and locks destdir/.lock before mirroring."
@@ -1,9 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import dateutil.parser
 from lxml import etree as ET
 from osc import conf
 from osc.core import show_project_meta
 from osclib.core import devel_project_fallback
+from osclib.core import devel_project_get_git_map
+from osclib.core import devel_project_get_map
 from osclib.core import request_age
 from osclib.util import sha1_short
 import re
@@ -25,6 +28,8 @@ class RequestSplitter(object):
             StrategySpecial.PACKAGES = special_packages.split(' ')
 
         self.requests_ignored = self.api.get_ignored_requests()
+        # after supplement_load()
+        self.devel_projects = None
 
         self.reset()
         # after propose_assignment()
@@ -107,12 +112,39 @@ class RequestSplitter(object):
             else:
                 self.other.append(request)
 
+    def supplement_load(self):
+        """
+        Load the devel projects of all target packages with a search per target
+        project instead of requesting the package meta for each request.
+        """
+        target_packages = {}
+        for request in self.requests:
+            target = request.find('./action/target')
+            if target is not None and target.get('package'):
+                target_packages.setdefault(target.get('project'), set()).add(target.get('package'))
+
+        self.devel_projects = {}
+        for target_project, packages in target_packages.items():
+            devel_projects = devel_project_get_map(self.api.apiurl, target_project, packages)
+            if target_project.endswith('openSUSE:Factory'):
+                # Packages migrated to git have no devel project in their meta.
+                # Factory has no further fallbacks so the lookup is complete.
+                devel_projects.update(devel_project_get_git_map(self.api.apiurl, packages - set(devel_projects)))
+                for target_package in packages - set(devel_projects):
+                    devel_projects[target_package] = None, None
+
+            for target_package, (devel, _) in devel_projects.items():
+                self.devel_projects[(target_project, target_package)] = devel
+
     def supplement(self, request):
         """ Provide additional information for grouping """
         if request.get('ignored'):
             # Only supplement once.
             return
 
+        if self.devel_projects is None:
+            self.supplement_load()
+
         history = request.find('history')
         if history is not None:
             age = request_age(request).total_seconds()
@@ -122,7 +154,12 @@ class RequestSplitter(object):
         target = request.find('./action/target')
         target_project = target.get('project')
         target_package = target.get('package')
-        devel, _ = devel_project_fallback(self.api.apiurl, target_project, target_package)
+        if (target_project, target_package) in self.devel_projects:
+            devel = self.devel_projects[(target_project, target_package)]
+        else:
+            # Packages without a devel project in their meta may still have one
+            # via the fallbacks which are looked up individually.
+            devel, _ = devel_project_fallback(self.api.apiurl, target_project, target_package)
         if not devel and request_type == 'submit':
             devel = request.find('./action/source').get('project')
         if devel:
@@ -198,7 +235,7 @@ class RequestSplitter(object):
         staging = self.stagings[staging]
         if staging['status'].find('staged_requests/request') is not None:
             return False
-        return self.api.prj_frozen_enough(staging['project'])
+        return self.api.prj_frozen_enough(staging['project'], staging['status'])
 
     def stagings_load(self, stagings):
         self.stagings = {}
@@ -219,15 +256,15 @@ class RequestSplitter(object):
             # attempt to use even if the normal conditions are not met.
             should_always = True
 
-        for staging in stagings:
-            project = self.api.prj_from_short(staging)
-            status = self.api.project_status(project)
-            bootstrapped = self.api.is_staging_bootstrapped(project)
+        projects = [self.api.prj_from_short(staging) for staging in stagings]
+        statuses, bootstrapped = self.stagings_status_load(projects)
+        for staging, project in zip(stagings, projects):
+            status = statuses[project]
 
             # Store information about staging.
             self.stagings[staging] = {
                 'project': project,
-                'bootstrapped': bootstrapped,
+                'bootstrapped': bootstrapped[project],
                 # TODO: find better place for splitter info
                 'splitter_info': {'strategy': {'name': 'none'}},
                 'status': status
@@ -249,6 +286,29 @@ class RequestSplitter(object):
                 len(self.stagings_mergeable) +
                 len(self.stagings_mergeable_none))
 
+    def stagings_status_load(self, projects):
+        """
+        Load the status of all stagings with a single request and determine
+        whether the projects are bootstrapped concurrently since that requires
+        the meta of each project.
+        """
+        statuses = {}
+        for status in self.api.project_status(None):
+            statuses[status.get('name')] = status
+
+        # Explicitly listed projects may not be part of the overall status.
+        missing = [project for project in projects if project not in statuses]
+
+        # Load lazily initialized value before use by multiple threads.
+        self.api.rings
+        workers = int(self.config.get('splitter-stagings-workers', 8))
+        with ThreadPoolExecutor(workers) as executor:
+            for project, status in zip(missing, executor.map(self.api.project_status, missing)):
+                statuses[project] = status
+            bootstrapped = dict(zip(projects, executor.map(self.api.is_staging_bootstrapped, projects)))
+
+        return statuses, bootstrapped
+
     def propose_assignment(self):
         # Attempt to assign groups that have bootstrap_required first.
         for group in sorted(self.grouped.keys()):
@@ -0,0 +1,86 @@
+import json
+import logging
+import threading
+import time
+
+from osclib.PubSubConsumer import PubSubConsumer
+
+
+class ReviewListener(PubSubConsumer):
+    """
+    Check requests as soon as the bus announces a change to them instead of
+    searching for all reviews every interval. The full search is still done
+    upon (re-)connecting and every sweep interval as a safety net for missed
+    events.
+
+    The checks run in a worker thread, one at a time, so that the ioloop keeps
+    serving the connection. Events arriving meanwhile are collected and checked
+    once the worker is done.
+    """
+
+    EVENTS = ['create', 'change', 'state_change', 'review_wanted', 'reviews_done', 'comment']
+    # Seconds to wait for further events before checking the changed requests.
+    SETTLE = 5
+
+    def __init__(self, amqp_prefix, check, sweep, sweep_interval, logger=None):
+        super(ReviewListener, self).__init__(amqp_prefix, logger or logging.getLogger(__name__))
+        self.amqp_prefix = amqp_prefix
+        # callbacks to check the given request ids or all requests
+        self.check = check
+        self.sweep = sweep
+        self.sweep_interval = sweep_interval
+        self.sweep_last = None
+        self.requests_to_check = set()
+        self.worker = None
+
+    def routing_keys(self):
+        return [f'{self.amqp_prefix}.obs.request.{event}' for event in self.EVENTS]
+
+    def interval(self):
+        if len(self.requests_to_check) or (self.worker is not None and self.worker.is_alive()):
+            return self.SETTLE
+        return super(ReviewListener, self).interval()
+
+    def start_consuming(self):
+        # now we are (re-)connected to the bus and events may have been missed
+        self.sweep_last = None
+        super(ReviewListener, self).start_consuming()
+
+    def still_alive(self):
+        if self.worker is not None and self.worker.is_alive():
+            self.logger.debug('still checking')
+        elif self.sweep_last is None or time.time() - self.sweep_last >= self.sweep_interval:
+            self.sweep_last = time.time()
+            # the sweep includes any request changed in the meantime
+            self.requests_to_check = set()
+            self.work(self.sweep)
+        elif len(self.requests_to_check):
+            request_ids = sorted(self.requests_to_check)
+            self.requests_to_check = set()
+            self.work(self.check, request_ids)
+
+        super(ReviewListener, self).still_alive()
+
+    def work(self, func, *args):
+        self.worker = threading.Thread(target=self.run_safely, args=(func,) + args, daemon=True)
+        self.worker.start()
+
+    def run_safely(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            self.logger.exception(e)
+
+    def on_message(self, unused_channel, method, properties, body):
+        self.acknowledge_message(method.delivery_tag)
+        try:
+            request_id = json.loads(body).get('number')
+        except ValueError:
+            request_id = None
+
+        if request_id is None:
+            self.logger.warning(f'ignoring {method.routing_key} without request number')
+            return
+
+        self.logger.debug(f'{method.routing_key} for request {request_id}')
+        self.requests_to_check.add(str(request_id))
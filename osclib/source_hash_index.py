@@ -0,0 +1,117 @@
+import atexit
+import os
+import re
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+from osclib.cache_manager import CacheManager
+
+# Persistent index of the source hash of package revisions as calculated by
+# osclib.core.package_source_hash(). A srcmd5 identifies the exact sources of a
+# revision so entries never expire and are only ever added. Repeated origin
+# lookups thus only request the revisions committed since the previous run.
+
+
+class SourceHashIndex(object):
+    """
+    Map (project, package, srcmd5) of an OBS instance to the source hash of the
+    revision. New entries are queued and written in batches.
+    """
+
+    BATCH = 100
+    # Bound the number of parameters of a single query.
+    LOOKUP_CHUNK = 500
+
+    SRCMD5_RE = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.pending = {}
+        self._connection = None
+        atexit.register(self.flush)
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # The connection must not be shared with a forked process and queued
+        # entries are left to be written by the parent.
+        self.lock = threading.Lock()
+        self.pending = {}
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.filename, timeout=60, isolation_level=None, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS source_hash (
+                    host TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    package TEXT NOT NULL,
+                    srcmd5 TEXT NOT NULL,
+                    source_hash TEXT NOT NULL,
+                    PRIMARY KEY (host, project, package, srcmd5)
+                ) WITHOUT ROWID
+            """)
+
+        return self._connection
+
+    @staticmethod
+    def indexable(revision):
+        # Revision numbers restart when a package is recreated.
+        return revision is not None and SourceHashIndex.SRCMD5_RE.match(revision) is not None
+
+    def lookup(self, apiurl, project, package, srcmd5s):
+        """Return the indexed source hashes of the srcmd5s as a dict."""
+        host = urlsplit(apiurl).hostname
+        srcmd5s = [srcmd5 for srcmd5 in srcmd5s if self.indexable(srcmd5)]
+
+        found = {}
+        with self.lock:
+            for srcmd5 in srcmd5s:
+                source_hash = self.pending.get((host, project, package, srcmd5))
+                if source_hash is not None:
+                    found[srcmd5] = source_hash
+
+            srcmd5s = [srcmd5 for srcmd5 in srcmd5s if srcmd5 not in found]
+            for i in range(0, len(srcmd5s), self.LOOKUP_CHUNK):
+                chunk = srcmd5s[i:i + self.LOOKUP_CHUNK]
+                found.update(self.connection.execute(
+                    'SELECT srcmd5, source_hash FROM source_hash '
+                    'WHERE host = ? AND project = ? AND package = ? AND srcmd5 IN ({})'.format(
+                        ', '.join('?' * len(chunk))),
+                    (host, project, package, *chunk)))
+
+        return found
+
+    def add(self, apiurl, project, package, srcmd5, source_hash):
+        if not self.indexable(srcmd5) or source_hash is None:
+            return
+
+        with self.lock:
+            self.pending[(urlsplit(apiurl).hostname, project, package, srcmd5)] = source_hash
+            if len(self.pending) >= self.BATCH:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO source_hash VALUES (?, ?, ?, ?, ?)',
+                [key + (source_hash,) for key, source_hash in self.pending.items()])
+
+        self.pending = {}
+
+
+SOURCE_HASH_INDEX = SourceHashIndex(os.path.join(CacheManager.directory('source-hash'), 'index.sqlite'))
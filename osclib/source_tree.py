@@ -0,0 +1,117 @@
+import fnmatch
+import hashlib
+import os
+import re
+from io import StringIO
+
+# The policy checks of check_source each used to glob and read the checked out
+# package on their own. A SourceTree indexes the files of a checkout once and
+# shares the contents, hashes and parsed spec files between the checks.
+
+PATCH_PATTERNS = ['*.diff', '*.patch', '*.dif']
+
+
+class SourceTree(object):
+    """
+    Inventory of the files of a checked out package directory. Contents and
+    hashes are loaded on first use and cached. Changes to the directory made
+    by the checks must go through remove() and write() to keep it current.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.present = os.path.isdir(directory)
+        self.files = set()
+        if self.present:
+            with os.scandir(directory) as entries:
+                self.files = {entry.name for entry in entries if entry.is_file()}
+
+        self._text = {}
+        self._md5 = {}
+        self._sources = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self, name):
+        return name in self.files
+
+    def glob(self, pattern):
+        # Like glob.glob() hidden files only match patterns starting with a dot.
+        return sorted(name for name in fnmatch.filter(self.files, pattern)
+                      if not name.startswith('.') or pattern.startswith('.'))
+
+    def read(self, name):
+        text = self._text.get(name)
+        if text is None:
+            with open(self.path(name), 'r') as f:
+                text = self._text[name] = f.read()
+        return text
+
+    def lines(self, name):
+        # Unlike str.splitlines() only split on newlines like reading a file.
+        return StringIO(self.read(name)).readlines()
+
+    def md5(self, name):
+        digest = self._md5.get(name)
+        if digest is None:
+            md5 = hashlib.md5()
+            with open(self.path(name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    md5.update(chunk)
+            digest = self._md5[name] = md5.hexdigest()
+        return digest
+
+    def same(self, other, name):
+        """Return True if both trees contain name with identical contents."""
+        if not self.exists(name) or not other.exists(name):
+            return False
+
+        return os.path.getsize(self.path(name)) == os.path.getsize(other.path(name)) and \
+            self.md5(name) == other.md5(name)
+
+    def remove(self, name):
+        os.unlink(self.path(name))
+        self.forget(name)
+        self.files.discard(name)
+
+    def write(self, name, text):
+        # Replace rather than overwrite the file since it may be a hardlink
+        # into the shared checkout cache (see osclib.checkout_cache).
+        path = self.path(name)
+        with open(path + '.new', 'w') as f:
+            f.write(text)
+        os.replace(path + '.new', path)
+        self.forget(name)
+        self.files.add(name)
+        self._text[name] = text
+
+    def forget(self, name):
+        self._text.pop(name, None)
+        self._md5.pop(name, None)
+        self._sources.pop(name, None)
+
+    def spec_sources(self, spec):
+        """Return the values of the Source tags of spec as list of (line index, tag, value)."""
+        sources = self._sources.get(spec)
+        if sources is None:
+            sources = self._sources[spec] = []
+            for i, line in enumerate(self.lines(spec)):
+                m = re.match(r'(Source[0-9]*\s*):\s*(.*)$', line)
+                if m:
+                    sources.append((i, m.group(1), m.group(2)))
+        return sources
+
+    def mentioned_sources(self, specs):
+        sources = set()
+        for spec in specs:
+            if not self.exists(spec):
+                continue
+            sources.update(value for _, _, value in self.spec_sources(spec))
+        return sources
+
+    def patches(self):
+        patches = set()
+        for pattern in PATCH_PATTERNS:
+            patches.update(self.glob(pattern))
+        return patches
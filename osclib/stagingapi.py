@@ -1173,14 +1173,15 @@ class StagingAPI(object):
         """
         self.switch_flag_in_prj(project, flag='build', state=state, repository=repository, arch=arch)
 
-    def prj_frozen_enough(self, project):
+    def prj_frozen_enough(self, project, status=None):
         """
         Check if we can and should refreeze the prj"
         :param project the project to check
+        :param status the already loaded project_status() of the project
         :returns True if we can select into it
         """
 
-        data = self.project_status(project)
+        data = status if status is not None else self.project_status(project)
         if data.get('state') != 'empty':
             return True  # already has content
 
@@ -0,0 +1,283 @@
+import glob
+import os
+import re
+import stat
+import struct
+import tempfile
+
+# Native implementation of write_repo_susetags_file.pl and CreatePackageDescr.pm
+# which turns the RPM headers mirrored by RepoMirror into a susetags packages
+# file and a catalog.yml listing the packages of each directory. The snippets
+# are cached in the same location and format as the perl implementation so
+# that either can be used on the same mirror.
+
+RPM_LEAD_MAGIC = b'\xed\xab\xee\xdb'
+RPM_HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_ARCH = 1022
+RPMTAG_FILEMODES = 1030
+RPMTAG_FILELINKTOS = 1036
+RPMTAG_FILEFLAGS = 1037
+RPMTAG_FILEUSERNAME = 1039
+RPMTAG_FILEGROUPNAME = 1040
+RPMTAG_SOURCERPM = 1044
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMTAG_DISTURL = 1123
+
+# Dependency tags as (name, flags, version) in the order of the snippet.
+DEPENDENCIES = {
+    'provides': (1047, 1112, 1113),
+    'requires': (1049, 1048, 1050),
+    'conflicts': (1054, 1053, 1055),
+    'obsoletes': (1090, 1114, 1115),
+    'recommends': (5046, 5048, 5047),
+    'suggests': (5049, 5051, 5050),
+    'supplements': (5052, 5054, 5053),
+    'enhances': (5055, 5057, 5056),
+}
+
+CACHE_PREFIX = '2-'
+
+
+class CorruptPackage(Exception):
+    pass
+
+
+def _header_read(data, offset):
+    """
+    Parse the RPM header structure at offset and return the tags and the
+    offset following the header.
+    """
+    if data[offset:offset + 4] != RPM_HEADER_MAGIC:
+        raise CorruptPackage('invalid header magic')
+
+    nindex, hsize = struct.unpack_from('>II', data, offset + 8)
+    index = offset + 16
+    store = index + nindex * 16
+    end = store + hsize
+    if end > len(data):
+        raise CorruptPackage('truncated header')
+
+    tags = {}
+    for i in range(nindex):
+        tag, kind, start, count = struct.unpack_from('>iiii', data, index + i * 16)
+        start += store
+        if kind in (6, 8, 9):
+            values = []
+            for _ in range(count if kind != 6 else 1):
+                stop = data.index(b'\0', start)
+                values.append(data[start:stop].decode('utf-8', 'surrogateescape'))
+                start = stop + 1
+        elif kind == 3:
+            values = list(struct.unpack_from(f'>{count}H', data, start))
+        elif kind == 4:
+            values = list(struct.unpack_from(f'>{count}I', data, start))
+        elif kind == 5:
+            values = list(struct.unpack_from(f'>{count}Q', data, start))
+        elif kind in (1, 2):
+            values = list(data[start:start + count])
+        else:
+            values = [data[start:start + count]]
+        tags[tag] = values
+
+    return tags, end
+
+
+def rpm_header(path):
+    """
+    Read the tags of the main header of an RPM, with or without lead and
+    signature, as lists of values similar to Build::Rpm::rpmq().
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    try:
+        offset = 0
+        if data[:4] == RPM_LEAD_MAGIC:
+            # Skip the lead and the signature header which is padded to 8 bytes.
+            _, offset = _header_read(data, 96)
+            offset += (8 - offset % 8) % 8
+
+        tags, _ = _header_read(data, offset)
+    except (struct.error, ValueError) as e:
+        raise CorruptPackage(str(e))
+
+    return tags
+
+
+def _flagsvers(tags, name, flags, version):
+    entries = []
+    flags = tags.get(flags, [])
+    versions = tags.get(version, [])
+    for i, entry in enumerate(tags.get(name, [])):
+        if i < len(flags) and flags[i] & 0xe and i < len(versions):
+            entry += ' '
+            entry += '<' if flags[i] & 2 else ''
+            entry += '>' if flags[i] & 4 else ''
+            entry += '=' if flags[i] & 8 else ''
+            entry += ' ' + versions[i]
+        entries.append(entry)
+
+    return entries
+
+
+def package_snippet_create(path):
+    """
+    Create the susetags snippet of an RPM header like CreatePackageDescr.pm.
+    """
+    tags = rpm_header(path)
+    if RPMTAG_NAME not in tags:
+        raise CorruptPackage('no name')
+
+    name = tags[RPMTAG_NAME][0]
+    dependencies = {key: _flagsvers(tags, *value) for key, value in DEPENDENCIES.items()}
+
+    arch = tags[RPMTAG_ARCH][0]
+    # some packages are more equal than others
+    if arch == 'i686':
+        arch = 'i586'
+
+    out = [f'=Pkg: {name} {tags[RPMTAG_VERSION][0]} {tags[RPMTAG_RELEASE][0]} {arch}\n']
+    # The source is written within the file list just like the perl variant.
+    out.append('+Flx:\n')
+
+    # e.g. libqt5-qttools-5.12.3-1.2.src.rpm
+    source = ['', '', '']
+    match = re.match(r'^(.*)-([^-]*)-([^-]*)\.(src|nosrc)\.rpm', tags.get(RPMTAG_SOURCERPM, [''])[0])
+    if match:
+        source = list(match.group(1, 2, 3))
+
+    # overwrite the source with the disturl, in case of multibuild and co
+    # e.g. obs://build.opensuse.org/openSUSE:Factory/standard/e71360fe635636b65ef2244eb123fc7f-libqt5-qttools
+    if RPMTAG_DISTURL in tags:
+        source[0] = re.sub(r'^[^-]*-', '', os.path.basename(tags[RPMTAG_DISTURL][0]), count=1)
+    out.append(f'=Src: {source[0]} {source[1]} {source[2]} src\n')
+
+    xprvs = []
+    dirnames = tags.get(RPMTAG_DIRNAMES, [])
+    # Columns of the file list with the value used when missing.
+    columns = ((RPMTAG_FILEMODES, 0), (RPMTAG_DIRINDEXES, 0), (RPMTAG_FILEUSERNAME, ''),
+               (RPMTAG_FILEGROUPNAME, ''), (RPMTAG_FILEFLAGS, 0), (RPMTAG_FILELINKTOS, ''))
+    columns = [(tags.get(column, []), default) for column, default in columns]
+    for i, basename in enumerate(tags.get(RPMTAG_BASENAMES, [])):
+        mode, dirindex, user, group, flag, linkto = (
+            values[i] if i < len(values) else default for values, default in columns)
+
+        filename = dirnames[dirindex] + basename
+        fs = filename
+        if stat.S_ISLNK(mode):
+            fs = f'{filename} -> {linkto}'
+        out.append(f'{mode:o} {flag:o} {user}:{group} {fs}\n')
+        if filename.startswith('/etc/') or 'bin/' in filename or filename == '/usr/lib/sendmail':
+            xprvs.append(filename)
+    out.append('-Flx:\n')
+
+    def section(key, entries):
+        out.append(f'+{key}:\n')
+        out.extend(f'{entry}\n' for entry in entries)
+        out.append(f'-{key}:\n')
+
+    section('Prv', dependencies['provides'] + xprvs)
+    section('Con', dependencies['conflicts'])
+    section('Req', [entry for entry in dependencies['requires']
+                    if entry != 'this-is-only-for-build-envs' and not (
+                        # Completely disgusting, but maintainers have no interest in fixing,
+                        # see #1153 for more details.
+                        re.search('^installation-images-debuginfodeps.*', name) and
+                        re.search('debuginfo.build', entry))])
+    section('Obs', dependencies['obsoletes'])
+    # ignore boolean dependencies
+    section('Rec', [entry for entry in dependencies['recommends'] if not entry.startswith('(')])
+    section('Sup', dependencies['supplements'])
+    section('Enh', dependencies['enhances'])
+    section('Sug', dependencies['suggests'])
+
+    return ''.join(out)
+
+
+def package_snippet(path):
+    """
+    Return the susetags snippet of an RPM header from the snippet cache next to
+    it or create and cache it. The mirrored headers are named after their
+    hdrmd5 so the cache never needs to be invalidated.
+    """
+    # mark as used
+    os.utime(path, None)
+    cachedir = os.path.join(os.path.dirname(path), '.cache')
+    cachefile = os.path.join(cachedir, CACHE_PREFIX + os.path.basename(path))
+
+    if os.path.exists(cachefile):
+        with open(cachefile, 'r', errors='surrogateescape') as f:
+            out = f.read()
+
+        # Detect corrupt cache file and rebuild.
+        if out and '=Pkg:    ' not in out:
+            return out
+
+        os.unlink(cachefile)
+
+    try:
+        out = package_snippet_create(path)
+    except CorruptPackage:
+        # Needs to be re-mirrored.
+        os.unlink(path)
+        raise CorruptPackage(f'corrupt rpm: {path}')
+
+    os.makedirs(cachedir, exist_ok=True)
+    # Write atomically rather than locking as the content is always the same.
+    with tempfile.NamedTemporaryFile('w', dir=cachedir, delete=False, errors='surrogateescape') as f:
+        f.write(out)
+    os.replace(f.name, cachefile)
+
+    return out
+
+
+def package_name(filename):
+    name = os.path.basename(filename)
+    if re.match(r'^[a-z0-9]{32}-', name):  # repo cache
+        return re.sub(r'^[^-]+-(.*)\.rpm', r'\1', name)
+
+    return re.sub(r'^(.*)-[^-]+-[^-]+.rpm', r'\1', name)
+
+
+def write_susetags(output_directory, directories):
+    """
+    Write the packages and catalog.yml files for the RPM headers within
+    directories like write_repo_susetags_file.pl. Packages in earlier
+    directories take precedence over those of the same name in later ones.
+    """
+    written_names = {}
+    sources = {}
+
+    with open(os.path.join(output_directory, 'packages'), 'w', errors='surrogateescape') as packages:
+        packages.write('=Ver: 2.0\n')
+        for directory in directories:
+            for rpm in sorted(glob.glob(os.path.join(glob.escape(directory), '*.rpm'))):
+                name = package_name(rpm)
+                if name in written_names:
+                    continue
+                written_names[name] = directory
+
+                out = package_snippet(rpm)
+                if not out or '=Pkg:    ' in out:
+                    raise CorruptPackage(f'empty package snippet for: {name}')
+
+                match = re.search(r'=Src: ([^ ]*)', out)
+                if match:
+                    sources[name] = match.group(1)
+                packages.write(out)
+
+    with open(os.path.join(output_directory, 'catalog.yml'), 'w') as catalog:
+        for directory in directories:
+            names = sorted(name for name, written in written_names.items() if written == directory)
+            if not names:
+                continue
+
+            catalog.write(f'{directory}:\n')
+            for name in names:
+                catalog.write(f"  '{name}': '{sources.get(name) or 'unknown'}'\n")
@@ -4,7 +4,7 @@ from lxml import etree as ET
 
 from osclib.comments import CommentAPI
 from osclib.conf import Config
-from osclib.core import get_request_list_with_history, request_age
+from osclib.core import get_request_list_with_history, request_age, request_list_paginated
 from osclib.stagingapi import StagingAPI
 import osc.core
 from urllib.error import HTTPError
@@ -67,14 +67,7 @@ class OBS(plat.base.PlatformBase):
             review = f"@by_user='{review_user}' and @state='new'"
         if review_group:
             review = osc.core.xpath_join(review, f"@by_group='{review_group}' and @state='new'")
-        url = osc.core.makeurl(self.apiurl, ('search', 'request'), {
-                               'match': f"state/@name='review' and review[{review}]", 'withfullhistory': 1})
-        root = ET.parse(osc.core.http_GET(url)).getroot()
-
-        for request in root.findall('request'):
-            req = osc.core.Request()
-            req.read(request)
-            yield req
+        yield from request_list_paginated(self.apiurl, f"state/@name='review' and review[{review}]")
 
     def _has_open_review_by(self, root, by_what, reviewer):
         states = set([review.get('state') for review in root.findall('review') if review.get(by_what) == reviewer])
@@ -1,11 +1,12 @@
 #!/usr/bin/python3
 
+import copy
 import difflib
 import hashlib
+import json
 import logging
 import os
 import os.path
-import subprocess
 import sys
 import tempfile
 import cmdln
@@ -22,10 +23,14 @@ import ToolBase
 from osclib.conf import Config
 from osclib.core import (http_DELETE, http_GET, makeurl,
                          repository_path_expand, repository_path_search,
-                         target_archs, source_file_load, source_file_ensure)
-from osclib.repochecks import mirror, parsed_installcheck, CorruptRepos
+                         target_archs, source_file_load, source_file_save)
+from osclib.repochecks import collapse_followups, mirror, engine_installcheck, write_susetags
 from osclib.comments import CommentAPI
 
+# The rebuild infos grow to several megabytes so prefer libyaml if available.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
 
 class RepoChecker():
     def __init__(self):
@@ -34,6 +39,9 @@ class RepoChecker():
         self.store_package = None
         self.rebuild = None
         self.comment = None
+        self.delta_log = None
+        self.state = None
+        self.stored_state = None
 
     def parse_store(self, project_package):
         if project_package:
@@ -47,6 +55,8 @@ class RepoChecker():
             self.logger.error(f'a repository must be specified via OSRT:Config main-repo for {project}')
             return
         self.repository = repository
+        # The rebuild infos are shared by all architectures of the repository.
+        self.state = None
 
         archs = target_archs(self.apiurl, project, repository)
         if not len(archs):
@@ -137,14 +147,83 @@ class RepoChecker():
 
         return repository
 
+    @staticmethod
+    def problem_hash(problem):
+        """
+        Hash the problem lines of a source regardless of their order. The sum
+        of the line hashes is a digest of the multiset of lines, so that the
+        lines need not be sorted.
+        """
+        digest = 0
+        for line in problem:
+            digest += int.from_bytes(hashlib.sha256(line.encode('utf-8')).digest(), 'big')
+        return digest % (1 << 256)
+
+    @staticmethod
+    def state_changes(old, new):
+        """
+        Compare two rebuild infos and return the changed entries as
+        (section, source, new value) with None for removed entries.
+        """
+        changes = []
+        for section in sorted(set(old) | set(new)):
+            before = old.get(section, {})
+            after = new.get(section, {})
+            if before == after:
+                continue
+            if not isinstance(before, dict) or not isinstance(after, dict):
+                changes.append((section, None, after))
+                continue
+            for source in sorted(set(before) | set(after)):
+                if before.get(source) != after.get(source):
+                    changes.append((section, source, after.get(source)))
+
+        return changes
+
+    def load_yaml(self):
+        if self.state is not None:
+            return self.state
+
+        state = None
+        if self.store_project and self.store_package:
+            state_yaml = source_file_load(self.apiurl, self.store_project, self.store_package,
+                                          self.store_filename)
+            if state_yaml:
+                state = yaml.load(state_yaml, Loader=YAML_LOADER)
+
+        state = state or {}
+        state.setdefault('check', {})
+        if not isinstance(state['check'], dict):
+            state['check'] = {}
+        state.setdefault('leafs', {})
+        if not isinstance(state['leafs'], dict):
+            state['leafs'] = {}
+
+        self.state = state
+        self.stored_state = copy.deepcopy(state)
+        return state
+
     def store_yaml(self, state):
         if not self.store_project or not self.store_package:
             return
 
-        state_yaml = yaml.dump(state, default_flow_style=False)
+        changes = self.state_changes(self.stored_state, state)
+        if not changes:
+            self.logger.debug('Rebuild infos unchanged')
+            return
+
+        state_yaml = yaml.dump(state, default_flow_style=False, Dumper=YAML_DUMPER)
         comment = f'Updated rebuild infos for {self.project}/{self.repository}/{self.arch}'
-        source_file_ensure(self.apiurl, self.store_project, self.store_package,
-                           self.store_filename, state_yaml, comment=comment)
+        source_file_save(self.apiurl, self.store_project, self.store_package,
+                         self.store_filename, state_yaml, comment=comment)
+        self.stored_state = copy.deepcopy(state)
+
+        if self.delta_log:
+            now = str(datetime.now())
+            with open(self.delta_log, 'a') as f:
+                for section, source, value in changes:
+                    f.write(json.dumps({'time': now, 'file': self.store_filename, 'section': section,
+                                        'source': source, 'value': value}) + '\n')
 
     def check_buildstate(self, oldstate, buildresult, code):
         oldstate.setdefault(code, {})
@@ -164,21 +243,8 @@ class RepoChecker():
     def check_pra(self, project, repository, arch):
         config = Config.get(self.apiurl, project)
 
-        oldstate = None
         self.store_filename = f'rebuildpacs.{project}-{repository}.yaml'
-        if self.store_project and self.store_package:
-            state_yaml = source_file_load(self.apiurl, self.store_project, self.store_package,
-                                          self.store_filename)
-            if state_yaml:
-                oldstate = yaml.safe_load(state_yaml)
-
-        oldstate = oldstate or {}
-        oldstate.setdefault('check', {})
-        if not isinstance(oldstate['check'], dict):
-            oldstate['check'] = {}
-        oldstate.setdefault('leafs', {})
-        if not isinstance(oldstate['leafs'], dict):
-            oldstate['leafs'] = {}
+        oldstate = self.load_yaml()
 
         repository_pairs = repository_path_expand(self.apiurl, project, repository)
         directories = []
@@ -194,15 +260,7 @@ class RepoChecker():
         with tempfile.TemporaryDirectory(prefix='repochecker') as dir:
             pfile = os.path.join(dir, 'packages')
 
-            SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
-            script = os.path.join(SCRIPT_PATH, 'write_repo_susetags_file.pl')
-            parts = ['perl', script, dir] + directories
-
-            p = subprocess.run(parts)
-            if p.returncode:
-                # technically only 126, but there is no other value atm -
-                # so if some other perl error happens, we don't continue
-                raise CorruptRepos
+            write_susetags(dir, directories)
 
             target_packages = {}
             with open(os.path.join(dir, 'catalog.yml')) as file:
@@ -210,22 +268,11 @@ class RepoChecker():
                 if catalog is not None:
                     target_packages = catalog.get(directories[0], [])
 
-            parsed = parsed_installcheck([pfile] + primaryxmls, arch, target_packages, [])
-
-        for package in parsed:
-            parsed[package]['output'] = "\n".join(parsed[package]['output'])
-
-        # let's risk a N*N algorithm in the hope that we have a limited N
-        for package1 in parsed:
-            output = parsed[package1]['output']
-            for package2 in parsed:
-                if package1 == package2:
-                    continue
-                output = output.replace(parsed[package2]['output'], 'FOLLOWUP(' + package2 + ')')
-            parsed[package1]['output'] = output
+            parsed = engine_installcheck(pfile, directories, arch, target_packages, [], primaryxmls)
 
-        for package in parsed:
-            parsed[package]['output'] = self._split_and_filter(parsed[package]['output'])
+        outputs = collapse_followups({package: "\n".join(entry['output']) for package, entry in parsed.items()})
+        for package, output in outputs.items():
+            parsed[package]['output'] = self._split_and_filter(output)
 
         url = makeurl(self.apiurl, ['build', project, '_result'], {'repository': repository, 'arch': arch})
         root = ET.parse(http_GET(url)).getroot()
@@ -265,7 +312,7 @@ class RepoChecker():
                     del oldstate['check'][source]
                 continue
             old_output = oldstate['check'].get(source, {}).get('problem', [])
-            if sorted(old_output) == sorted(per_source[source]['output']):
+            if self.problem_hash(old_output) == self.problem_hash(per_source[source]['output']):
                 self.logger.debug("unchanged problem")
                 continue
             self.logger.info("rebuild %s", source)
@@ -370,6 +417,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
         return RepoChecker()
 
     @cmdln.option('--store', help='Project/Package to store the rebuild infos in')
+    @cmdln.option('--delta-log', help='File to append the changes of the rebuild infos to')
     @cmdln.option('-r', '--repo', dest='repo', help='Repository to check')
     @cmdln.option('--add-comments', dest='comments', action='store_true', help='Create comments about issues')
     @cmdln.option('--no-rebuild', dest='norebuild', action='store_true', help='Only track issues, do not rebuild')
@@ -382,6 +430,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
         self.tool.rebuild = not opts.norebuild
         self.tool.comment = opts.comments
         self.tool.parse_store(opts.store)
+        self.tool.delta_log = opts.delta_log
         self.tool.apiurl = conf.config['apiurl']
         self.tool.check(project, opts.repo)
 
@@ -5,6 +5,12 @@ import sys
 import shutil
 import osc.core
 
+from osclib.checkout_cache import checkout_cache
+
+# Check out packages with osc or from the shared checkout cache (see
+# osclib.checkout_cache.CheckoutCache).
+CHECKOUT_BACKEND = os.environ.get('OSRT_CHECKOUT_BACKEND', 'osc')
+
 
 class OSC(scm.base.SCMBase):
     """SCM interface implementation for OSC"""
@@ -23,6 +29,17 @@ class OSC(scm.base.SCMBase):
             pathname,
             **kwargs
     ):
+        if CHECKOUT_BACKEND == 'cache' and set(kwargs) <= {'revision', 'expand_link', 'server_service_files'}:
+            checkout_cache().checkout(
+                self.apiurl,
+                target_project,
+                target_package,
+                os.path.join(pathname, target_package),
+                revision=kwargs.get('revision'),
+                expand_link=bool(kwargs.get('expand_link')),
+                server_service_files=bool(kwargs.get('server_service_files')))
+            return
+
         with open(os.devnull, 'w') as devnull:
             _stdout = sys.stdout
             sys.stdout = devnull
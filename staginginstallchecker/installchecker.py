@@ -2,6 +2,7 @@ import logging
 import os
 import re
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import osc.core
 import yaml
@@ -38,6 +39,8 @@ class InstallChecker(object):
         self.ignore_duplicated = set(config.get('installcheck-ignore-duplicated-binaries', '').split(' '))
         self.ignore_conflicts = set(config.get('installcheck-ignore-conflicts', '').split(' '))
         self.ignore_deletes = str2bool(config.get('installcheck-ignore-deletes', 'False'))
+        # Number of architectures checked concurrently.
+        self.workers = int(config.get('installcheck-workers', 1))
 
     def check_required_by(self, fileinfo, provides, requiredby, built_binaries, comments):
         if requiredby.get('name') in built_binaries:
@@ -190,40 +193,32 @@ class InstallChecker(object):
                 if req.get('type') == 'delete':
                     result = self.check_delete_request(req, to_ignore, to_delete, result_comment) and result
 
-        for arch in architectures:
-            # hit the first repository in the target project (if existant)
-            target_pair = None
-            directories = []
-            for pair_project, pair_repository in repository_pairs:
-                # ignore repositories only inherited for config
-                if repository_arch_state(self.api.apiurl, pair_project, pair_repository, arch):
-                    if not target_pair and pair_project == api.project:
-                        target_pair = [pair_project, pair_repository]
-
-                    directories.append(mirror(self.api.apiurl, pair_project, pair_repository, arch))
-
-            if not api.is_adi_project(project):
-                # For "leaky" ring packages in letter stagings, where the
-                # repository setup does not include the target project, that are
-                # not intended to to have all run-time dependencies satisfied.
-                whitelist = self.ring_whitelist
-            else:
-                whitelist = set()
-
-            whitelist |= to_ignore
-            ignore_conflicts = self.ignore_conflicts | to_ignore
-
-            check = self.cycle_check(project, repository, arch)
-            if not check.success:
-                self.logger.warning('Cycle check failed')
-                result_comment.append(check.comment)
-                result = False
+        if not api.is_adi_project(project):
+            # For "leaky" ring packages in letter stagings, where the
+            # repository setup does not include the target project, that are
+            # not intended to to have all run-time dependencies satisfied.
+            whitelist = self.ring_whitelist | to_ignore
+        else:
+            whitelist = set(to_ignore)
+        ignore_conflicts = self.ignore_conflicts | to_ignore
 
-            check = self.install_check(directories, arch, whitelist, ignore_conflicts)
-            if not check.success:
-                self.logger.warning('Install check failed')
-                result_comment.append(check.comment)
-                result = False
+        def check_arch(arch):
+            return self.arch_installcheck(project, repository, repository_pairs, arch, whitelist, ignore_conflicts)
+
+        if self.workers > 1 and len(architectures) > 1:
+            # The checks are dominated by downloads and the installcheck and
+            # findfileconflicts subprocesses so threads run them concurrently.
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                checks = list(executor.map(check_arch, architectures))
+        else:
+            checks = [check_arch(arch) for arch in architectures]
+
+        # Merge in the order of the architectures regardless of completion order.
+        for arch_checks in checks:
+            for check in arch_checks:
+                if not check.success:
+                    result_comment.append(check.comment)
+                    result = False
 
         duplicates = duplicated_binaries_in_repo(self.api.apiurl, project, repository)
         # remove white listed duplicates
@@ -243,6 +238,35 @@ class InstallChecker(object):
 
         return CheckResult(result, result_comment)
 
+    def arch_installcheck(self, project, repository, repository_pairs, arch, whitelist, ignore_conflicts):
+        """
+        Run the cycle and install check of a single architecture and return
+        their CheckResults.
+        """
+        # hit the first repository in the target project (if existant)
+        target_pair = None
+        directories = []
+        for pair_project, pair_repository in repository_pairs:
+            # ignore repositories only inherited for config
+            if repository_arch_state(self.api.apiurl, pair_project, pair_repository, arch):
+                if not target_pair and pair_project == self.api.project:
+                    target_pair = [pair_project, pair_repository]
+
+                directories.append(mirror(self.api.apiurl, pair_project, pair_repository, arch))
+
+        checks = []
+        check = self.cycle_check(project, repository, arch)
+        if not check.success:
+            self.logger.warning(f'Cycle check failed for {arch}')
+        checks.append(check)
+
+        check = self.install_check(directories, arch, whitelist, ignore_conflicts)
+        if not check.success:
+            self.logger.warning(f'Install check failed for {arch}')
+        checks.append(check)
+
+        return checks
+
     def buildid(self, project, repository, architecture):
         url = self.api.makeurl(['build', project, repository, architecture], {'view': 'status'})
         root = ET.parse(osc.core.http_GET(url)).getroot()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from osclib.abi_dump_cache import AbiDumpCache
+
+
+class TestAbiDumpCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cache = AbiDumpCache(os.path.join(self.tmpdir, 'dumps'))
+
+    def dump(self, name, size):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(name.encode() * size)
+        return path
+
+    def get(self, key):
+        output = os.path.join(self.tmpdir, 'output')
+        if not self.cache.get(key, output):
+            return None
+        with open(output, 'rb') as f:
+            return f.read()
+
+    def test_key(self):
+        key = AbiDumpCache.key('a' * 32, '/usr/lib64/libfoo.so.1', 'x86_64', 1000)
+        self.assertEqual(key, AbiDumpCache.key('a' * 32, '/usr/lib64/libfoo.so.1', 'x86_64', 1000))
+        # A rebuild of the same sources is another build.
+        self.assertNotEqual(key, AbiDumpCache.key('a' * 32, '/usr/lib64/libfoo.so.1', 'x86_64', 1001))
+        self.assertNotEqual(key, AbiDumpCache.key('a' * 32, '/usr/lib64/libfoo.so.1', 'i586', 1000))
+
+    def test_get(self):
+        self.assertIsNone(self.get('a'))
+
+        self.cache.put('a', self.dump('a', 10))
+        self.assertEqual(self.get('a'), b'a' * 10)
+        self.assertIsNone(self.get('b'))
+
+    def test_prune(self):
+        self.cache.size_limit = 2500
+        self.cache.put('a', self.dump('a', 1000))
+        self.cache.put('b', self.dump('b', 1000))
+        os.utime(self.cache.path('b'), (0, 0))
+        # The use of a keeps it over b which was used less recently.
+        os.utime(self.cache.path('a'), (1, 1))
+        self.assertIsNotNone(self.get('a'))
+
+        self.cache.put('c', self.dump('c', 1000))
+        self.assertIsNotNone(self.get('a'))
+        self.assertIsNone(self.get('b'))
+        self.assertIsNotNone(self.get('c'))
+
+    def test_disabled(self):
+        self.cache.size_limit = 0
+        self.cache.put('a', self.dump('a', 10))
+        self.assertIsNone(self.get('a'))
+        self.assertFalse(os.path.exists(self.cache.path('a')))
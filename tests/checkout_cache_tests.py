@@ -0,0 +1,141 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlsplit
+
+from osclib.checkout_cache import CheckoutCache
+
+APIURL = 'https://api.example.com'
+
+
+class SourceServer(object):
+    """Serve the listing and files of package revisions as http_GET would."""
+
+    def __init__(self):
+        self.revisions = {}
+        # revisions which are links expanding to another revision
+        self.links = {}
+        # revisions whose expanded sources including service files are another revision
+        self.expanded = {}
+        self.requested = []
+        # files served with other contents than listed
+        self.corrupt = {}
+
+    def add(self, revision, files):
+        self.revisions[revision] = files
+
+    def __call__(self, url):
+        o = urlsplit(url)
+        path = o.path.split('/')[2:]
+        query = parse_qs(o.query)
+        revision = query['rev'][0]
+        if len(path) == 2 and 'expand' in query:
+            revision = self.expanded[revision]
+        files = self.revisions.get(revision)
+        if files is None:
+            raise HTTPError(url, 404, 'not found', None, None)
+
+        if len(path) == 2:
+            entries = ''.join(f'<entry name="{name}" md5="{hashlib.md5(text).hexdigest()}" size="{len(text)}"/>'
+                              for name, text in files.items())
+            if revision in self.links:
+                entries += f'<linkinfo project="openSUSE:Factory" package="kernel-source" xsrcmd5="{self.links[revision]}"/>'
+            return BytesIO(f'<directory srcmd5="{revision}">{entries}</directory>'.encode())
+
+        self.requested.append(path[2])
+        return BytesIO(self.corrupt.get(path[2], files[path[2]]))
+
+
+class TestCheckoutCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        self.server = SourceServer()
+        patcher = mock.patch('osclib.checkout_cache.http_GET', self.server)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cache = CheckoutCache(os.path.join(self.tmpdir, 'cache'))
+
+    def checkout(self, revision, name, **kwargs):
+        directory = os.path.join(self.tmpdir, name)
+        self.cache.checkout(APIURL, 'openSUSE:Factory', 'kernel-source', directory, revision, **kwargs)
+        files = {}
+        for filename in os.listdir(directory):
+            with open(os.path.join(directory, filename), 'rb') as f:
+                files[filename] = f.read()
+        return files
+
+    def test_checkout(self):
+        files = {'kernel-source.spec': b'Name: kernel-source\n', 'linux.tar.xz': b'x' * 1000}
+        self.server.add('1', files)
+        self.assertEqual(self.checkout('1', 'a'), files)
+        self.assertEqual(sorted(self.server.requested), sorted(files))
+
+        # Only the changed file is downloaded for the next revision.
+        self.server.requested = []
+        files = dict(files, **{'kernel-source.spec': b'Name: kernel-source\nVersion: 2\n'})
+        self.server.add('2', files)
+        self.assertEqual(self.checkout('2', 'b'), files)
+        self.assertEqual(self.server.requested, ['kernel-source.spec'])
+
+    def test_expand(self):
+        self.server.add('1', {'_link': b'<link/>', '_service': b'<services/>'})
+        self.server.add('x1', {'kernel-source.spec': b'Name: kernel-source\n', '_service': b'<services/>'})
+        self.server.add('e1', {'kernel-source.spec': b'Name: kernel-source\n', 'linux.tar.xz': b'x'})
+        self.server.links['1'] = 'x1'
+        self.server.expanded['1'] = 'e1'
+
+        self.assertEqual(sorted(self.checkout('1', 'a')), ['_link', '_service'])
+        # Only the link is expanded, the service files are not.
+        self.assertEqual(sorted(self.checkout('1', 'b', expand_link=True)), ['_service', 'kernel-source.spec'])
+        self.assertEqual(sorted(self.checkout('1', 'c', expand_link=True, server_service_files=True)),
+                         ['kernel-source.spec', 'linux.tar.xz'])
+
+    def test_modified(self):
+        files = {'kernel-source.spec': b'Name: kernel-source\n'}
+        self.server.add('1', files)
+        self.cache.reflink = False
+        self.checkout('1', 'a')
+
+        # Written in place through the hardlink regardless of the permissions.
+        path = os.path.join(self.tmpdir, 'a', 'kernel-source.spec')
+        os.chmod(path, 0o644)
+        with open(path, 'r+b') as f:
+            f.write(b'Name: kernel-sourcf\n')
+
+        self.server.requested = []
+        self.assertEqual(self.checkout('1', 'b'), files)
+        self.assertEqual(self.server.requested, ['kernel-source.spec'])
+
+    def test_corrupt(self):
+        self.server.add('1', {'a': b'a'})
+        self.server.corrupt['a'] = b'b'
+
+        with self.assertRaises(ValueError):
+            self.checkout('1', 'a')
+        self.assertEqual(os.listdir(os.path.dirname(self.cache.path(hashlib.md5(b'a').hexdigest()))), [])
+
+    def test_missing(self):
+        with self.assertRaises(HTTPError):
+            self.checkout('1', 'a')
+
+    def test_prune(self):
+        self.cache.size_limit = 2500
+        self.server.add('1', {'a': b'a' * 1000, 'b': b'b' * 1000})
+        self.server.add('2', {'b': b'b' * 1000, 'c': b'c' * 1000})
+        self.checkout('1', 'a')
+        os.utime(self.cache.path(hashlib.md5(b'a' * 1000).hexdigest()), (0, 0))
+        self.checkout('2', 'b')
+
+        self.assertFalse(os.path.exists(self.cache.path(hashlib.md5(b'a' * 1000).hexdigest())))
+        self.assertTrue(os.path.exists(self.cache.path(hashlib.md5(b'c' * 1000).hexdigest())))
+        # The working tree is not affected by the eviction.
+        with open(os.path.join(self.tmpdir, 'a', 'a'), 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 1000)
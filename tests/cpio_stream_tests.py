@@ -0,0 +1,75 @@
+import unittest
+from io import BytesIO
+
+from osclib.cpio_stream import CpioError
+from osclib.cpio_stream import CpioStream
+
+
+def cpio_member(name, data, mode=0o100644):
+    """Build a newc cpio member padded to 4 bytes like rpm2cpio does."""
+    name = name.encode() + b'\0'
+    fields = [0, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0]
+    header = b'070701' + b''.join(b'%08x' % field for field in fields)
+    out = header + name
+    out += b'\0' * ((4 - len(out) % 4) % 4)
+    out += data
+    out += b'\0' * ((4 - len(data) % 4) % 4)
+    return out
+
+
+def cpio_archive(members):
+    return b''.join(cpio_member(name, data) for name, data in members) + cpio_member('TRAILER!!!', b'', mode=0)
+
+
+class ShortReads(BytesIO):
+    """Return at most a few bytes per read like a pipe may."""
+
+    def read(self, size=-1):
+        return super(ShortReads, self).read(min(size, 3) if size >= 0 else 3)
+
+
+class TestCpioStream(unittest.TestCase):
+    MEMBERS = [
+        ('./usr/lib64/libfoo.so.1', b'library'),
+        ('./usr/share/doc/foo/README', b'a' * 10),
+        ('./usr/lib/debug/usr/lib64/libfoo.so.1.debug', b'debug!'),
+        ('./empty', b''),
+    ]
+
+    def test_members(self):
+        cpio = CpioStream(BytesIO(cpio_archive(self.MEMBERS)))
+        self.assertEqual([(name, size) for name, mode, size in cpio],
+                         [(name.encode(), len(data)) for name, data in self.MEMBERS])
+
+    def test_copy(self):
+        for fh in (BytesIO, ShortReads):
+            cpio = CpioStream(fh(cpio_archive(self.MEMBERS)))
+            copied = {}
+            for name, mode, size in cpio:
+                # Only copy some members, the others are skipped including their padding.
+                if name.endswith(b'.so.1') or name.endswith(b'.debug'):
+                    out = BytesIO()
+                    cpio.copy(out)
+                    copied[name] = out.getvalue()
+
+            self.assertEqual(copied, {
+                b'./usr/lib64/libfoo.so.1': b'library',
+                b'./usr/lib/debug/usr/lib64/libfoo.so.1.debug': b'debug!',
+            })
+
+    def test_trailer(self):
+        # Anything following the trailer is not read.
+        archive = cpio_archive(self.MEMBERS[:1]) + b'garbage'
+        fh = BytesIO(archive)
+        self.assertEqual(len(list(CpioStream(fh))), 1)
+        self.assertEqual(fh.read(), b'garbage')
+
+    def test_truncated(self):
+        archive = cpio_archive(self.MEMBERS)
+        for end in (len(cpio_member(*self.MEMBERS[0])) - 2, len(archive) - 50):
+            with self.assertRaises(CpioError):
+                list(CpioStream(BytesIO(archive[:end])))
+
+    def test_invalid(self):
+        with self.assertRaises(CpioError):
+            list(CpioStream(BytesIO(b'x' * 200)))
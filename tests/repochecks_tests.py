@@ -0,0 +1,235 @@
+import os
+import random
+import shutil
+import solv
+import subprocess
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from osclib import repochecks
+from osclib.repochecks import collapse_followups
+
+from .susetags_tests import RPMSENSE_EQUAL, RPMSENSE_GREATER, rpm_write
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# Problems of the staging packages of TestInstallcheck as reported by either engine.
+INSTALLCHECK_PROBLEMS = {
+    'app': {'problem': 'app-1.0-1.1.x86_64', 'source': 'app', 'output': [
+        'package app-1.0.x86_64 requires libfoo.so.1, but none of the providers can be installed',
+        'nothing provides bar needed by libfoo-1.0.x86_64',
+    ]},
+    'libfoo': {'problem': 'libfoo-1.0-1.1.x86_64', 'source': 'foo', 'output': [
+        'nothing provides bar needed by libfoo-1.0.x86_64',
+    ]},
+    'tool': {'problem': 'tool-1.0-1.1.x86_64', 'source': 'tool', 'output': [
+        'nothing provides libbaz >= 2 needed by tool-1.0.x86_64',
+        '  (we have libbaz-1.0-1.1.x86_64)',
+    ]},
+}
+
+
+def collapse_followups_reference(outputs):
+    """The N*N loop collapse_followups() replaced in project-installcheck."""
+    outputs = dict(outputs)
+    for package1 in outputs:
+        output = outputs[package1]
+        for package2 in outputs:
+            if package1 == package2:
+                continue
+            output = output.replace(outputs[package2], 'FOLLOWUP(' + package2 + ')')
+        outputs[package1] = output
+
+    return outputs
+
+
+def installcheck_outputs(count, seed=42):
+    """
+    Generate the joined installcheck output of count failing binaries. A few
+    core libraries miss a dependency, which breaks the libraries requiring
+    them and in turn the applications requiring those.
+    """
+    rng = random.Random(seed)
+
+    def requires(package, dependency):
+        return f'package {package}-1.0-1.1.x86_64 requires {dependency}, but none of the providers can be installed'
+
+    outputs = {}
+    cores = [f'libcore{i}' for i in range(max(1, count // 500))]
+    for core in cores:
+        outputs[core] = f'nothing provides {core}-data needed by {core}-1.0-1.1.x86_64'
+
+    libraries = [f'lib{i}' for i in range(max(1, count // 10))]
+    for library in libraries:
+        core = rng.choice(cores)
+        outputs[library] = '\n'.join([requires(library, core + '.so.1'), outputs[core]])
+
+    while len(outputs) < count:
+        application = f'app{len(outputs)}'
+        lines = []
+        for library in rng.sample(libraries, rng.randint(1, 3)):
+            lines.append(requires(application, library + '.so.1'))
+            lines.append(outputs[library])
+        if rng.random() < 0.1:
+            lines.append(f'  (we have {application}-data-0.9-1.1.noarch)')
+        outputs[application] = '\n'.join(lines)
+
+    # Include the edge cases of the plain replacement.
+    outputs['short'] = 'lib0'
+    outputs['empty'] = ''
+
+    packages = list(outputs)
+    rng.shuffle(packages)
+    return {package: outputs[package] for package in packages}
+
+
+class TestCollapseFollowups(unittest.TestCase):
+    def test_followup(self):
+        outputs = {
+            'app': 'package app requires libfoo, but none of the providers can be installed\n'
+                   'nothing provides bar needed by libfoo',
+            'libfoo': 'nothing provides bar needed by libfoo',
+        }
+        self.assertEqual(collapse_followups(outputs), {
+            'app': 'package app requires libfoo, but none of the providers can be installed\nFOLLOWUP(libfoo)',
+            'libfoo': 'nothing provides bar needed by libfoo',
+        })
+
+    def test_reference(self):
+        for seed in range(5):
+            outputs = installcheck_outputs(300, seed)
+            outputs.pop('empty')
+            self.assertEqual(collapse_followups(outputs), collapse_followups_reference(outputs))
+
+    def test_reference_empty(self):
+        outputs = installcheck_outputs(50)
+        self.assertEqual(collapse_followups(outputs), collapse_followups_reference(outputs))
+
+    @unittest.skipUnless(os.environ.get('OSRT_BENCHMARK'), 'set OSRT_BENCHMARK to run')
+    def test_benchmark(self):
+        outputs = installcheck_outputs(4000)
+        outputs.pop('empty')
+
+        start = time.perf_counter()
+        expected = collapse_followups_reference(outputs)
+        reference = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = collapse_followups(outputs)
+        indexed = time.perf_counter() - start
+
+        print(f'\n{len(outputs)} failing binaries: reference {reference:.2f}s, indexed {indexed:.2f}s')
+        self.assertEqual(actual, expected)
+        self.assertLess(indexed, reference)
+
+
+SUSETAGS = hasattr(solv.Repo, 'add_susetags')
+
+
+@unittest.skipUnless(SUSETAGS, 'libsolv built without susetags support')
+class TestSolvFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        rpm_write(self.directory, 'a' * 32, 'glibc')
+
+        patcher = mock.patch.dict(os.environ, {'OSRT_SUSETAGS_WRITER': 'python'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reuse(self):
+        path = repochecks.solv_file(self.directory)
+        with mock.patch('osclib.repochecks.write_susetags') as write_susetags:
+            self.assertEqual(repochecks.solv_file(self.directory), path)
+        write_susetags.assert_not_called()
+
+    def test_prune(self):
+        recent = repochecks.solv_file(self.directory)
+        rpm_write(self.directory, 'b' * 32, 'blowfish')
+        outdated = repochecks.solv_file(self.directory)
+        # Files of outdated states are kept while possibly still in use.
+        self.assertTrue(os.path.exists(recent))
+
+        os.utime(outdated, (0, 0))
+        rpm_write(self.directory, 'c' * 32, 'bash')
+        path = repochecks.solv_file(self.directory)
+        self.assertFalse(os.path.exists(outdated))
+        self.assertTrue(os.path.exists(recent))
+        self.assertTrue(os.path.exists(path))
+
+    def test_pruned_before_use(self):
+        path = repochecks.solv_file(self.directory)
+        solv_file = repochecks.solv_file
+        lookups = []
+
+        def solv_file_pruned(directory):
+            lookups.append(directory)
+            if len(lookups) == 1:
+                # Removed by another process right after the lookup.
+                os.unlink(path)
+                return path
+            return solv_file(directory)
+
+        with mock.patch('osclib.repochecks.solv_file', solv_file_pruned):
+            pool = repochecks.solv_pool([self.directory], 'x86_64')
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual([solvable.name for solvable in pool.solvables_iter()], ['glibc'])
+
+
+class TestInstallcheck(unittest.TestCase):
+    TARGET_PACKAGES = {'app': 'app', 'libfoo': 'foo', 'tool': 'tool', 'ignored': 'ignored', 'ok': 'ok'}
+    WHITELIST = ['ignored']
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.staging = os.path.join(self.tmpdir, 'staging')
+        self.base = os.path.join(self.tmpdir, 'base')
+        os.makedirs(self.staging)
+        os.makedirs(self.base)
+
+        rpm_write(self.staging, 'a' * 32, 'app', requires=[('libfoo.so.1', 0, '')])
+        rpm_write(self.staging, 'b' * 32, 'libfoo', provides=[('libfoo.so.1', 0, '')], requires=[('bar', 0, '')])
+        rpm_write(self.staging, 'c' * 32, 'tool', requires=[('libbaz', RPMSENSE_GREATER | RPMSENSE_EQUAL, '2')])
+        rpm_write(self.staging, 'd' * 32, 'ignored', requires=[('missing', 0, '')])
+        rpm_write(self.staging, 'e' * 32, 'ok', requires=[('libbaz', 0, '')])
+        rpm_write(self.base, 'f' * 32, 'libbaz', provides=[('libbaz', RPMSENSE_EQUAL, '1.0-1.1')])
+        # Not a target package so not reported.
+        rpm_write(self.base, '0' * 32, 'broken', requires=[('gone', 0, '')])
+
+        patcher = mock.patch.dict(os.environ, {'OSRT_SUSETAGS_WRITER': 'python'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def installcheck(self, engine):
+        pfile = os.path.join(self.tmpdir, 'packages')
+        if engine == 'installcheck':
+            repochecks.write_susetags(self.tmpdir, [self.staging, self.base])
+
+        with mock.patch.dict(os.environ, {'OSRT_INSTALLCHECK_ENGINE': engine}):
+            return repochecks.engine_installcheck(
+                pfile, [self.staging, self.base], 'x86_64', self.TARGET_PACKAGES, self.WHITELIST)
+
+    def test_parsed_installcheck(self):
+        # Output of /usr/bin/installcheck for the packages file of the repositories.
+        with open(os.path.join(FIXTURES, 'installcheck', 'installcheck.out')) as f:
+            output = f.read()
+
+        with mock.patch('subprocess.run', return_value=subprocess.CompletedProcess([], 1, output)) as run:
+            self.assertEqual(self.installcheck('installcheck'), INSTALLCHECK_PROBLEMS)
+        self.assertEqual(run.call_args[0][0][:2], ['/usr/bin/installcheck', 'x86_64'])
+
+    @unittest.skipUnless(SUSETAGS, 'libsolv built without susetags support')
+    def test_solv_installcheck(self):
+        self.assertEqual(self.installcheck('solv'), INSTALLCHECK_PROBLEMS)
+
+    @unittest.skipUnless(SUSETAGS and os.path.exists('/usr/bin/installcheck'), 'installcheck not available')
+    def test_compare_installcheck(self):
+        self.assertEqual(self.installcheck('solv'), self.installcheck('installcheck'))
+
+    def test_collapse_followups(self):
+        outputs = {package: '\n'.join(problem['output']) for package, problem in INSTALLCHECK_PROBLEMS.items()}
+        self.assertEqual(collapse_followups(outputs)['app'],
+                         'package app-1.0.x86_64 requires libfoo.so.1, but none of the providers can be installed\n'
+                         'FOLLOWUP(libfoo)')
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from osclib.source_hash_index import SourceHashIndex
+
+APIURL = 'https://api.example.com'
+
+
+class TestSourceHashIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'index.sqlite')
+
+    def test_lookup(self):
+        index = SourceHashIndex(self.filename)
+        index.add(APIURL, 'openSUSE:Factory', 'osc', 'a' * 32, 'hash-a')
+        # Pending entries are found before being written.
+        self.assertEqual(index.lookup(APIURL, 'openSUSE:Factory', 'osc', ['a' * 32, 'b' * 32]), {'a' * 32: 'hash-a'})
+        index.flush()
+
+        index = SourceHashIndex(self.filename)
+        self.assertEqual(index.lookup(APIURL, 'openSUSE:Factory', 'osc', ['a' * 32, 'b' * 32]), {'a' * 32: 'hash-a'})
+        self.assertEqual(index.lookup(APIURL, 'openSUSE:Leap', 'osc', ['a' * 32]), {})
+        self.assertEqual(index.lookup('https://api.example.org', 'openSUSE:Factory', 'osc', ['a' * 32]), {})
+
+    def test_batch(self):
+        index = SourceHashIndex(self.filename)
+        srcmd5s = [f'{i:032x}' for i in range(index.BATCH + index.LOOKUP_CHUNK)]
+        for srcmd5 in srcmd5s:
+            index.add(APIURL, 'openSUSE:Factory', 'osc', srcmd5, 'hash-' + srcmd5)
+        self.assertLess(len(index.pending), index.BATCH)
+        index.flush()
+
+        found = SourceHashIndex(self.filename).lookup(APIURL, 'openSUSE:Factory', 'osc', srcmd5s)
+        self.assertEqual(found, {srcmd5: 'hash-' + srcmd5 for srcmd5 in srcmd5s})
+
+    def test_not_indexable(self):
+        index = SourceHashIndex(self.filename)
+        index.add(APIURL, 'openSUSE:Factory', 'osc', '5', 'hash-5')
+        index.add(APIURL, 'openSUSE:Factory', 'osc', 'a' * 32, None)
+        self.assertEqual(index.pending, {})
+        self.assertEqual(index.lookup(APIURL, 'openSUSE:Factory', 'osc', ['5', 'a' * 32]), {})
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from osclib.checkout_cache import CheckoutCache
+from osclib.source_tree import SourceTree
+
+
+class TestSourceTree(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def tree(self, name, files):
+        directory = os.path.join(self.tmpdir, name)
+        os.makedirs(directory)
+        for filename, text in files.items():
+            with open(os.path.join(directory, filename), 'w') as f:
+                f.write(text)
+        return SourceTree(directory)
+
+    def test_missing(self):
+        tree = SourceTree(os.path.join(self.tmpdir, '_old'))
+        self.assertFalse(tree.present)
+        self.assertFalse(tree.exists('foo.spec'))
+        self.assertEqual(tree.mentioned_sources(['foo.spec']), set())
+
+    def test_glob(self):
+        tree = self.tree('foo', {'foo.spec': '', '.hidden.spec': '', 'a.patch': '', 'b.dif': '', 'c.diff.sig': ''})
+        self.assertEqual(tree.glob('*.spec'), ['foo.spec'])
+        self.assertEqual(tree.glob('.*.spec'), ['.hidden.spec'])
+        self.assertEqual(tree.patches(), {'a.patch', 'b.dif'})
+
+    def test_same(self):
+        old = self.tree('_old', {'foo.changes': 'a\n', 'bar.changes': 'a\n', 'baz.changes': 'a\n'})
+        new = self.tree('foo', {'foo.changes': 'a\n', 'bar.changes': 'b\n', 'baz.changes': 'a\r\n'})
+        self.assertTrue(new.same(old, 'foo.changes'))
+        self.assertFalse(new.same(old, 'bar.changes'))
+        # Compared byte wise like cmp even though the text is the same.
+        self.assertFalse(new.same(old, 'baz.changes'))
+        self.assertFalse(new.same(old, 'missing.changes'))
+
+    def test_lines(self):
+        tree = self.tree('foo', {'foo.changes': 'a\x0cb\nc'})
+        self.assertEqual(tree.lines('foo.changes'), ['a\x0cb\n', 'c'])
+
+    def test_spec_sources(self):
+        tree = self.tree('foo', {'foo.spec': 'Name: foo\nSource0 : https://example.com/foo.tar.gz\nSource1:foo.keyring\n'})
+        self.assertEqual(tree.spec_sources('foo.spec'), [
+            (1, 'Source0 ', 'https://example.com/foo.tar.gz'),
+            (2, 'Source1', 'foo.keyring'),
+        ])
+        self.assertEqual(tree.mentioned_sources(['foo.spec', 'bar.spec']),
+                         {'https://example.com/foo.tar.gz', 'foo.keyring'})
+
+        tree.write('foo.spec', 'Name: foo\n')
+        self.assertEqual(tree.mentioned_sources(['foo.spec']), set())
+        with open(tree.path('foo.spec')) as f:
+            self.assertEqual(f.read(), 'Name: foo\n')
+
+    def test_remove(self):
+        tree = self.tree('foo', {'_service': '<services/>'})
+        tree.remove('_service')
+        self.assertFalse(tree.exists('_service'))
+        self.assertFalse(os.path.exists(tree.path('_service')))
+
+    def test_write_checkout_cache(self):
+        spec = b'Name: foo\nSource: https://example.com/foo.tar.gz\n'
+        md5 = hashlib.md5(spec).hexdigest()
+
+        def http_GET(url):
+            if 'foo.spec' in url:
+                return BytesIO(spec)
+            return BytesIO(f'<directory srcmd5="1"><entry name="foo.spec" md5="{md5}"/></directory>'.encode())
+
+        cache = CheckoutCache(os.path.join(self.tmpdir, 'cache'))
+        # Populate the working tree by hardlink.
+        cache.reflink = False
+        directory = os.path.join(self.tmpdir, 'foo')
+        with mock.patch('osclib.checkout_cache.http_GET', http_GET):
+            cache.checkout('https://api.example.com', 'openSUSE:Factory', 'foo', directory, '1')
+        self.assertTrue(os.path.samefile(cache.path(md5), os.path.join(directory, 'foo.spec')))
+
+        tree = SourceTree(directory)
+        tree.write('foo.spec', 'Name: foo\nSource: foo.tar.gz\n')
+
+        with open(cache.path(md5), 'rb') as f:
+            self.assertEqual(f.read(), spec)
+        with open(tree.path('foo.spec')) as f:
+            self.assertEqual(f.read(), 'Name: foo\nSource: foo.tar.gz\n')
+        self.assertEqual(os.listdir(directory), ['foo.spec'])
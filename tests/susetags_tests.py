@@ -0,0 +1,213 @@
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+
+import yaml
+
+from osclib import susetags
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PERL_BUILD = '/usr/lib/build/Build/Rpm.pm'
+# packages file of the test repositories as written by write_repo_susetags_file.pl
+PACKAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'susetags', 'packages')
+
+RPMSENSE_LESS = 2
+RPMSENSE_GREATER = 4
+RPMSENSE_EQUAL = 8
+
+RPM_INT16 = 3
+RPM_INT32 = 4
+RPM_STRING = 6
+RPM_STRING_ARRAY = 8
+
+
+def rpm_header(tags):
+    """Build an RPM header structure from {tag: (type, value)}."""
+    index = b''
+    store = b''
+    for tag, (kind, value) in sorted(tags.items()):
+        if kind == RPM_INT16:
+            store += b'\0' * (len(store) % 2)
+            data = struct.pack(f'>{len(value)}H', *value)
+        elif kind == RPM_INT32:
+            store += b'\0' * ((4 - len(store) % 4) % 4)
+            data = struct.pack(f'>{len(value)}I', *value)
+        elif kind == RPM_STRING:
+            data = value.encode() + b'\0'
+            value = [value]
+        else:
+            data = b''.join(v.encode() + b'\0' for v in value)
+        index += struct.pack('>iiii', tag, kind, len(store), len(value))
+        store += data
+
+    return susetags.RPM_HEADER_MAGIC + b'\0' * 4 + struct.pack('>II', len(tags), len(store)) + index + store
+
+
+def rpm_write(directory, hdrmd5, name, version='1.0', release='1.1', arch='x86_64',
+              files=(), provides=(), requires=(), recommends=(), disturl=None):
+    """Write a header only RPM as mirrored by RepoMirror and return its path."""
+    tags = {
+        susetags.RPMTAG_NAME: (RPM_STRING, name),
+        susetags.RPMTAG_VERSION: (RPM_STRING, version),
+        susetags.RPMTAG_RELEASE: (RPM_STRING, release),
+        susetags.RPMTAG_ARCH: (RPM_STRING, arch),
+        susetags.RPMTAG_SOURCERPM: (RPM_STRING, f'{name}-{version}-{release}.src.rpm'),
+    }
+    if disturl:
+        tags[susetags.RPMTAG_DISTURL] = (RPM_STRING, disturl)
+
+    if files:
+        dirnames = sorted({os.path.dirname(f[0]) + '/' for f in files})
+        tags[susetags.RPMTAG_BASENAMES] = (RPM_STRING_ARRAY, [os.path.basename(f[0]) for f in files])
+        tags[susetags.RPMTAG_DIRNAMES] = (RPM_STRING_ARRAY, dirnames)
+        tags[susetags.RPMTAG_DIRINDEXES] = (RPM_INT32, [dirnames.index(os.path.dirname(f[0]) + '/') for f in files])
+        tags[susetags.RPMTAG_FILEMODES] = (RPM_INT16, [f[1] for f in files])
+        tags[susetags.RPMTAG_FILEFLAGS] = (RPM_INT32, [0o21 if f[0].startswith('/etc/') else 0 for f in files])
+        tags[susetags.RPMTAG_FILEUSERNAME] = (RPM_STRING_ARRAY, ['root'] * len(files))
+        tags[susetags.RPMTAG_FILEGROUPNAME] = (RPM_STRING_ARRAY, ['root'] * len(files))
+        tags[susetags.RPMTAG_FILELINKTOS] = (RPM_STRING_ARRAY, [f[2] if len(f) > 2 else '' for f in files])
+
+    for key, entries in (('provides', provides), ('requires', requires), ('recommends', recommends)):
+        if not entries:
+            continue
+        name_tag, flags_tag, version_tag = susetags.DEPENDENCIES[key]
+        tags[name_tag] = (RPM_STRING_ARRAY, [e[0] for e in entries])
+        tags[flags_tag] = (RPM_INT32, [e[1] for e in entries])
+        tags[version_tag] = (RPM_STRING_ARRAY, [e[2] for e in entries])
+
+    # Lead with signature type 5 followed by an empty signature header.
+    lead = susetags.RPM_LEAD_MAGIC + b'\0' * 74 + struct.pack('>H', 5) + b'\0' * 16
+    signature = susetags.RPM_HEADER_MAGIC + b'\0' * 12
+
+    path = os.path.join(directory, f'{hdrmd5}-{name}.rpm')
+    with open(path, 'wb') as f:
+        f.write(lead + signature + rpm_header(tags))
+    return path
+
+
+class TestSusetags(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        self.staging = os.path.join(self.tmpdir, 'staging')
+        self.base = os.path.join(self.tmpdir, 'base')
+        os.makedirs(self.staging)
+        os.makedirs(self.base)
+
+        rpm_write(self.staging, 'a' * 32, 'blowfish', arch='i686',
+                  disturl='obs://build.opensuse.org/openSUSE:Factory/standard/' + 'f' * 32 + '-blowfish:tools',
+                  files=[('/etc/blowfish.conf', 0o100644),
+                         ('/usr/bin/blowfish', 0o100755),
+                         ('/usr/lib/libblowfish.so', 0o120777, 'libblowfish.so.1')],
+                  provides=[('blowfish', RPMSENSE_EQUAL, '1.0-1.1')],
+                  requires=[('libc.so.6', 0, ''), ('this-is-only-for-build-envs', 0, ''),
+                            ('grep', RPMSENSE_GREATER | RPMSENSE_EQUAL, '3')],
+                  recommends=[('(foo if bar)', 0, ''), ('sed', RPMSENSE_LESS, '5')])
+        rpm_write(self.base, 'b' * 32, 'blowfish', version='0.9')
+        rpm_write(self.base, 'c' * 32, 'glibc')
+
+    def test_snippet(self):
+        path = os.path.join(self.staging, 'a' * 32 + '-blowfish.rpm')
+        self.assertEqual(susetags.package_snippet(path), '\n'.join([
+            '=Pkg: blowfish 1.0 1.1 i586',
+            '+Flx:',
+            '=Src: blowfish:tools 1.0 1.1 src',
+            '100644 21 root:root /etc/blowfish.conf',
+            '100755 0 root:root /usr/bin/blowfish',
+            '120777 0 root:root /usr/lib/libblowfish.so -> libblowfish.so.1',
+            '-Flx:',
+            '+Prv:',
+            'blowfish = 1.0-1.1',
+            '/etc/blowfish.conf',
+            '/usr/bin/blowfish',
+            '-Prv:',
+            '+Con:',
+            '-Con:',
+            '+Req:',
+            'libc.so.6',
+            'grep >= 3',
+            '-Req:',
+            '+Obs:',
+            '-Obs:',
+            '+Rec:',
+            'sed < 5',
+            '-Rec:',
+            '+Sup:',
+            '-Sup:',
+            '+Enh:',
+            '-Enh:',
+            '+Sug:',
+            '-Sug:',
+            '',
+        ]))
+
+    def test_snippet_cache(self):
+        path = os.path.join(self.base, 'c' * 32 + '-glibc.rpm')
+        snippet = susetags.package_snippet(path)
+
+        cachefile = os.path.join(self.base, '.cache', '2-' + os.path.basename(path))
+        self.assertTrue(os.path.exists(cachefile))
+
+        # The header is no longer parsed once cached.
+        with open(path, 'wb') as f:
+            f.write(b'corrupt')
+        self.assertEqual(susetags.package_snippet(path), snippet)
+
+    def test_corrupt(self):
+        path = os.path.join(self.base, 'd' * 32 + '-corrupt.rpm')
+        with open(path, 'wb') as f:
+            f.write(b'corrupt')
+
+        with self.assertRaises(susetags.CorruptPackage):
+            susetags.write_susetags(self.tmpdir, [self.base])
+        self.assertFalse(os.path.exists(path))
+
+    def test_write_susetags(self):
+        susetags.write_susetags(self.tmpdir, [self.staging, self.base])
+
+        with open(os.path.join(self.tmpdir, 'packages')) as f:
+            packages = f.read()
+        with open(PACKAGES) as f:
+            self.assertEqual(packages, f.read())
+
+        with open(os.path.join(self.tmpdir, 'catalog.yml')) as f:
+            catalog = yaml.safe_load(f)
+        self.assertEqual(catalog, {
+            self.staging: {'blowfish': 'blowfish:tools'},
+            self.base: {'glibc': 'glibc'},
+        })
+
+    @unittest.skipUnless(os.path.exists(PERL_BUILD), 'perl Build module not available')
+    def test_compare_perl(self):
+        directories = [self.staging, self.base]
+        perl = os.path.join(self.tmpdir, 'perl')
+        native = os.path.join(self.tmpdir, 'native')
+        os.makedirs(perl)
+        os.makedirs(native)
+
+        script = os.path.join(PROJECT_ROOT, 'write_repo_susetags_file.pl')
+        subprocess.run(['perl', script, perl] + directories, check=True)
+        # Ensure the snippets are created rather than read from the perl cache.
+        for directory in directories:
+            shutil.rmtree(os.path.join(directory, '.cache'))
+        susetags.write_susetags(native, directories)
+
+        with open(os.path.join(perl, 'packages')) as f:
+            with open(PACKAGES) as fixture:
+                self.assertEqual(f.read(), fixture.read())
+
+        for filename in ('packages', 'catalog.yml'):
+            with open(os.path.join(perl, filename)) as f:
+                expected = f.read()
+            with open(os.path.join(native, filename)) as f:
+                actual = f.read()
+
+            if filename == 'catalog.yml':
+                # perl writes the packages of a directory in hash order.
+                expected = yaml.safe_load(expected)
+                actual = yaml.safe_load(actual)
+            self.assertEqual(expected, actual)